@@ -0,0 +1,350 @@
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+import numpy as np
+from collections.abc import Callable
+from dataclasses import dataclass, replace
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from colour_rendering.temp_to_rgb import temp_to_rgb, temps_to_rgb
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import COMPONENTS, COMPONENT_NAMES, component_parameters, scaled_config
+from spiral_galaxy_components.config import default_config
+
+RESULTS_FORMAT = 'galaxy-benchmarks 1'
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baseline.json')
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+# Times below this are dominated by fixed overheads and left out of the scaling fits
+MIN_FIT_SECONDS = 1e-3
+
+
+@dataclass(frozen=True)
+class Benchmark:
+
+    """
+    One benchmark: setup(n) builds whatever the timed call needs for about n stars, run(state)
+    is the timed call and returns the number of stars it actually handled. run() must leave the
+    state fit to run again.
+    """
+
+    name: str
+    sizes: tuple[int, ...] # Star counts of the full sweep, the quick sweep drops the largest
+    setup: Callable[[int], object]
+    run: Callable[[object], int]
+
+
+# ---------- Headless open3d ----------
+
+class HeadlessVisualizer:
+
+    """Stands in for open3d's Visualizer: accepts geometry and returns at once instead of opening a window."""
+
+    def create_window(self, *args, **kwargs) -> None:
+        pass
+
+    def get_render_option(self) -> types.SimpleNamespace:
+        return types.SimpleNamespace()
+
+    def add_geometry(self, geometry, *args) -> None:
+        pass
+
+    def run(self) -> None:
+        pass
+
+    def destroy_window(self) -> None:
+        pass
+
+
+def headless_render():
+    """
+    Import render.py with its window stubbed out. When open3d is not installed a minimal module
+    takes its place, whose point clouds copy their points into float64 arrays as open3d does.
+    """
+    try:
+        import open3d
+    except ImportError:
+        class PointCloud:
+            points = None
+            colors = None
+
+        stub = types.ModuleType('open3d')
+        stub.geometry = types.SimpleNamespace(PointCloud=PointCloud)
+        stub.utility = types.SimpleNamespace(Vector3dVector=lambda values: np.array(values, dtype=np.float64))
+        stub.visualization = types.SimpleNamespace(Visualizer=HeadlessVisualizer)
+        sys.modules['open3d'] = stub
+
+    import render
+    render.create_visualizer = lambda window_name='Stars': HeadlessVisualizer()
+    return render
+
+
+_scratch: tempfile.TemporaryDirectory | None = None
+
+def scratch_path(file_name: str) -> str:
+    """Path in a temporary directory removed when the suite exits."""
+    global _scratch
+    if _scratch is None:
+        _scratch = tempfile.TemporaryDirectory(prefix='galaxy_benchmark_')
+    return os.path.join(_scratch.name, file_name)
+
+def load_script(relative_path: str) -> types.ModuleType:
+    """Import one of the standalone generator scripts, which are not packages."""
+    name = os.path.splitext(os.path.basename(relative_path))[0]
+    spec = importlib.util.spec_from_file_location(name, os.path.join(REPO_DIR, relative_path))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+# ---------- Benchmarks ----------
+
+def component_benchmark(name: str, sizes: tuple[int, ...]) -> Benchmark:
+    """Constructing a component class, e.g. Bulge, which generates its stars with the tabulated engine."""
+    component_class, _, _ = COMPONENTS[name]
+
+    def run(parameters) -> int:
+        return len(component_class(parameters, 'tabulated', 0).XX)
+
+    return Benchmark(component_class.__name__, sizes, lambda n: replace(component_parameters(default_config, name), n_stars=n), run)
+
+def generated_galaxy(n: int) -> SpiralGalaxy:
+    galaxy = SpiralGalaxy(scaled_config(n), seed=0)
+    galaxy.generate_galaxy()
+    return galaxy
+
+def galaxy_benchmark() -> Benchmark:
+    def run(galaxy: SpiralGalaxy) -> int:
+        galaxy.generate_galaxy()
+        return len(galaxy.stars)
+
+    return Benchmark('SpiralGalaxy.generate_galaxy', (10_000, 100_000, 1_000_000), lambda n: SpiralGalaxy(scaled_config(n), seed=0), run)
+
+def export_benchmark(suffix: str, sizes: tuple[int, ...]) -> Benchmark:
+    def setup(n: int):
+        return generated_galaxy(n), scratch_path('stars' + suffix)
+
+    def run(state) -> int:
+        galaxy, path = state
+        galaxy.export(path)
+        return len(galaxy.stars)
+
+    return Benchmark(f'SpiralGalaxy.export ({suffix})', sizes, setup, run)
+
+def render_load_benchmark() -> Benchmark:
+    render = headless_render()
+
+    def setup(n: int) -> tuple[str, int]:
+        galaxy = generated_galaxy(n)
+        path = scratch_path('stars.csv')
+        galaxy.df.to_csv(path, index=False)
+        return path, len(galaxy.stars)
+
+    def run(state) -> int:
+        path, n_stars = state
+        render.render_open3d_file(path)
+        return n_stars
+
+    return Benchmark('render_open3d_file', (1_000, 10_000, 100_000, 1_000_000), setup, run)
+
+def temperature_benchmarks() -> list[Benchmark]:
+    def setup(n: int) -> np.ndarray:
+        return np.random.default_rng(0).normal(5000, 2000, n)
+
+    def run_scalar(temps: np.ndarray) -> int:
+        for temp in temps:
+            temp_to_rgb(temp, out_fmt='rgb')
+        return len(temps)
+
+    def run_vector(temps: np.ndarray) -> int:
+        temps_to_rgb(temps)
+        return len(temps)
+
+    return [
+        Benchmark('temp_to_rgb', (100, 1_000, 10_000), setup, run_scalar),
+        Benchmark('temps_to_rgb', (10_000, 100_000, 1_000_000, 10_000_000), setup, run_vector),
+    ]
+
+def legacy_benchmarks() -> list[Benchmark]:
+    """
+    The elliptical generator and the star formation regions of the irregular one, which draws from
+    the global numpy stream. The irregular galaxy and faint bar scripts do not run as they stand
+    (they call methods and functions that are not defined), so they are left out.
+    """
+    elliptical = load_script('elliptical_galaxy_rendering/elliptical_galaxy_rendering.py')
+    regions = load_script('irregular_galaxy_rendering/star_formation_regions_rendering.py')
+
+    def run_elliptical(n: int) -> int:
+        return len(elliptical.EllipticalGalaxy(n, elliptical.galaxy_radius, elliptical.brightness, elliptical.size, seed=0).x)
+
+    def run_regions(n: int) -> int:
+        np.random.seed(0)
+        # Ten regions of about n / 10 stars, whose counts scatter by 400 stars each
+        return len(regions.star_formation_regions_render(10, n // 10, regions.galaxy_radius, regions.min_distance_between_regions, regions.brightness, regions.size).x)
+
+    return [
+        Benchmark('EllipticalGalaxy', (10_000, 100_000, 1_000_000, 10_000_000), lambda n: n, run_elliptical),
+        Benchmark('star_formation_regions_render', (3_000, 10_000, 30_000, 100_000), lambda n: n, run_regions),
+    ]
+
+def all_benchmarks() -> list[Benchmark]:
+    component_sizes = (10_000, 100_000, 1_000_000, 10_000_000)
+    return [
+        *(component_benchmark(name, component_sizes) for name in COMPONENT_NAMES),
+        galaxy_benchmark(),
+        *legacy_benchmarks(),
+        *temperature_benchmarks(),
+        export_benchmark('.csv', (1_000, 10_000, 100_000, 1_000_000)),
+        export_benchmark('.gqz', (10_000, 100_000, 1_000_000)),
+        render_load_benchmark(),
+    ]
+
+
+# ---------- Measurement ----------
+
+def measure(benchmark: Benchmark, n: int, repeats: int) -> dict:
+    """Best wall time of repeats runs, then one more run under tracemalloc for the peak allocation."""
+    seconds = []
+    # Banners and progress bars are part of the run, but not of the report
+    with contextlib.redirect_stdout(io.StringIO()), contextlib.redirect_stderr(io.StringIO()):
+        state = benchmark.setup(n)
+        for _ in range(repeats):
+            start = time.perf_counter()
+            n_stars = benchmark.run(state)
+            seconds.append(time.perf_counter() - start)
+
+        tracemalloc.start()
+        try:
+            benchmark.run(state)
+            _, peak_bytes = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        del state
+
+    return {'n': n, 'n_stars': n_stars, 'seconds': min(seconds), 'peak_bytes': peak_bytes, 'stars_per_second': n_stars / max(min(seconds), 1e-9)}
+
+def fit_scaling(n_stars: list[int], seconds: list[float]) -> float | None:
+    """Exponent a of seconds ~ n_stars^a, fitted in log-log space to the runs long enough to time."""
+    points = [(n, t) for n, t in zip(n_stars, seconds) if t >= MIN_FIT_SECONDS and n > 0]
+    if len(points) < 2:
+        return None
+    n, t = np.log(np.array(points)).T
+    if np.ptp(n) == 0:
+        return None
+    return float(np.polyfit(n, t, 1)[0])
+
+def run_benchmarks(quick: bool = False, repeats: int = 3, only: list[str] | None = None) -> dict:
+    """Sweep every benchmark over its star counts and return the results with the scaling exponents."""
+    results = {}
+    for benchmark in all_benchmarks():
+        if only and benchmark.name not in only:
+            continue
+        sizes = benchmark.sizes[:-1] if quick else benchmark.sizes
+        print(f'\n---------- {benchmark.name} ----------')
+        runs = []
+        for n in sizes:
+            run = measure(benchmark, n, repeats)
+            runs.append(run)
+            print(f"N = {run['n_stars']:>10}: {run['seconds']:9.4f} s, {run['stars_per_second']:12.0f} stars/s, peak {run['peak_bytes'] / 2**20:9.1f} MiB")
+        exponent = fit_scaling([run['n_stars'] for run in runs], [run['seconds'] for run in runs])
+        print(f"Scaling exponent: {exponent:.2f}" if exponent is not None else "Scaling exponent: too fast to fit")
+        results[benchmark.name] = {'runs': runs, 'exponent': exponent}
+
+    return {
+        'format': RESULTS_FORMAT,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'quick': quick,
+        'machine': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'cpu_count': os.cpu_count(),
+        },
+        'benchmarks': results,
+    }
+
+
+# ---------- Baselines ----------
+
+def save_results(results: dict, path: str) -> None:
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=1)
+
+def load_results(path: str) -> dict:
+    with open(path) as f:
+        results = json.load(f)
+    if results.get('format') != RESULTS_FORMAT:
+        raise ValueError(f'{path} is not a benchmark results file')
+    return results
+
+def compare_results(results: dict, baseline: dict, time_threshold: float = 0.25, memory_threshold: float = 0.25, exponent_threshold: float = 0.15) -> list[str]:
+    """
+    Regressions of results against a baseline: a run at the same N slower or using more peak memory
+    than the thresholds allow (as fractions, 0.25 is 25 % worse), or a scaling exponent grown by more
+    than exponent_threshold. Benchmarks or sizes missing from either side are skipped.
+    """
+    regressions = []
+    for name, result in results['benchmarks'].items():
+        reference = baseline['benchmarks'].get(name)
+        if reference is None:
+            continue
+        reference_runs = {run['n']: run for run in reference['runs']}
+        for run in result['runs']:
+            old = reference_runs.get(run['n'])
+            if old is None:
+                continue
+            if run['seconds'] > old['seconds'] * (1 + time_threshold) and run['seconds'] >= MIN_FIT_SECONDS:
+                regressions.append(f"{name} at N = {run['n']}: {run['seconds']:.4f} s against {old['seconds']:.4f} s ({run['seconds'] / old['seconds']:.2f}x)")
+            if run['peak_bytes'] > old['peak_bytes'] * (1 + memory_threshold) and run['peak_bytes'] > 2**20:
+                regressions.append(f"{name} at N = {run['n']}: peak {run['peak_bytes'] / 2**20:.1f} MiB against {old['peak_bytes'] / 2**20:.1f} MiB")
+        if result['exponent'] is not None and reference['exponent'] is not None and result['exponent'] > reference['exponent'] + exponent_threshold:
+            regressions.append(f"{name}: scaling exponent {result['exponent']:.2f} against {reference['exponent']:.2f}")
+    return regressions
+
+
+def main():
+    names = [benchmark.name for benchmark in all_benchmarks()]
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.suite', description='Time and memory-profile the generators, colour conversion, export and loading, and compare with a local baseline.')
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark', help=f"benchmarks to run, all by default: {', '.join(names)}")
+    parser.add_argument('--quick', action='store_true', help='drop the largest star count of every benchmark')
+    parser.add_argument('--save-baseline', action='store_true', help=f'store the results as the baseline of this machine, {BASELINE_PATH}')
+    parser.add_argument('--output', default='benchmark_results.json', help='where to write the results (default: %(default)s)')
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in names]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)}")
+    quick, save_baseline, output, only = args.quick, args.save_baseline, args.output, args.benchmarks
+
+    results = run_benchmarks(quick=quick, only=only or None)
+    save_results(results, output)
+    print(f"\nResults written to {output}")
+
+    if save_baseline:
+        save_results(results, BASELINE_PATH)
+        print(f"Baseline written to {BASELINE_PATH}")
+        return
+    if not os.path.exists(BASELINE_PATH):
+        print("No baseline to compare with, run with --save-baseline to store one")
+        return
+
+    baseline = load_results(BASELINE_PATH)
+    if baseline['machine'] != results['machine']:
+        print("The baseline was recorded on another machine, compare with care")
+    regressions = compare_results(results, baseline)
+    print('\n---------- Regressions against the baseline ----------')
+    for regression in regressions:
+        print(regression)
+    if not regressions:
+        print("None")
+    sys.exit(1 if regressions else 0)
+
+if __name__ == "__main__":
+    main()
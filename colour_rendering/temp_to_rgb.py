@@ -25,6 +25,30 @@ def temp_to_rgb(temp: int | float, out_fmt: str = 'html'):
     rgb = cs.spec_to_rgb(spec, out_fmt=out_fmt)
     return rgb
 
+# Range and resolution of the colour lookup table, log-spaced in temperature
+lut_temp_range = (500.0, 50000.0)
+lut_size = 4096
+_rgb_lut: np.ndarray | None = None
+
+def rgb_lut() -> np.ndarray: 
+    """Fractional rgb colours of lut_size temperatures, computed once per process."""
+    global _rgb_lut
+    if _rgb_lut is None: 
+        temps = np.geomspace(*lut_temp_range, lut_size)
+        _rgb_lut = np.array([temp_to_rgb(temp, out_fmt='rgb') for temp in temps])
+    return _rgb_lut
+
+def temps_to_rgb(temps: np.ndarray) -> np.ndarray: 
+    """Vectorized temp_to_rgb for an array of temperatures, returning an (N, 3) array of fractional rgb.
+
+    Temperatures outside lut_temp_range, including non-positive ones, get the colour of the nearest end.
+    """
+    lut = rgb_lut()
+    log_range = np.log(lut_temp_range[1] / lut_temp_range[0])
+    temps = np.clip(np.asarray(temps, dtype=np.float64), *lut_temp_range)
+    index = np.rint(np.log(temps / lut_temp_range[0]) * ((lut_size - 1) / log_range)).astype(np.int64)
+    return lut[index]
+
 if __name__ == '__main__': 
 
     import matplotlib.pyplot as plt
@@ -1,6 +1,11 @@
 import numpy as np
 import matplotlib.pyplot as plt
 import csv
+import sys
+import os
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spiral_galaxy_components.sampling import sample_plummer_radius, sample_isotropic_directions, sample_temperature
 
 # Parameters
 n_stars = 20000 
@@ -11,42 +16,31 @@ size = 2
 
 
 class EllipticalGalaxy: 
-    def __init__(self, n_stars, galaxy_radius, brightness, size):
+    def __init__(self, n_stars, galaxy_radius, brightness, size, seed=None):
         self.n_stars = n_stars
+        self.seed = seed
         self.galaxy_radius = galaxy_radius
         self.bright = brightness
         self.s = size
         self.x, self.y, self.z, self.temperature, self.brightness, self.size = self.generate_elliptical_galaxy()
     
     def generate_elliptical_galaxy(self):
-        x = np.zeros(self.n_stars)
-        y = np.zeros(self.n_stars)
-        z = np.zeros(self.n_stars)
-        temperature = np.zeros(self.n_stars)
-        brightness = np.zeros(self.n_stars)
-        size = np.zeros(self.n_stars)
+        rng = np.random.default_rng(self.seed)
         normalized_ratio = tuple(i/max(size_ratio) for i in size_ratio)
 
-        for i in range(self.n_stars):
-            # Generate radius using the Plummer model
-            r = self.galaxy_radius / np.sqrt(np.random.uniform(0, 1) ** (-2/3) - 1) - 1
-            while r > self.galaxy_radius: 
-                r = self.galaxy_radius / np.sqrt(np.random.uniform(0, 1) ** (-2/3) - 1) - 1
+        # Plummer radii shifted by -1 and truncated at galaxy_radius, as the old per-star rejection loop did
+        r = sample_plummer_radius(self.n_stars, self.galaxy_radius, self.galaxy_radius + 1, rng) - 1
 
-            # Generate random angles for spherical coordinates
-            theta = np.arccos(2 * np.random.uniform(0, 1) - 1)  # Polar angle
-            phi = 2 * np.pi * np.random.uniform(0, 1)           # Azimuthal angle
+        # Random directions for spherical coordinates
+        ux, uy, uz = sample_isotropic_directions(self.n_stars, rng)
 
-            # Convert spherical coordinates to Cartesian coordinates
-            x[i] = (r * np.sin(theta) * np.cos(phi) + np.random.normal(0, self.galaxy_radius/20)) * normalized_ratio[0]
-            y[i] = (r * np.sin(theta) * np.sin(phi) + np.random.normal(0, self.galaxy_radius/20)) * normalized_ratio[1]
-            z[i] = (r * np.cos(theta) + np.random.normal(0, self.galaxy_radius/20)) * normalized_ratio[2]
-            temperature[i] = np.random.normal(3000, 500)
-            #while temperature[i] < 3000: 
-            #    temperature[i] = np.random.normal(3000, 100)
-            #temperature[i] = int(np.fix(np.random.normal(1000,400)))
-            brightness[i] = self.bright
-            size[i] = self.s
+        # Convert spherical coordinates to Cartesian coordinates
+        x = (r * ux + rng.normal(0, self.galaxy_radius/20, self.n_stars)) * normalized_ratio[0]
+        y = (r * uy + rng.normal(0, self.galaxy_radius/20, self.n_stars)) * normalized_ratio[1]
+        z = (r * uz + rng.normal(0, self.galaxy_radius/20, self.n_stars)) * normalized_ratio[2]
+        temperature = sample_temperature(self.n_stars, 3000, 500, rng)
+        brightness = np.full(self.n_stars, float(self.bright))
+        size = np.full(self.n_stars, float(self.s))
 
         return x, y, z, temperature, brightness, size
     
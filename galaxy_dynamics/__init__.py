@@ -0,0 +1 @@
+# galaxy_dynamics/__init__.py
\ No newline at end of file
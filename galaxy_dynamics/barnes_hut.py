@@ -0,0 +1,271 @@
+import numpy as np
+import multiprocessing as mp
+import multiprocessing.pool
+from dataclasses import dataclass, field, fields
+from multiprocessing.shared_memory import SharedMemory
+from spiral_galaxy_components.kinematics import G
+from spiral_galaxy_components.shared_buffer import attach_shared_memory
+
+# Bits per axis of the Morton keys, 3*21 = 63 bits fit in an unsigned 64-bit integer
+MORTON_BITS = 21
+
+
+def spread_bits(v: np.ndarray) -> np.ndarray:
+    """Insert two zero bits between each of the lower 21 bits of v."""
+    v = v.astype(np.uint64) & np.uint64(0x1fffff)
+    v = (v | v << np.uint64(32)) & np.uint64(0x1f00000000ffff)
+    v = (v | v << np.uint64(16)) & np.uint64(0x1f0000ff0000ff)
+    v = (v | v << np.uint64(8)) & np.uint64(0x100f00f00f00f00f)
+    v = (v | v << np.uint64(4)) & np.uint64(0x10c30c30c30c30c3)
+    v = (v | v << np.uint64(2)) & np.uint64(0x1249249249249249)
+    return v
+
+def morton_keys(grid: np.ndarray) -> np.ndarray:
+    """Interleave the bits of integer (N, 3) grid coordinates into Morton keys."""
+    return spread_bits(grid[:, 0]) << np.uint64(2) | spread_bits(grid[:, 1]) << np.uint64(1) | spread_bits(grid[:, 2])
+
+
+@dataclass
+class Octree:
+
+    """
+    Linear octree over Morton-sorted particles.
+
+    Every node covers a contiguous range [start, end) of the sorted particles. Children of a node
+    are stored contiguously from first_child, and nodes holding at most leaf_size particles, or
+    sitting at the maximum depth, are leaves whose particles are summed directly.
+    """
+
+    positions: np.ndarray # Sorted particle positions
+    masses: np.ndarray # Sorted particle masses
+    order: np.ndarray # Sorted index -> original index
+    start: np.ndarray
+    end: np.ndarray
+    level: np.ndarray
+    first_child: np.ndarray
+    n_children: np.ndarray
+    mass: np.ndarray
+    com: np.ndarray
+    center: np.ndarray # Geometric centre of each node's cube
+    half_size: np.ndarray # Half the side of each node's cube
+
+    @classmethod
+    def build(cls, positions: np.ndarray, masses: np.ndarray, leaf_size: int = 16) -> 'Octree':
+        """Build the tree level by level with vectorized segment detection on the sorted keys."""
+        lower = positions.min(axis=0)
+        side = max(float((positions.max(axis=0) - lower).max()), 1e-12) * (1 + 1e-9)
+        n_cells = 2**MORTON_BITS
+        grid = np.minimum(((positions - lower) / side * n_cells).astype(np.int64), n_cells - 1)
+        keys = morton_keys(grid)
+
+        order = np.argsort(keys, kind='stable')
+        keys = keys[order]
+        grid = grid[order]
+        positions = positions[order]
+        masses = masses[order]
+        n = len(positions)
+
+        starts = [np.array([0])]
+        ends = [np.array([n])]
+        levels = [np.array([0])]
+        parents = [np.array([-1])]
+        n_nodes = 1
+
+        # Internal nodes of the previous level, sorted by start and disjoint
+        frontier_ids = np.array([0]) if n > leaf_size else np.array([], dtype=np.int64)
+        frontier_starts = np.array([0])
+        frontier_ends = np.array([n])
+
+        for level in range(1, MORTON_BITS + 1):
+            if len(frontier_ids) == 0:
+                break
+            prefix = keys >> np.uint64(3 * (MORTON_BITS - level))
+            segment_starts = np.concatenate([[0], np.flatnonzero(prefix[1:] != prefix[:-1]) + 1])
+            segment_ends = np.concatenate([segment_starts[1:], [n]])
+
+            # Keep the segments lying inside a node that is being subdivided
+            parent = np.searchsorted(frontier_starts, segment_starts, side='right') - 1
+            inside = (parent >= 0) & (segment_starts < frontier_ends[np.maximum(parent, 0)])
+            segment_starts = segment_starts[inside]
+            segment_ends = segment_ends[inside]
+            parent = frontier_ids[parent[inside]]
+
+            ids = n_nodes + np.arange(len(segment_starts))
+            n_nodes += len(segment_starts)
+            starts.append(segment_starts)
+            ends.append(segment_ends)
+            levels.append(np.full(len(segment_starts), level))
+            parents.append(parent)
+
+            internal = segment_ends - segment_starts > leaf_size
+            if level == MORTON_BITS:
+                internal[:] = False
+            frontier_ids = ids[internal]
+            frontier_starts = segment_starts[internal]
+            frontier_ends = segment_ends[internal]
+
+        start = np.concatenate(starts)
+        end = np.concatenate(ends)
+        level = np.concatenate(levels)
+        parent = np.concatenate(parents)
+
+        # Children of a node were created contiguously, in key order
+        n_children = np.bincount(parent[1:], minlength=n_nodes)
+        first_child = np.full(n_nodes, -1)
+        child_ids = np.arange(1, n_nodes)
+        first = np.concatenate([[True], parent[2:] != parent[1:-1]]) if n_nodes > 1 else np.array([], dtype=bool)
+        first_child[parent[1:][first]] = child_ids[first]
+
+        cumulative_mass = np.concatenate([[0.0], np.cumsum(masses)])
+        cumulative_moment = np.vstack([np.zeros(3), np.cumsum(masses[:, None] * positions, axis=0)])
+        mass = cumulative_mass[end] - cumulative_mass[start]
+        com = (cumulative_moment[end] - cumulative_moment[start]) / np.maximum(mass, 1e-300)[:, None]
+
+        # Cube of each node from the grid coordinates of its first particle
+        shift = (MORTON_BITS - level)[:, None]
+        corner = (grid[start] >> shift) << shift
+        cell = side / n_cells
+        half_size = cell * 2.0**(MORTON_BITS - level) / 2
+        center = lower + corner * cell + half_size[:, None]
+
+        return cls(positions, masses, order, start, end, level, first_child, n_children, mass, com, center, half_size)
+
+    def accelerations(self, targets: np.ndarray, theta: float, softening: float) -> np.ndarray:
+        """
+        Gravitational acceleration at the sorted particles with index targets, in (km/s)^2/kpc.
+
+        The traversal is breadth-first over (target, node) pairs: nodes far enough away by the
+        opening angle criterion are accepted as point masses, internal nodes are replaced by their
+        children and leaves by their particles, all as array operations.
+        """
+        n_targets = len(targets)
+        acc = np.zeros((n_targets, 3))
+        target = np.arange(n_targets)
+        node = np.zeros(n_targets, dtype=np.int64)
+        eps2 = softening**2
+        theta2 = theta**2
+
+        def accumulate(pair_target: np.ndarray, d: np.ndarray, weight: np.ndarray) -> None:
+            for axis in range(3):
+                acc[:, axis] += np.bincount(pair_target, weights=weight * d[:, axis], minlength=n_targets)
+
+        while len(node):
+            position = self.positions[targets[target]]
+            d = self.com[node] - position
+            r2 = np.einsum('ij,ij->i', d, d) + eps2
+            size2 = (2 * self.half_size[node])**2
+            contains = np.all(np.abs(position - self.center[node]) <= self.half_size[node][:, None], axis=1)
+            opened = contains | (size2 > theta2 * r2)
+
+            far = ~opened
+            accumulate(target[far], d[far], G * self.mass[node[far]] / (r2[far] * np.sqrt(r2[far])))
+
+            is_internal = self.n_children[node] > 0
+            leaf = opened & ~is_internal
+            if leaf.any():
+                leaf_target = target[leaf]
+                leaf_node = node[leaf]
+                counts = self.end[leaf_node] - self.start[leaf_node]
+                pair_target = np.repeat(leaf_target, counts)
+                offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+                particle = np.repeat(self.start[leaf_node], counts) + offsets
+                d_leaf = self.positions[particle] - self.positions[targets[pair_target]]
+                # With softening the target's own particle contributes exactly zero
+                r2_leaf = np.einsum('ij,ij->i', d_leaf, d_leaf) + eps2
+                accumulate(pair_target, d_leaf, G * self.masses[particle] / (r2_leaf * np.sqrt(r2_leaf)))
+
+            expand = opened & is_internal
+            counts = self.n_children[node[expand]]
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            node = np.repeat(self.first_child[node[expand]], counts) + offsets
+            target = np.repeat(target[expand], counts)
+
+        return acc
+
+
+# ---------- Shared trees ----------
+
+def share_tree(tree: Octree) -> tuple[SharedMemory, list[tuple[str, str, tuple[int, ...], int]]]:
+    """Copy the arrays of a tree into one shared memory segment, returning it with their layout."""
+    layout = []
+    offset = 0
+    for f in fields(tree):
+        array = getattr(tree, f.name)
+        layout.append((f.name, array.dtype.str, array.shape, offset))
+        offset += -(-array.nbytes // 64) * 64 # Aligned to cache lines
+    shared = SharedMemory(create=True, size=max(offset, 1))
+    for name, dtype, shape, start in layout:
+        np.ndarray(shape, dtype=dtype, buffer=shared.buf, offset=start)[...] = getattr(tree, name)
+    return shared, layout
+
+def attach_tree(shared: SharedMemory, layout: list[tuple[str, str, tuple[int, ...], int]]) -> Octree:
+    return Octree(**{name: np.ndarray(shape, dtype=dtype, buffer=shared.buf, offset=start) for name, dtype, shape, start in layout})
+
+
+# Tree of the latest force evaluation a worker has seen, with its segment, attached once per step
+_worker_tree: tuple[str, SharedMemory, Octree] | None = None
+
+def _worker_accelerations(task: tuple[str, list, int, int, float, float]) -> np.ndarray:
+    global _worker_tree
+    name, layout, start, stop, theta, softening = task
+    if _worker_tree is None or _worker_tree[0] != name:
+        if _worker_tree is not None:
+            _, shared, tree = _worker_tree
+            _worker_tree = None
+            del tree
+            shared.close()
+        shared = attach_shared_memory(name)
+        _worker_tree = (name, shared, attach_tree(shared, layout))
+    return _worker_tree[2].accelerations(np.arange(start, stop), theta, softening)
+
+
+@dataclass
+class BarnesHutSolver:
+
+    """
+    O(N log N) tree gravity with force evaluation spread across processes. The worker pool is
+    started on the first evaluation and reused by every later one until close(); each tree is
+    handed to it through shared memory.
+    """
+
+    theta: float = 0.5
+    softening: float = 0.05 # kpc
+    leaf_size: int = 16
+    n_workers: int | None = None # Defaults to the number of CPUs
+    batch_size: int = 2048 # Targets traversed together, bounds the size of the pair arrays
+    pool: mp.pool.Pool | None = field(init=False, default=None, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.softening <= 0:
+            raise ValueError('softening must be positive')
+        if self.n_workers is None:
+            self.n_workers = mp.cpu_count()
+
+    def accelerations(self, positions: np.ndarray, masses: np.ndarray) -> np.ndarray:
+        """Acceleration of every particle in (km/s)^2/kpc, in the original particle order."""
+        tree = Octree.build(positions, masses, self.leaf_size)
+        batches = [(i, min(i + self.batch_size, len(positions))) for i in range(0, len(positions), self.batch_size)]
+
+        if self.n_workers > 1 and len(batches) > 1:
+            if self.pool is None:
+                self.pool = mp.Pool(self.n_workers)
+            shared, layout = share_tree(tree)
+            try:
+                results = self.pool.map(_worker_accelerations, [(shared.name, layout, start, stop, self.theta, self.softening) for start, stop in batches])
+            finally:
+                # Workers keep their mapping until the next tree, the name can go now
+                shared.close()
+                shared.unlink()
+        else:
+            results = [tree.accelerations(np.arange(start, stop), self.theta, self.softening) for start, stop in batches]
+
+        acc = np.empty_like(positions, dtype=np.float64)
+        acc[tree.order] = np.concatenate(results)
+        return acc
+
+    def close(self) -> None:
+        """Stop the worker pool; the next evaluation starts a new one."""
+        if self.pool is not None:
+            self.pool.terminate()
+            self.pool.join()
+            self.pool = None
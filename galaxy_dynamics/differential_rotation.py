@@ -0,0 +1,101 @@
+import numpy as np
+from dataclasses import dataclass, field
+from spiral_galaxy_components.config import KinematicsParameters, default_kinematics_parameters
+from spiral_galaxy_components.kinematics import ROTATING_COMPONENTS, RotationCurve, build_rotation_curve
+
+
+@dataclass
+class DifferentialRotation:
+
+    """
+    Kinematic winding of a galaxy: every rotating star stays on its circular orbit and advances its
+    azimuth by Omega(r) dt per step, the bulge and halo stay put.
+
+    All state lives in preallocated arrays and step() only runs in-place ufuncs, so frames cost no
+    allocation. positions can be swapped for an external (N, 3) float64 buffer, such as the memory
+    of an open3d point cloud, with use_buffer().
+    """
+
+    stars: np.ndarray # Star buffer
+    component_slices: dict[str, slice]
+    curve: RotationCurve
+    dt: float = 1e-3 # kpc/(km/s), about 1 Myr
+
+    time: float = field(init=False, default=0.0)
+    positions: np.ndarray = field(init=False)
+    radius: np.ndarray = field(init=False)
+    phi: np.ndarray = field(init=False)
+    omega: np.ndarray = field(init=False)
+    _scratch: np.ndarray = field(init=False, repr=False)
+
+    def __post_init__(self) -> None:
+        n = len(self.stars)
+        self.positions = np.empty((n, 3))
+        self.positions[:, 0] = self.stars['XX']
+        self.positions[:, 1] = self.stars['YY']
+        self.positions[:, 2] = self.stars['ZZ']
+        self.radius = np.hypot(self.positions[:, 0], self.positions[:, 1])
+        self.phi = np.arctan2(self.positions[:, 1], self.positions[:, 0])
+
+        # Clockwise rotation seen from +z, matching the kinematics stage, so the arms trail
+        self.omega = np.zeros(n)
+        for name in ROTATING_COMPONENTS:
+            component_slice = self.component_slices[name]
+            self.omega[component_slice] = -self.curve.angular_velocity(self.radius[component_slice])
+        self._scratch = np.empty(n)
+
+    @classmethod
+    def from_galaxy(cls, galaxy, parameters: KinematicsParameters | None = None, dt: float = 1e-3) -> 'DifferentialRotation':
+        parameters = parameters or galaxy.config.kinematics_parameters or default_kinematics_parameters
+        return cls(galaxy.stars, galaxy.component_slices, build_rotation_curve(galaxy.config, parameters), dt)
+
+    def use_buffer(self, buffer: np.ndarray) -> None:
+        """Write positions into buffer from now on, starting with the current ones."""
+        buffer[:] = self.positions
+        self.positions = buffer
+
+    def step(self, n_steps: int = 1) -> None:
+        """Advance every azimuth by Omega(r) * dt * n_steps and update positions in place."""
+        np.multiply(self.omega, self.dt * n_steps, out=self._scratch)
+        np.add(self.phi, self._scratch, out=self.phi)
+        np.remainder(self.phi, 2 * np.pi, out=self.phi)
+        np.cos(self.phi, out=self._scratch)
+        np.multiply(self.radius, self._scratch, out=self.positions[:, 0])
+        np.sin(self.phi, out=self._scratch)
+        np.multiply(self.radius, self._scratch, out=self.positions[:, 1])
+        self.time += self.dt * n_steps
+
+
+def write_frames(rotation: DifferentialRotation, path: str, n_frames: int, steps_per_frame: int = 1) -> None:
+    """
+    Stream n_frames float32 frames of positions into an (n_frames, N, 3) .npy file.
+
+    The file is memory-mapped and each frame is cast straight into it, so memory use stays at one frame.
+    """
+    frames = np.lib.format.open_memmap(path, mode='w+', dtype=np.float32, shape=(n_frames, len(rotation.positions), 3))
+    for frame in range(n_frames):
+        frames[frame] = rotation.positions
+        rotation.step(steps_per_frame)
+    frames.flush()
+    del frames
+
+    print(f"Frames written to {path}")
+
+
+def main():
+    import sys
+    from spiral_galaxy import SpiralGalaxy
+
+    galaxy = SpiralGalaxy()
+    galaxy.generate_galaxy()
+    rotation = DifferentialRotation.from_galaxy(galaxy, dt=2e-3)
+
+    # python -m galaxy_dynamics.differential_rotation <frames.npy> <n_frames> writes frames instead of showing them
+    if len(sys.argv) == 3:
+        write_frames(rotation, sys.argv[1], int(sys.argv[2]))
+    else:
+        from render import animate_open3d
+        animate_open3d(rotation, galaxy.T)
+
+if __name__ == "__main__":
+    main()
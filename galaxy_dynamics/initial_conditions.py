@@ -0,0 +1,76 @@
+import numpy as np
+from dataclasses import dataclass
+from spiral_galaxy_components.config import KinematicsParameters, default_kinematics_parameters
+from spiral_galaxy_components.kinematics import component_size, isothermal_halo_circular_velocity
+
+
+@dataclass
+class Particles:
+    positions: np.ndarray # (N, 3) kpc
+    velocities: np.ndarray # (N, 3) km/s
+    masses: np.ndarray # (N,) solar masses
+
+
+def galaxy_particles(galaxy, parameters: KinematicsParameters | None = None) -> Particles:
+    """
+    Turn a generated SpiralGalaxy into N-body particles.
+
+    The bulge stars share the bulge mass, the bar, disk and arm stars share the disk mass, and the
+    scattered stars are given the disk particle mass. Velocities are assigned first if missing.
+    """
+    parameters = parameters or galaxy.config.kinematics_parameters or default_kinematics_parameters
+    if 'VX' not in galaxy.stars.dtype.names:
+        galaxy.assign_velocities(parameters)
+
+    stars = galaxy.stars
+    positions = np.column_stack([stars['XX'], stars['YY'], stars['ZZ']]).astype(np.float64)
+    velocities = np.column_stack([stars['VX'], stars['VY'], stars['VZ']]).astype(np.float64)
+
+    slices = galaxy.component_slices
+    n_disk = sum(component_size(slices[name]) for name in ('bar', 'disk', 'spiral_arms'))
+    n_bulge = component_size(slices['bulge'])
+    masses = np.full(len(stars), parameters.disk_mass / max(n_disk, 1))
+    masses[slices['bulge']] = parameters.bulge_mass / max(n_bulge, 1)
+
+    return Particles(positions, velocities, masses)
+
+def place(particles: Particles, offset: tuple[float, float, float], velocity: tuple[float, float, float], inclination: float = 0.0) -> Particles:
+    """Tilt a galaxy about the x axis by inclination (radians), then move it to offset with a bulk velocity."""
+    c, s = np.cos(inclination), np.sin(inclination)
+    rotation = np.array([[1, 0, 0], [0, c, -s], [0, s, c]])
+    return Particles(
+        particles.positions @ rotation.T + np.asarray(offset), 
+        particles.velocities @ rotation.T + np.asarray(velocity), 
+        particles.masses.copy()
+    )
+
+def combine(*particle_sets: Particles) -> tuple[Particles, list[slice]]:
+    """Concatenate particle sets, returning the slice each one occupies."""
+    slices = []
+    start = 0
+    for particles in particle_sets:
+        slices.append(slice(start, start + len(particles.masses)))
+        start += len(particles.masses)
+    combined = Particles(
+        np.concatenate([p.positions for p in particle_sets]), 
+        np.concatenate([p.velocities for p in particle_sets]), 
+        np.concatenate([p.masses for p in particle_sets])
+    )
+    return combined, slices
+
+
+@dataclass
+class IsothermalHalo:
+
+    """Rigid dark halo centred on the centre of mass of one galaxy's particles, so it follows that galaxy."""
+
+    parameters: KinematicsParameters
+    members: slice
+
+    def accelerations(self, positions: np.ndarray, masses: np.ndarray) -> np.ndarray:
+        member_masses = masses[self.members]
+        center = (member_masses[:, None] * positions[self.members]).sum(axis=0) / member_masses.sum()
+        d = positions - center
+        r = np.maximum(np.linalg.norm(d, axis=1), 1e-12)
+        v = isothermal_halo_circular_velocity(r, self.parameters.halo_velocity, self.parameters.halo_core_radius)
+        return -(v**2 / r**2)[:, None] * d
@@ -0,0 +1,31 @@
+import numpy as np
+from collections.abc import Callable
+
+
+def leapfrog(positions: np.ndarray, velocities: np.ndarray, acceleration: Callable[[np.ndarray], np.ndarray], dt: float, n_steps: int, 
+             callback: Callable[[int], None] | None = None, acc: np.ndarray | None = None) -> np.ndarray:
+    """
+    Advance positions and velocities in place with kick-drift-kick leapfrog steps.
+
+    Parameters:
+        positions (np.ndarray): (N, 3) positions in kpc, updated in place.
+        velocities (np.ndarray): (N, 3) velocities in km/s, updated in place.
+        acceleration (callable): Maps (N, 3) positions to (N, 3) accelerations in (km/s)^2/kpc.
+        dt (float): Time step in kpc/(km/s), about 0.978 Gyr.
+        n_steps (int): Number of steps.
+        callback (callable): Called with the step number after each step.
+        acc (np.ndarray): Acceleration at the current positions, if already known.
+
+    Returns:
+        np.ndarray: Acceleration at the final positions, to pass to the next call.
+    """
+    if acc is None:
+        acc = acceleration(positions)
+    for step in range(1, n_steps + 1):
+        velocities += 0.5 * dt * acc
+        positions += dt * velocities
+        acc = acceleration(positions)
+        velocities += 0.5 * dt * acc
+        if callback is not None:
+            callback(step)
+    return acc
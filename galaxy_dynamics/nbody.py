@@ -0,0 +1,81 @@
+import numpy as np
+import time
+from dataclasses import dataclass, field
+from .barnes_hut import BarnesHutSolver
+from .initial_conditions import Particles, IsothermalHalo, combine, galaxy_particles, place
+from .leapfrog import leapfrog
+from .particle_mesh import ParticleMeshSolver
+from .snapshots import SnapshotWriter
+
+
+@dataclass
+class NBodySimulation:
+
+    """Self-gravitating evolution of galaxy particles, optionally inside rigid dark halos."""
+
+    particles: Particles
+    solver: BarnesHutSolver | ParticleMeshSolver = field(default_factory=BarnesHutSolver) # Anything with accelerations(positions, masses)
+    halos: list[IsothermalHalo] = field(default_factory=list)
+    dt: float = 1e-3 # kpc/(km/s), about 1 Myr
+
+    step: int = field(init=False, default=0)
+    time: float = field(init=False, default=0.0)
+    acc: np.ndarray | None = field(init=False, default=None)
+
+    def accelerations(self, positions: np.ndarray) -> np.ndarray:
+        acc = self.solver.accelerations(positions, self.particles.masses)
+        for halo in self.halos:
+            acc += halo.accelerations(positions, self.particles.masses)
+        return acc
+
+    def run(self, n_steps: int, snapshot_path: str | None = None, snapshot_every: int = 1) -> None:
+        """Advance n_steps, appending a snapshot every snapshot_every steps if a path is given."""
+        writer = SnapshotWriter(snapshot_path, self.particles.masses) if snapshot_path is not None else None
+        if writer is not None and self.step == 0:
+            writer.write(self.step, self.time, self.particles.positions, self.particles.velocities)
+
+        def after_step(_: int) -> None:
+            self.step += 1
+            self.time += self.dt
+            print(f"Step {self.step}, t = {self.time:.4f} ({time.perf_counter() - started:.1f} s)")
+            if writer is not None and self.step % snapshot_every == 0:
+                writer.write(self.step, self.time, self.particles.positions, self.particles.velocities)
+
+        started = time.perf_counter()
+        try:
+            self.acc = leapfrog(self.particles.positions, self.particles.velocities, self.accelerations, self.dt, n_steps, after_step, self.acc)
+        finally:
+            if writer is not None:
+                writer.close()
+            # The solver's workers live for one integration
+            if hasattr(self.solver, 'close'):
+                self.solver.close()
+
+
+def main(): 
+    import sys
+    from spiral_galaxy import SpiralGalaxy
+    from spiral_galaxy_components.config import default_kinematics_parameters
+
+    # Two galaxies on a head-on collision course, the second tilted by 45 degrees
+    galaxy_a = SpiralGalaxy(seed=1)
+    galaxy_a.generate_galaxy()
+    galaxy_b = SpiralGalaxy(seed=2)
+    galaxy_b.generate_galaxy()
+
+    particles, (members_a, members_b) = combine(
+        place(galaxy_particles(galaxy_a), (-40.0, 0.0, 0.0), (100.0, 0.0, 0.0)), 
+        place(galaxy_particles(galaxy_b), (40.0, 10.0, 0.0), (-100.0, 0.0, 0.0), inclination=np.pi/4)
+    )
+    # python -m galaxy_dynamics.nbody pm switches to the particle-mesh solver for large runs
+    solver = ParticleMeshSolver() if sys.argv[1:] == ['pm'] else BarnesHutSolver()
+    simulation = NBodySimulation(
+        particles, 
+        solver=solver, 
+        halos=[IsothermalHalo(default_kinematics_parameters, members_a), IsothermalHalo(default_kinematics_parameters, members_b)], 
+        dt=0.002
+    )
+    simulation.run(400, snapshot_path='galaxy_collision.snap', snapshot_every=10)
+
+if __name__ == "__main__":
+    main()
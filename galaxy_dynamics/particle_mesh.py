@@ -0,0 +1,102 @@
+import numpy as np
+from functools import lru_cache
+from dataclasses import dataclass
+from spiral_galaxy_components.kinematics import G
+
+# Offsets of the 8 cells sharing a particle's cloud-in-cell weight
+CIC_OFFSETS = np.array([[i, j, k] for i in (0, 1) for j in (0, 1) for k in (0, 1)])
+
+
+def cic_weights(positions: np.ndarray, lower: np.ndarray, cell_size: float, shape: tuple[int, int, int]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Cloud-in-cell flat cell indices and weights of a chunk of particles.
+
+    Returns (index, weight, valid), each of shape (8, N), where valid masks corners outside the grid.
+    """
+    f = (positions - lower) / cell_size - 0.5
+    i0 = np.floor(f).astype(np.int64)
+    d = f - i0
+    index = np.zeros((8, len(positions)), dtype=np.int64)
+    weight = np.ones((8, len(positions)))
+    valid = np.ones((8, len(positions)), dtype=bool)
+    for corner, offset in enumerate(CIC_OFFSETS):
+        for axis in range(3):
+            i = i0[:, axis] + offset[axis]
+            valid[corner] &= (i >= 0) & (i < shape[axis])
+            index[corner] = index[corner] * shape[axis] + np.clip(i, 0, shape[axis] - 1)
+            weight[corner] *= d[:, axis] if offset[axis] else 1 - d[:, axis]
+    return index, weight, valid
+
+def cic_deposit(positions: np.ndarray, weights: np.ndarray, lower: np.ndarray, cell_size: float, shape: tuple[int, int, int],
+                out: np.ndarray | None = None, chunk_size: int = 1_000_000) -> np.ndarray:
+    """Add particle weights to a 3D grid with cloud-in-cell weighting, one bincount per chunk."""
+    if out is None:
+        out = np.zeros(shape)
+    flat = out.reshape(-1)
+    for start in range(0, len(positions), chunk_size):
+        index, weight, valid = cic_weights(positions[start:start + chunk_size], lower, cell_size, shape)
+        weight *= weights[start:start + chunk_size]
+        flat += np.bincount(index[valid], weights=weight[valid], minlength=flat.size)
+    return out
+
+def cic_interpolate(fields: np.ndarray, positions: np.ndarray, lower: np.ndarray, cell_size: float, chunk_size: int = 1_000_000) -> np.ndarray:
+    """Interpolate (C, nx, ny, nz) grid fields to the particles with cloud-in-cell weights, giving (N, C)."""
+    shape = fields.shape[1:]
+    flat = fields.reshape(len(fields), -1)
+    values = np.zeros((len(positions), len(fields)))
+    for start in range(0, len(positions), chunk_size):
+        index, weight, valid = cic_weights(positions[start:start + chunk_size], lower, cell_size, shape)
+        weight = np.where(valid, weight, 0.0)
+        for c in range(len(fields)):
+            values[start:start + chunk_size, c] = (flat[c][index] * weight).sum(axis=0)
+    return values
+
+
+@lru_cache(maxsize=4)
+def green_function_fft(n_grid: int, cell_size: float) -> np.ndarray:
+    """FFT of the isolated -G/r kernel on the doubled (2n)^3 grid used for zero-padded convolution."""
+    m = 2 * n_grid
+    d = np.minimum(np.arange(m), m - np.arange(m)) * cell_size
+    r = np.sqrt(d[:, None, None]**2 + d[None, :, None]**2 + d[None, None, :]**2)
+    # The self-cell term is softened to half a cell
+    r[0, 0, 0] = cell_size / 2
+    return np.fft.rfftn(-G / r)
+
+
+@dataclass
+class ParticleMeshSolver:
+
+    """
+    Particle-mesh gravity: cloud-in-cell deposit, FFT Poisson solve with isolated boundaries,
+    finite-difference forces and cloud-in-cell interpolation back to the particles.
+
+    The grid is a cube around all particles, so the force resolution is the box size over n_grid.
+    """
+
+    n_grid: int = 128
+    padding: float = 0.05 # Fraction of the box added around the particles
+    chunk_size: int = 1_000_000
+
+    def grid_geometry(self, positions: np.ndarray) -> tuple[np.ndarray, float]:
+        lower = positions.min(axis=0)
+        upper = positions.max(axis=0)
+        side = max(float((upper - lower).max()), 1e-12) * (1 + 2 * self.padding)
+        # Round the side up to a power of 2^(1/8) so the cached Green's function is reused between steps
+        side = 2.0**(np.ceil(8 * np.log2(side)) / 8)
+        center = (lower + upper) / 2
+        return center - side / 2, side / self.n_grid
+
+    def potential(self, positions: np.ndarray, masses: np.ndarray) -> tuple[np.ndarray, np.ndarray, float]:
+        """Gravitational potential on the grid in (km/s)^2, with the grid's lower corner and cell size."""
+        n = self.n_grid
+        lower, cell_size = self.grid_geometry(positions)
+        mass_grid = np.zeros((2 * n, 2 * n, 2 * n))
+        mass_grid[:n, :n, :n] = cic_deposit(positions, masses, lower, cell_size, (n, n, n), chunk_size=self.chunk_size)
+        potential = np.fft.irfftn(np.fft.rfftn(mass_grid) * green_function_fft(n, cell_size), s=mass_grid.shape)
+        return potential[:n, :n, :n], lower, cell_size
+
+    def accelerations(self, positions: np.ndarray, masses: np.ndarray) -> np.ndarray:
+        """Acceleration of every particle in (km/s)^2/kpc."""
+        potential, lower, cell_size = self.potential(positions, masses)
+        force = -np.stack(np.gradient(potential, cell_size))
+        return cic_interpolate(force, positions, lower, cell_size, self.chunk_size)
@@ -0,0 +1,83 @@
+import numpy as np
+import json
+import os
+from collections.abc import Iterator
+from dataclasses import dataclass
+
+# Snapshot files start with this line, then one JSON header line, then the particle masses
+# and any number of appended frames of (step, time, positions, velocities)
+MAGIC = b'GALAXY-SNAPSHOTS 1\n'
+FRAME_HEADER_DTYPE = np.dtype([('step', '<i8'), ('time', '<f8')])
+
+
+@dataclass
+class Snapshot:
+    step: int
+    time: float # In units of kpc/(km/s), about 0.978 Gyr
+    positions: np.ndarray # (N, 3) kpc
+    velocities: np.ndarray # (N, 3) km/s
+
+
+class SnapshotWriter:
+
+    """Append-only float32 snapshot file; reopening an existing file appends further frames."""
+
+    def __init__(self, path: str, masses: np.ndarray) -> None:
+        self.path = path
+        self.n_particles = len(masses)
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            header, _ = read_header(path)
+            if header['n_particles'] != self.n_particles:
+                raise ValueError(f"{path} holds {header['n_particles']} particles, not {self.n_particles}")
+            self.file = open(path, 'ab')
+        else:
+            self.file = open(path, 'wb')
+            header = {'n_particles': self.n_particles, 'dtype': '<f4', 'columns': ['XX', 'YY', 'ZZ', 'VX', 'VY', 'VZ']}
+            self.file.write(MAGIC)
+            self.file.write(json.dumps(header).encode() + b'\n')
+            self.file.write(np.ascontiguousarray(masses, dtype='<f4').tobytes())
+            self.file.flush()
+
+    def write(self, step: int, time: float, positions: np.ndarray, velocities: np.ndarray) -> None:
+        frame_header = np.array([(step, time)], dtype=FRAME_HEADER_DTYPE)
+        self.file.write(frame_header.tobytes())
+        self.file.write(np.ascontiguousarray(positions, dtype='<f4').tobytes())
+        self.file.write(np.ascontiguousarray(velocities, dtype='<f4').tobytes())
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+    def __enter__(self) -> 'SnapshotWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+def read_header(path: str) -> tuple[dict, int]:
+    """Return the JSON header of a snapshot file and the byte offset of the masses."""
+    with open(path, 'rb') as f:
+        if f.readline() != MAGIC:
+            raise ValueError(f'{path} is not a galaxy snapshot file')
+        header = json.loads(f.readline())
+        return header, f.tell()
+
+def read_masses(path: str) -> np.ndarray:
+    header, offset = read_header(path)
+    return np.fromfile(path, dtype='<f4', count=header['n_particles'], offset=offset)
+
+def read_snapshots(path: str) -> Iterator[Snapshot]:
+    """Yield every complete frame of a snapshot file as memory-mapped arrays."""
+    header, offset = read_header(path)
+    n = header['n_particles']
+    frame_size = FRAME_HEADER_DTYPE.itemsize + 2 * 3 * n * 4
+    offset += 4 * n
+    file_size = os.path.getsize(path)
+
+    # A frame cut short by an interrupted run is ignored
+    while offset + frame_size <= file_size:
+        frame_header = np.fromfile(path, dtype=FRAME_HEADER_DTYPE, count=1, offset=offset)[0]
+        data = np.memmap(path, dtype='<f4', mode='r', offset=offset + FRAME_HEADER_DTYPE.itemsize, shape=(2, n, 3))
+        yield Snapshot(int(frame_header['step']), float(frame_header['time']), data[0], data[1])
+        offset += frame_size
@@ -0,0 +1 @@
+# galaxy_products/__init__.py
\ No newline at end of file
@@ -0,0 +1,23 @@
+import numpy as np
+
+# Grids up to this many cells per star of a chunk take a bincount, larger ones a sort of the chunk
+BINCOUNT_CELLS_PER_STAR = 8
+
+
+def scatter_add(flat: np.ndarray, index: np.ndarray, values: np.ndarray) -> None:
+    """
+    flat[index] += values with repeated indices summed, for (cells,) or (cells, k) grids. Small
+    grids take one bincount per column; large ones sort the chunk so every touched cell is updated
+    once, so the cost of a chunk never grows with the grid, which may be memory-mapped.
+    """
+    if not len(index):
+        return
+    columns = values.reshape(len(values), -1)
+    if len(flat) <= BINCOUNT_CELLS_PER_STAR * len(index):
+        sums = np.stack([np.bincount(index, weights=column, minlength=len(flat)) for column in columns.T], axis=1)
+        flat += sums.reshape(flat.shape)
+        return
+    order = np.argsort(index)
+    index = index[order]
+    first = np.flatnonzero(np.r_[True, index[1:] != index[:-1]])
+    flat[index[first]] += np.add.reduceat(columns[order], first, axis=0).reshape((len(first),) + flat.shape[1:]).astype(flat.dtype)
@@ -0,0 +1,197 @@
+import os
+import sys
+import time
+import numpy as np
+from collections.abc import Iterable
+from dataclasses import dataclass, field
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spiral_galaxy_components.instrumentation import stage
+from spiral_galaxy_components.luminosity_function import SUN_ABSOLUTE_MAGNITUDE
+from galaxy_products.sources import iter_star_chunks, source_from_argument
+
+# Stars projected at once, bounding the temporary arrays whatever the size of the chunks fed in
+BLOCK_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class Observer:
+
+    """
+    Where a mock survey looks from, in the galaxy's frame. Declination is measured from the plane
+    normal to pole and right ascension from ra_zero, the direction of RA = 0.
+    """
+
+    position: tuple[float, float, float] # kpc
+    pole: tuple[float, float, float] = (0.0, 0.0, 1.0)
+    ra_zero: tuple[float, float, float] = (-1.0, 0.0, 0.0)
+    reference_brightness: float = 2.0 # B of a Sun-like star, see magnitude_to_brightness()
+
+    def basis(self) -> np.ndarray:
+        """Rows are the unit vectors towards RA = 0, RA = 90 degrees and the pole."""
+        pole = np.asarray(self.pole, dtype=np.float64)
+        pole /= np.linalg.norm(pole)
+        zero = np.asarray(self.ra_zero, dtype=np.float64)
+        zero -= zero @ pole * pole
+        zero /= np.linalg.norm(zero)
+        return np.stack([zero, np.cross(pole, zero), pole])
+
+# The Sun's place in the default galaxy, 8.2 kpc from the centre and slightly above the disk
+default_observer: Observer = Observer(position=(8.2, 0.0, 0.02))
+
+
+# ---------- Projection ----------
+
+def project_stars(stars: np.ndarray, observer: Observer) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """RA and Dec in radians, distance in kpc and apparent magnitude of every star of a chunk."""
+    sin_dec, ra, distance = observer_coordinates(stars, observer)
+    return ra, np.arcsin(sin_dec), distance, apparent_magnitude(stars['B'], distance, observer.reference_brightness)
+
+def observer_coordinates(stars: np.ndarray, observer: Observer) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """sin(Dec), RA in [0, 2 pi) and distance of every star, without the arcsin project_stars() adds."""
+    offset = np.stack([stars['XX'], stars['YY'], stars['ZZ']], axis=1).astype(np.float64) - observer.position
+    local = offset @ observer.basis().T
+    distance = np.sqrt(np.einsum('ij,ij->i', local, local))
+    # A star exactly at the observer is given the pole rather than a division by zero
+    sin_dec = np.divide(local[:, 2], distance, out=np.ones(len(distance)), where=distance > 0)
+    ra = np.arctan2(local[:, 1], local[:, 0]) % (2*np.pi)
+    return np.clip(sin_dec, -1.0, 1.0), ra, distance
+
+def apparent_magnitude(brightness: np.ndarray, distance: np.ndarray, reference_brightness: float = 2.0) -> np.ndarray:
+    """Inverse of magnitude_to_brightness() for the absolute magnitude, moved to distance kpc."""
+    absolute = SUN_ABSOLUTE_MAGNITUDE - 2.5*np.log10(np.maximum(brightness, 1e-30) / reference_brightness)
+    return absolute + 5*np.log10(np.maximum(distance, 1e-9) * 100)
+
+
+# ---------- HEALPix ----------
+
+def n_pixels(nside: int) -> int:
+    return 12 * nside * nside
+
+def ang2pix_ring(nside: int, z: np.ndarray, phi: np.ndarray) -> np.ndarray:
+    """
+    HEALPix RING pixel of directions given by z = cos(colatitude) = sin(Dec) and phi = RA, the
+    equal-area pixelization of Gorski et al. (2005), ported from the reference loc2pix().
+    """
+    z = np.asarray(z, dtype=np.float64)
+    za = np.abs(z)
+    tt = (np.asarray(phi, dtype=np.float64) % (2*np.pi)) / (np.pi / 2) # In [0, 4)
+    pixel = np.empty(len(z), dtype=np.int64)
+
+    # Equatorial belt, |z| <= 2/3
+    equator = za <= 2/3
+    t1 = nside * (0.5 + tt[equator])
+    t2 = nside * z[equator] * 0.75
+    jp = (t1 - t2).astype(np.int64) # Index of the ascending edge line
+    jm = (t1 + t2).astype(np.int64) # Index of the descending edge line
+    ring = nside + 1 + jp - jm # In [1, 2 nside + 1]
+    shift = 1 - (ring & 1)
+    ip = ((jp + jm - nside + shift + 1) // 2) % (4 * nside)
+    pixel[equator] = 2 * nside * (nside - 1) + (ring - 1) * 4 * nside + ip
+
+    # Polar caps
+    cap = ~equator
+    tp = tt[cap] - np.floor(tt[cap])
+    tmp = nside * np.sqrt(3 * (1 - za[cap]))
+    jp = (tp * tmp).astype(np.int64)
+    jm = ((1 - tp) * tmp).astype(np.int64)
+    ring = jp + jm + 1 # Counted from the nearest pole
+    ip = (tt[cap] * ring).astype(np.int64) % (4 * ring)
+    pixel[cap] = np.where(z[cap] > 0, 2 * ring * (ring - 1) + ip, n_pixels(nside) - 2 * ring * (ring + 1) + ip)
+    return pixel
+
+
+# ---------- Sky maps ----------
+
+@dataclass
+class SkyMap:
+
+    """Star counts and summed flux per HEALPix pixel of the sky seen by observer, filled chunk by chunk."""
+
+    observer: Observer
+    nside: int = 64
+    magnitude_limit: float | None = None # Survey depth: fainter stars are left out of the maps
+    counts: np.ndarray = field(init=False)
+    flux: np.ndarray = field(init=False) # In units of a magnitude 0 star
+    n_stars: int = field(init=False, default=0) # Stars seen, detected or not
+    n_detected: int = field(init=False, default=0)
+
+    def __post_init__(self) -> None:
+        self.counts = np.zeros(n_pixels(self.nside), dtype=np.int64)
+        self.flux = np.zeros(n_pixels(self.nside), dtype=np.float64)
+
+    def add(self, stars: np.ndarray) -> None:
+        """Project a chunk of stars and bin it. Only a block of projected coordinates exists at once."""
+        # Flux straight from B / distance^2, and the depth as a flux limit, skip every logarithm
+        zero_point = 10**(-0.4*SUN_ABSOLUTE_MAGNITUDE) / (self.observer.reference_brightness * 100**2)
+        for start in range(0, len(stars), BLOCK_SIZE):
+            block = stars[start:start + BLOCK_SIZE]
+            sin_dec, ra, distance = observer_coordinates(block, self.observer)
+            flux = block['B'] * zero_point / np.maximum(distance, 1e-9)**2
+            if self.magnitude_limit is not None:
+                detected = flux >= 10**(-0.4*self.magnitude_limit)
+                sin_dec, ra, flux = sin_dec[detected], ra[detected], flux[detected]
+            pixel = ang2pix_ring(self.nside, sin_dec, ra)
+            self.counts += np.bincount(pixel, minlength=len(self.counts))
+            self.flux += np.bincount(pixel, weights=flux, minlength=len(self.flux))
+            self.n_stars += len(block)
+            self.n_detected += len(pixel)
+
+    def surface_brightness(self) -> np.ndarray:
+        """Magnitude per square degree of every pixel, inf where the pixel is empty."""
+        pixel_area = 4*np.pi * (180/np.pi)**2 / len(self.flux)
+        with np.errstate(divide='ignore'):
+            return -2.5*np.log10(self.flux / pixel_area)
+
+    def save(self, path: str) -> None:
+        np.savez_compressed(path, counts=self.counts, flux=self.flux, nside=self.nside,
+                            magnitude_limit=np.nan if self.magnitude_limit is None else self.magnitude_limit,
+                            observer=np.array([*self.observer.position, *self.observer.pole, *self.observer.ra_zero, self.observer.reference_brightness]),
+                            n_stars=self.n_stars, n_detected=self.n_detected)
+
+def load_sky_map(path: str) -> SkyMap:
+    data = np.load(path)
+    values = data['observer']
+    limit = float(data['magnitude_limit'])
+    sky_map = SkyMap(Observer(tuple(values[0:3]), tuple(values[3:6]), tuple(values[6:9]), float(values[9])), int(data['nside']), None if np.isnan(limit) else limit)
+    sky_map.counts, sky_map.flux = data['counts'], data['flux']
+    sky_map.n_stars, sky_map.n_detected = int(data['n_stars']), int(data['n_detected'])
+    return sky_map
+
+
+def build_sky_map(chunks: Iterable[np.ndarray], observer: Observer = default_observer, nside: int = 64, magnitude_limit: float | None = None) -> SkyMap:
+    """One pass over a stream of star chunks, e.g. iter_star_chunks(), into a sky map, in constant memory."""
+    sky_map = SkyMap(observer, nside, magnitude_limit)
+    with stage('build_sky_map') as running:
+        for stars in chunks:
+            sky_map.add(stars)
+            running.advance(len(stars))
+        running.record.n_stars = sky_map.n_stars
+    return sky_map
+
+def print_sky_map(sky_map: SkyMap) -> None:
+    print(f'\n---------- Sky map (nside {sky_map.nside}, {len(sky_map.counts)} pixels) ----------')
+    depth = f' brighter than magnitude {sky_map.magnitude_limit}' if sky_map.magnitude_limit is not None else ''
+    print(f"{sky_map.n_detected} of {sky_map.n_stars} stars{depth}")
+    occupied = sky_map.counts > 0
+    print(f"{np.count_nonzero(occupied)} pixels hold stars, at most {sky_map.counts.max()} stars per pixel")
+    if occupied.any():
+        print(f"Brightest pixel: {sky_map.surface_brightness()[occupied].min():.2f} mag/deg^2")
+
+
+def main():
+    # python -m galaxy_products.sky <manifest.json | n_stars> [nside] [magnitude_limit] [output.npz]
+    args = sys.argv[1:]
+    source = source_from_argument(args[0]) if args else source_from_argument('100000')
+    nside = int(args[1]) if len(args) > 1 else 64
+    magnitude_limit = float(args[2]) if len(args) > 2 else None
+    output_path = args[3] if len(args) > 3 else 'sky_map.npz'
+
+    start_time = time.perf_counter()
+    sky_map = build_sky_map(iter_star_chunks(source, seed=0), default_observer, nside, magnitude_limit)
+    print_sky_map(sky_map)
+    sky_map.save(output_path)
+    print(f"Sky map saved to {output_path} in {time.perf_counter() - start_time:.1f} s")
+
+if __name__ == "__main__":
+    main()
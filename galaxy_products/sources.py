@@ -0,0 +1,24 @@
+import numpy as np
+from collections.abc import Iterator
+from sharded_galaxy import iter_partitions
+from spiral_galaxy_components.components import CHUNK_SIZE, iter_galaxy_chunks, scaled_config
+from spiral_galaxy_components.config import SpiralGalaxyConfig
+
+
+def iter_star_chunks(source: str | SpiralGalaxyConfig, seed: int | None = None, chunk_size: int = CHUNK_SIZE) -> Iterator[np.ndarray]:
+    """
+    Star buffers of a galaxy one chunk at a time: the partitions of a sharded dataset or universe
+    field when source is the path of its manifest, memory-mapped and cut into chunk_size stars,
+    or the chunks of a galaxy generated on the fly from a config and seed.
+    """
+    if isinstance(source, SpiralGalaxyConfig):
+        for _, stars in iter_galaxy_chunks(source, seed, chunk_size):
+            yield stars
+        return
+    for _, partition in iter_partitions(source):
+        for start in range(0, len(partition), chunk_size):
+            yield partition[start:start + chunk_size]
+
+def source_from_argument(argument: str) -> str | SpiralGalaxyConfig:
+    """A command-line source: a manifest path, or a star count to scale the default config to."""
+    return scaled_config(int(argument)) if argument.isdigit() else argument
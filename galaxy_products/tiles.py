@@ -0,0 +1,279 @@
+import hashlib
+import json
+import os
+import struct
+import sys
+import time
+import zlib
+import numpy as np
+from collections.abc import Callable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from colour_rendering.temp_to_rgb import temps_to_rgb
+from sharded_galaxy import iter_partitions
+from spiral_galaxy_components.components import CHUNK_SIZE, COMPONENT_NAMES, component_parameters, iter_galaxy_chunks
+from spiral_galaxy_components.config import SpiralGalaxyConfig
+from spiral_galaxy_components.instrumentation import stage
+from galaxy_products.grids import scatter_add
+from galaxy_products.sources import source_from_argument
+
+TILE_SIZE = 256
+# Deep Zoom levels below the whole image at TILE_SIZE pixels, 1, 2, 4, ... 128 pixels across
+DZI_BASE_LEVEL = 8
+PYRAMID_FORMAT = 'galaxy-tile-pyramid 1'
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+@dataclass(frozen=True)
+class PyramidParameters:
+    extent: float = 40.0 # kpc from the centre to the edge of the square imaged
+    max_level: int = 4 # The finest level is TILE_SIZE * 2**max_level pixels across
+    axes: tuple[str, str] = ('XX', 'YY') # Star columns along the image's width and, upwards, its height
+    white_point: float | None = None # Mean flux per finest pixel shown at full brightness, by default from the data
+    softening: float = 0.01 # Of the white point, where the asinh stretch turns from linear to logarithmic
+
+    @property
+    def size(self) -> int:
+        return TILE_SIZE * 2**self.max_level
+
+    def geometry(self) -> dict:
+        """The parameters that change the accumulated grids, as opposed to their tone mapping."""
+        return {'extent': self.extent, 'max_level': self.max_level, 'axes': list(self.axes)}
+
+
+# ---------- PNG ----------
+
+def png_chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data))
+
+def encode_png(rgb: np.ndarray, compression: int = 6) -> bytes:
+    """An 8-bit RGB PNG of an (h, w, 3) uint8 image, with no filtering."""
+    height, width, _ = rgb.shape
+    rows = np.zeros((height, 1 + 3 * width), dtype=np.uint8) # A zero filter byte starts every row
+    rows[:, 1:] = rgb.reshape(height, 3 * width)
+    return (PNG_SIGNATURE + png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0))
+            + png_chunk(b'IDAT', zlib.compress(rows.tobytes(), compression)) + png_chunk(b'IEND', b''))
+
+
+# ---------- Accumulation ----------
+
+def open_grid(path: str, size: int, mode: str = 'w+') -> np.ndarray:
+    """A (size, size, 3) float32 flux grid memory-mapped from a .npy file, so levels larger than memory work."""
+    if mode == 'r+':
+        return np.load(path, mmap_mode='r+')
+    return np.lib.format.open_memmap(path, mode=mode, dtype=np.float32, shape=(size, size, 3))
+
+def accumulate_stars(grid: np.ndarray, stars: np.ndarray, parameters: PyramidParameters) -> None:
+    """
+    Add the B-weighted, temperature-coloured flux of a chunk of stars to the finest grid. The stars
+    are summed per pixel before touching the grid, whatever the size of the grid.
+    """
+    size = parameters.size
+    scale = size / (2 * parameters.extent)
+    col = np.floor((stars[parameters.axes[0]] + parameters.extent) * scale).astype(np.int64)
+    row = np.floor((parameters.extent - stars[parameters.axes[1]]) * scale).astype(np.int64)
+    inside = (col >= 0) & (col < size) & (row >= 0) & (row < size)
+    pixel = row[inside] * size + col[inside]
+    if not len(pixel):
+        return
+    flux = temps_to_rgb(stars['T'][inside]) * stars['B'][inside, None]
+
+    scatter_add(grid.reshape(-1, 3), pixel, flux)
+
+def iter_bands(size: int, rows: int = 2 * TILE_SIZE) -> Iterator[slice]:
+    for start in range(0, size, rows):
+        yield slice(start, min(start + rows, size))
+
+def downsample(fine: np.ndarray, coarse: np.ndarray) -> None:
+    """Sum 2 x 2 pixels of fine into coarse, a band of rows at a time."""
+    for band in iter_bands(len(fine)):
+        block = np.asarray(fine[band])
+        coarse[band.start // 2:band.stop // 2] = block.reshape(len(block) // 2, 2, -1, 2, 3).sum(axis=(1, 3))
+
+
+# ---------- Sources ----------
+
+def component_sources(source: str | SpiralGalaxyConfig, seed: int, chunk_size: int = CHUNK_SIZE) -> dict[str, tuple[str, Callable[[], Iterator[np.ndarray]]]]:
+    """
+    The parts a pyramid is accumulated from, each with a key that changes whenever its stars do
+    and a function streaming its chunks: every component of a generated galaxy, or a sharded
+    dataset as a single part keyed by its manifest.
+    """
+    if isinstance(source, SpiralGalaxyConfig):
+        def chunks(name: str) -> Callable[[], Iterator[np.ndarray]]:
+            return lambda: (stars for _, stars in iter_galaxy_chunks(source, seed, chunk_size, (name,)))
+
+        return {
+            name: (json.dumps([asdict(component_parameters(source, name)), seed, chunk_size], sort_keys=True), chunks(name))
+            for name in COMPONENT_NAMES
+        }
+
+    with open(source, 'rb') as f:
+        key = f.read().decode()
+    return {'dataset': (key, lambda: (partition for _, partition in iter_partitions(source)))}
+
+
+# ---------- Pyramid ----------
+
+def read_pyramid_manifest(output_dir: str) -> dict:
+    path = os.path.join(output_dir, 'pyramid.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        manifest = json.load(f)
+    return manifest if manifest.get('format') == PYRAMID_FORMAT else {}
+
+def update_component_grids(sources: dict, parameters: PyramidParameters, cache_dir: str) -> tuple[dict[str, str], list[str]]:
+    """
+    Accumulate the finest grid of every part whose key has no grid in cache_dir yet, removing the
+    part's stale grids. Returns the grid path of every part and the parts that were accumulated.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    paths = {}
+    changed = []
+    for name, (key, chunks) in sources.items():
+        digest = hashlib.sha1(json.dumps([key, parameters.geometry()]).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f'{name}-{digest}.npy')
+        paths[name] = path
+        if os.path.exists(path):
+            continue
+        for stale in os.listdir(cache_dir):
+            if stale.startswith(f'{name}-'):
+                os.remove(os.path.join(cache_dir, stale))
+
+        with stage(f'accumulate {name}') as running:
+            grid = open_grid(path + '.tmp.npy', parameters.size)
+            for stars in chunks():
+                accumulate_stars(grid, stars, parameters)
+                running.record.n_stars += len(stars)
+            grid.flush()
+            del grid
+        os.replace(path + '.tmp.npy', path)
+        changed.append(name)
+    return paths, changed
+
+def build_levels(component_paths: dict[str, str], parameters: PyramidParameters, cache_dir: str) -> list[np.ndarray]:
+    """Sum the parts into the finest level and downsample it into every coarser one, finest last."""
+    levels = [None] * (parameters.max_level + 1)
+    finest = open_grid(os.path.join(cache_dir, f'level-{parameters.max_level}.npy'), parameters.size)
+    grids = [np.load(path, mmap_mode='r') for path in component_paths.values()]
+    for band in iter_bands(parameters.size):
+        finest[band] = sum(np.asarray(grid[band]) for grid in grids)
+    levels[-1] = finest
+    for level in range(parameters.max_level - 1, -1, -1):
+        levels[level] = open_grid(os.path.join(cache_dir, f'level-{level}.npy'), TILE_SIZE * 2**level)
+        downsample(levels[level + 1], levels[level])
+    return levels
+
+def tone_map(flux: np.ndarray, pixel_area: int, white_point: float, softening: float) -> np.ndarray:
+    """8-bit RGB of summed flux over pixels of pixel_area finest pixels, with an asinh stretch."""
+    soft = white_point * softening
+    value = np.arcsinh(flux / (pixel_area * soft)) / np.arcsinh(1 / softening)
+    return np.clip(np.rint(value * 255), 0, 255).astype(np.uint8)
+
+def write_tile(path: str, image: np.ndarray, previous_crc: int | None) -> tuple[int, bool]:
+    """Write a PNG tile unless its file already holds the same image. Returns its CRC and whether it was written."""
+    png = encode_png(image)
+    crc = zlib.crc32(png)
+    if crc == previous_crc and os.path.exists(path):
+        return crc, False
+    with open(path + '.tmp', 'wb') as f:
+        f.write(png)
+    os.replace(path + '.tmp', path)
+    return crc, True
+
+def build_pyramid(source: str | SpiralGalaxyConfig, output_dir: str, parameters: PyramidParameters = PyramidParameters(), seed: int = 0,
+                  chunk_size: int = CHUNK_SIZE, n_workers: int | None = None, name: str = 'galaxy', recompute_white_point: bool = False) -> dict:
+    """
+    Render a galaxy into a Deep Zoom tile pyramid in output_dir: name.dzi and name_files/<level>/<col>_<row>.png.
+
+    Stars are binned once, into the finest level, per component; coarser levels are 2 x 2 sums of
+    finer ones. The finest grid of every component is cached under output_dir/cache keyed by its
+    parameters and seed, so a rerun after editing some components only bins those again, and only
+    tiles whose image changed are rewritten. Tiles without any flux are not written. Unless
+    parameters fix a white point, the one of the previous run with the same geometry is kept, so
+    edits do not re-tone the whole pyramid; recompute_white_point measures it from the data again.
+    Returns the pyramid manifest.
+    """
+    start_time = time.perf_counter()
+    cache_dir = os.path.join(output_dir, 'cache')
+    tiles_dir = os.path.join(output_dir, f'{name}_files')
+    previous = read_pyramid_manifest(output_dir)
+    same_geometry = previous.get('geometry') == parameters.geometry()
+    previous_tiles = previous.get('tiles', {}) if same_geometry else {}
+
+    print(f"\n---------- Tile pyramid: {parameters.max_level + 1} levels, {parameters.size} x {parameters.size} pixels ----------")
+    component_paths, changed = update_component_grids(component_sources(source, seed, chunk_size), parameters, cache_dir)
+    print(f"Binned: {', '.join(changed) if changed else 'nothing, every part is cached'}")
+    levels = build_levels(component_paths, parameters, cache_dir)
+
+    # The white point from the whole-galaxy tile keeps every level and rerun on one brightness scale
+    white_point = parameters.white_point
+    if white_point is None and same_geometry and not recompute_white_point:
+        white_point = previous.get('white_point')
+    if white_point is None:
+        brightest = levels[0].max(axis=2) / 4**parameters.max_level
+        white_point = float(np.quantile(brightest[brightest > 0], 0.999)) if np.any(brightest > 0) else 1.0
+
+    tiles = {}
+    written = 0
+    with ThreadPoolExecutor(n_workers) as executor:
+        for level, grid in enumerate(levels):
+            pixel_area = 4**(parameters.max_level - level)
+            level_dir = os.path.join(tiles_dir, str(DZI_BASE_LEVEL + level))
+            os.makedirs(level_dir, exist_ok=True)
+            n_tiles = len(grid) // TILE_SIZE
+
+            def render(tile: tuple[int, int]) -> tuple[str, int, bool] | None:
+                col, row = tile
+                flux = np.asarray(grid[row * TILE_SIZE:(row + 1) * TILE_SIZE, col * TILE_SIZE:(col + 1) * TILE_SIZE])
+                if not flux.any():
+                    return None
+                tile_name = f'{DZI_BASE_LEVEL + level}/{col}_{row}'
+                crc, changed = write_tile(os.path.join(tiles_dir, tile_name + '.png'), tone_map(flux, pixel_area, white_point, parameters.softening), previous_tiles.get(tile_name))
+                return tile_name, crc, changed
+
+            for result in executor.map(render, [(col, row) for row in range(n_tiles) for col in range(n_tiles)]):
+                if result is not None:
+                    tiles[result[0]] = result[1]
+                    written += result[2]
+
+    # Deep Zoom levels smaller than one tile, each the previous one halved
+    image = levels[0]
+    for level in range(DZI_BASE_LEVEL - 1, -1, -1):
+        image = np.asarray(image).reshape(len(image) // 2, 2, -1, 2, 3).sum(axis=(1, 3))
+        os.makedirs(os.path.join(tiles_dir, str(level)), exist_ok=True)
+        tile_name = f'{level}/0_0'
+        tiles[tile_name], changed = write_tile(os.path.join(tiles_dir, tile_name + '.png'), tone_map(image, 4**parameters.max_level * (TILE_SIZE // len(image))**2, white_point, parameters.softening), previous_tiles.get(tile_name))
+        written += changed
+
+    removed = 0
+    for tile_name in set(previous.get('tiles', {})) - set(tiles):
+        path = os.path.join(tiles_dir, tile_name + '.png')
+        if os.path.exists(path):
+            os.remove(path)
+            removed += 1
+
+    with open(os.path.join(output_dir, f'{name}.dzi'), 'w') as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="png" Overlap="0" TileSize="{TILE_SIZE}">\n'
+                f'  <Size Width="{parameters.size}" Height="{parameters.size}"/>\n</Image>\n')
+    manifest = {'format': PYRAMID_FORMAT, 'geometry': parameters.geometry(), 'white_point': white_point, 'components': {name: os.path.basename(path) for name, path in component_paths.items()}, 'tiles': tiles}
+    with open(os.path.join(output_dir, 'pyramid.json'), 'w') as f:
+        json.dump(manifest, f)
+
+    print(f"{len(tiles)} tiles, {written} written, {len(tiles) - written} unchanged, {removed} removed, in {time.perf_counter() - start_time:.1f} s")
+    return manifest
+
+
+def main():
+    # python -m galaxy_products.tiles <manifest.json | n_stars> [output_dir] [max_level] [retone]
+    args = sys.argv[1:]
+    source = source_from_argument(args[0]) if args else source_from_argument('1000000')
+    output_dir = args[1] if len(args) > 1 else 'galaxy_tiles'
+    parameters = PyramidParameters(max_level=int(args[2])) if len(args) > 2 else PyramidParameters()
+    build_pyramid(source, output_dir, parameters, recompute_white_point=len(args) > 3 and args[3] == 'retone')
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+from collections.abc import Iterable
+from dataclasses import asdict, dataclass, field
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from galaxy_dynamics.particle_mesh import cic_weights
+from spiral_galaxy_components.instrumentation import stage
+from galaxy_products.grids import scatter_add
+from galaxy_products.sources import iter_star_chunks, source_from_argument
+
+VOXELS_FORMAT = 'galaxy-voxels 1'
+# Stars deposited at once; cloud-in-cell holds 8 corners of about 17 bytes per star
+BLOCK_SIZE = 1 << 18
+# Accumulators larger than this are memory-mapped from the output directory
+MEMMAP_BYTES = 256 * 2**20
+# Summed per cell: star count, B and T
+ACCUMULATED = ('count', 'luminosity', 'temperature_sum')
+# Exported float32 fields, one .npy file each
+FIELDS = ('count', 'density', 'luminosity', 'mean_temperature')
+
+
+@dataclass(frozen=True)
+class VoxelGridParameters:
+    shape: tuple[int, int, int] = (256, 256, 64)
+    cell_size: float = 0.3 # kpc, cells are cubes
+    centre: tuple[float, float, float] = (0.0, 0.0, 0.0) # kpc
+    cic: bool = False # Cloud-in-cell weighting instead of nearest grid point
+
+    @property
+    def lower(self) -> np.ndarray:
+        return np.asarray(self.centre) - np.asarray(self.shape) * self.cell_size / 2
+
+    @property
+    def n_cells(self) -> int:
+        return int(np.prod(self.shape))
+
+
+@dataclass
+class VoxelGrid:
+
+    """
+    Star count, luminosity and temperature of a galaxy on a 3D grid, accumulated chunk by chunk
+    and written to output_dir by finish(). The per-cell sums are float64, so counts stay exact for
+    any number of stars, and are memory-mapped from output_dir when larger than MEMMAP_BYTES.
+    """
+
+    parameters: VoxelGridParameters
+    output_dir: str
+    sums: np.ndarray = field(init=False, repr=False) # (n_cells, len(ACCUMULATED))
+    n_stars: int = field(init=False, default=0)
+    n_inside: float = field(init=False, default=0.0) # Stars deposited inside the grid, fractional with CIC
+
+    def __post_init__(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        shape = (self.parameters.n_cells, len(ACCUMULATED))
+        if self.parameters.n_cells * len(ACCUMULATED) * 8 > MEMMAP_BYTES:
+            self.sums = np.lib.format.open_memmap(self.accumulator_path, mode='w+', dtype=np.float64, shape=shape)
+        else:
+            self.sums = np.zeros(shape)
+
+    @property
+    def accumulator_path(self) -> str:
+        return os.path.join(self.output_dir, 'accumulator.npy')
+
+    def add(self, stars: np.ndarray) -> None:
+        """Deposit a chunk of stars, a block at a time."""
+        parameters = self.parameters
+        for start in range(0, len(stars), BLOCK_SIZE):
+            block = stars[start:start + BLOCK_SIZE]
+            positions = np.stack([block['XX'], block['YY'], block['ZZ']], axis=1).astype(np.float64)
+            values = np.stack([np.ones(len(block)), block['B'], block['T']], axis=1)
+
+            if parameters.cic:
+                index, weight, valid = cic_weights(positions, parameters.lower, parameters.cell_size, parameters.shape)
+                star = np.broadcast_to(np.arange(len(block)), index.shape)[valid]
+                index = index[valid]
+                values = values[star] * weight[valid][:, None]
+            else:
+                cell = np.floor((positions - parameters.lower) / parameters.cell_size).astype(np.int64)
+                inside = np.all((cell >= 0) & (cell < parameters.shape), axis=1)
+                index = np.ravel_multi_index(tuple(cell[inside].T), parameters.shape)
+                values = values[inside]
+
+            scatter_add(self.sums, index, values)
+            self.n_stars += len(block)
+            self.n_inside += float(values[:, 0].sum())
+
+    def finish(self) -> dict:
+        """Write every field as float32 .npy files and voxels.json to output_dir, returning the latter's content."""
+        parameters = self.parameters
+        fields = {name: np.lib.format.open_memmap(os.path.join(self.output_dir, f'{name}.npy'), mode='w+', dtype=np.float32, shape=parameters.shape)
+                  for name in FIELDS}
+        cell_volume = parameters.cell_size**3
+        # A slab of cells at a time, so memory-mapped grids are never read whole
+        slab = parameters.n_cells // parameters.shape[0]
+        for x in range(parameters.shape[0]):
+            sums = np.asarray(self.sums[x * slab:(x + 1) * slab]).reshape(parameters.shape[1:] + (len(ACCUMULATED),))
+            count = sums[..., 0]
+            fields['count'][x] = count
+            fields['density'][x] = count / cell_volume
+            fields['luminosity'][x] = sums[..., 1]
+            fields['mean_temperature'][x] = np.divide(sums[..., 2], count, out=np.zeros_like(count), where=count > 0)
+        for grid in fields.values():
+            grid.flush()
+
+        description = {
+            'format': VOXELS_FORMAT,
+            **asdict(self.parameters),
+            'lower': self.parameters.lower.tolist(),
+            'n_stars': self.n_stars,
+            'n_inside': self.n_inside,
+            'fields': {name: f'{name}.npy' for name in FIELDS},
+            'units': {'count': 'stars', 'density': 'stars / kpc^3', 'luminosity': 'B', 'mean_temperature': 'K'},
+        }
+        with open(os.path.join(self.output_dir, 'voxels.json'), 'w') as f:
+            json.dump(description, f, indent=1)
+        if isinstance(self.sums, np.memmap):
+            del self.sums
+            os.remove(self.accumulator_path)
+        return description
+
+
+def load_voxel_field(output_dir: str, name: str) -> np.ndarray:
+    """One exported field, memory-mapped."""
+    return np.load(os.path.join(output_dir, f'{name}.npy'), mmap_mode='r')
+
+def build_voxel_grid(chunks: Iterable[np.ndarray], output_dir: str, parameters: VoxelGridParameters = VoxelGridParameters()) -> dict:
+    """One pass over a stream of star chunks, e.g. iter_star_chunks(), into voxel fields in output_dir."""
+    grid = VoxelGrid(parameters, output_dir)
+    with stage('build_voxel_grid') as running:
+        for stars in chunks:
+            grid.add(stars)
+            running.advance(len(stars))
+        running.record.n_stars = grid.n_stars
+        return grid.finish()
+
+def print_voxel_grid(description: dict) -> None:
+    print(f"\n---------- Voxel grid {' x '.join(map(str, description['shape']))}, {description['cell_size']} kpc cells ----------")
+    print(f"{description['n_inside']:.0f} of {description['n_stars']} stars inside the grid{', cloud-in-cell' if description['cic'] else ''}")
+
+
+def main():
+    # python -m galaxy_products.voxels <manifest.json | n_stars> [output_dir] [n_cells_per_side] [cic]
+    args = sys.argv[1:]
+    source = source_from_argument(args[0]) if args else source_from_argument('1000000')
+    output_dir = args[1] if len(args) > 1 else 'galaxy_voxels'
+    parameters = VoxelGridParameters()
+    if len(args) > 2:
+        # A cube of the same extent across as the default grid
+        n = int(args[2])
+        parameters = VoxelGridParameters(shape=(n, n, n), cell_size=parameters.shape[0] * parameters.cell_size / n)
+    if len(args) > 3 and args[3] == 'cic':
+        parameters = VoxelGridParameters(parameters.shape, parameters.cell_size, parameters.centre, cic=True)
+
+    start_time = time.perf_counter()
+    description = build_voxel_grid(iter_star_chunks(source, seed=0), output_dir, parameters)
+    print_voxel_grid(description)
+    print(f"Voxel fields saved to {output_dir} in {time.perf_counter() - start_time:.1f} s")
+
+if __name__ == "__main__":
+    main()
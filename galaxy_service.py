@@ -0,0 +1,305 @@
+import http.client
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import numpy as np
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import fields, replace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from colour_rendering.temp_to_rgb import rgb_lut, temps_to_rgb
+from spiral_galaxy_components import config as config_module
+from spiral_galaxy_components.components import CHUNK_SIZE, COMPONENT_NAMES, component_parameters, generate_component
+from spiral_galaxy_components.config import PopulationParameters, SpiralGalaxyConfig, default_kinematics_parameters
+from spiral_galaxy_components.helper import derive_seed
+from spiral_galaxy_components.kinematics import assign_velocities, build_rotation_curve
+from spiral_galaxy_components.star_buffer import STAR_COLUMNS, VELOCITY_COLUMNS
+
+DEFAULT_PORT = 8765
+COLOUR_COLUMNS = ('RED', 'GREEN', 'BLUE')
+
+
+def config_from_payload(payload: dict) -> SpiralGalaxyConfig:
+    """
+    Build a config from a request: {"base": "default_config", "disk_parameters": {"n_stars": 1000}, ...}.
+
+    Every field not given keeps the base config's value; "population" may be a dict of
+    PopulationParameters fields and "kinematics_parameters" a dict overriding the default ones.
+    """
+    config = getattr(config_module, payload.get('base', 'default_config'))
+    if not isinstance(config, SpiralGalaxyConfig):
+        raise ValueError(f"{payload.get('base')!r} is not a galaxy config")
+
+    changes = {}
+    for field in fields(SpiralGalaxyConfig):
+        overrides = payload.get(field.name)
+        if overrides is None:
+            continue
+        current = getattr(config, field.name)
+        if field.name == 'kinematics_parameters' and current is None:
+            current = default_kinematics_parameters
+        overrides = dict(overrides)
+        if isinstance(overrides.get('population'), dict):
+            overrides['population'] = PopulationParameters(**{key: tuple(value) if isinstance(value, list) else value for key, value in overrides['population'].items()})
+        overrides = {key: tuple(value) if isinstance(value, list) else value for key, value in overrides.items()}
+        changes[field.name] = replace(current, **overrides)
+    return replace(config, **changes)
+
+
+class ComponentCache:
+
+    """Thread-safe LRU cache of component star buffers, bounded by their total size in bytes."""
+
+    def __init__(self, max_bytes: int) -> None:
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key: tuple) -> np.ndarray | None:
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: tuple, stars: np.ndarray) -> None:
+        if stars.nbytes > self.max_bytes:
+            return
+        with self.lock:
+            if key not in self.entries:
+                self.entries[key] = stars
+                self.nbytes += stars.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+
+class GalaxyService:
+
+    """
+    Generation state kept warm between requests: a process pool forked after every import, the
+    colour lookup table and a cache of generated components. Components are keyed by their
+    parameters, engine and seed, so a request changing one component regenerates only that one.
+    """
+
+    def __init__(self, n_workers: int | None = None, cache_bytes: int = 512 * 2**20, inline_stars: int = 200_000) -> None:
+        rgb_lut()
+        self.pool = ProcessPoolExecutor(n_workers)
+        self.cache = ComponentCache(cache_bytes)
+        self.inline_stars = inline_stars # Components up to this size skip the round trip to the pool
+        self.requests = 0
+        self.started = time.time()
+
+    def component_futures(self, config: SpiralGalaxyConfig, engine: str, seed: int, chunk_size: int) -> list:
+        """One entry per component: a cached or inline star buffer, or a future of the pool."""
+        results = []
+        for index, name in enumerate(COMPONENT_NAMES):
+            parameters = component_parameters(config, name)
+            key = (name, parameters, engine, seed, chunk_size)
+            stars = self.cache.get(key)
+            if stars is None and parameters.n_stars <= self.inline_stars:
+                stars = generate_component(name, parameters, engine, derive_seed(seed, index), chunk_size)
+                self.cache.put(key, stars)
+            results.append((key, stars if stars is not None else self.pool.submit(generate_component, name, parameters, engine, derive_seed(seed, index), chunk_size)))
+        return results
+
+    def stream_galaxy(self, payload: dict, write) -> None:
+        """
+        Write a galaxy as one .npy array to write(), component by component in buffer order as each
+        is ready. The stars and velocities are those of SpiralGalaxy.generate_galaxy() with the same
+        seed; with "colours" the RED, GREEN, BLUE columns of the colour lookup table are appended.
+        """
+        config = config_from_payload(payload.get('config', {}))
+        engine = payload.get('engine', 'tabulated')
+        seed = payload.get('seed')
+        seed = np.random.SeedSequence().entropy if seed is None else int(seed)
+        chunk_size = int(payload.get('chunk_size', CHUNK_SIZE))
+        kinematics = config.kinematics_parameters
+
+        columns = STAR_COLUMNS + (VELOCITY_COLUMNS if kinematics is not None else ()) + (COLOUR_COLUMNS if payload.get('colours') else ())
+        dtype = np.dtype([(column, np.float32) for column in columns])
+        counts = [component_parameters(config, name).n_stars for name in COMPONENT_NAMES]
+        slices = {}
+        start = 0
+        for name, n in zip(COMPONENT_NAMES, counts):
+            slices[name] = [start, start + n]
+            start += n
+
+        results = self.component_futures(config, engine, seed, chunk_size)
+        header = io.BytesIO()
+        np.lib.format.write_array_header_1_0(header, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (sum(counts),)})
+        write.begin({'seed': seed, 'components': slices}, len(header.getvalue()) + dtype.itemsize * sum(counts))
+        write(header.getvalue())
+
+        if kinematics is not None:
+            curve = build_rotation_curve(config, kinematics)
+            velocity_rng = np.random.default_rng(derive_seed(seed, 5))
+        for name, (key, result) in zip(COMPONENT_NAMES, results):
+            if not isinstance(result, np.ndarray):
+                result = result.result()
+                self.cache.put(key, result)
+            stars = np.zeros(len(result), dtype=dtype)
+            for column in STAR_COLUMNS:
+                stars[column] = result[column]
+            if kinematics is not None:
+                # Components in buffer order consume the velocity stream exactly as SpiralGalaxy does
+                assign_velocities(stars, {name: slice(0, len(stars))}, curve, kinematics, velocity_rng, chunk_size)
+            if payload.get('colours'):
+                rgb = temps_to_rgb(stars['T'])
+                for axis, column in enumerate(COLOUR_COLUMNS):
+                    stars[column] = rgb[:, axis]
+            write(stars.tobytes())
+        self.requests += 1
+
+    def status(self) -> dict:
+        return {
+            'requests': self.requests,
+            'uptime': time.time() - self.started,
+            'cache_entries': len(self.cache.entries),
+            'cache_bytes': self.cache.nbytes,
+            'cache_hits': self.cache.hits,
+            'cache_misses': self.cache.misses,
+        }
+
+
+class ResponseWriter:
+
+    """Streams a response body of known length, sending the headers when the body begins."""
+
+    def __init__(self, handler: BaseHTTPRequestHandler) -> None:
+        self.handler = handler
+        self.started = False
+
+    def begin(self, metadata: dict, length: int) -> None:
+        self.handler.send_response(200)
+        self.handler.send_header('Content-Type', 'application/x-npy')
+        self.handler.send_header('Content-Length', str(length))
+        self.handler.send_header('X-Galaxy', json.dumps(metadata))
+        self.handler.end_headers()
+        self.started = True
+
+    def __call__(self, data: bytes) -> None:
+        self.handler.wfile.write(data)
+
+
+class ServiceHandler(BaseHTTPRequestHandler):
+
+    """POST /generate with a JSON request streams back a .npy array; GET /status returns JSON."""
+
+    service: GalaxyService
+
+    def address_string(self) -> str:
+        # Unix socket clients have no address
+        return self.client_address[0] if self.client_address else 'unix'
+
+    def log_message(self, format: str, *args) -> None:
+        pass
+
+    def send_json(self, code: int, body: dict) -> None:
+        data = json.dumps(body).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self) -> None:
+        if self.path == '/status':
+            self.send_json(200, self.service.status())
+        else:
+            self.send_json(404, {'error': f'No such endpoint {self.path}'})
+
+    def do_POST(self) -> None:
+        if self.path != '/generate':
+            self.send_json(404, {'error': f'No such endpoint {self.path}'})
+            return
+        try:
+            payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except json.JSONDecodeError as error:
+            self.send_json(400, {'error': str(error)})
+            return
+
+        writer = ResponseWriter(self)
+        try:
+            self.service.stream_galaxy(payload, writer)
+        except (TypeError, ValueError, AttributeError) as error:
+            # Bad requests are reported as long as nothing has been streamed yet
+            if writer.started:
+                raise
+            self.send_json(400, {'error': str(error)})
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def serve(address: str | int = DEFAULT_PORT, n_workers: int | None = None) -> None:
+    """Serve on a localhost port, or on a Unix socket when address is a path."""
+    ServiceHandler.service = GalaxyService(n_workers)
+    if isinstance(address, str) and not address.isdigit():
+        if os.path.exists(address):
+            os.remove(address)
+        server = UnixHTTPServer(address, ServiceHandler)
+        print(f"Galaxy service listening on unix socket {address}")
+    else:
+        server = ThreadingHTTPServer(('127.0.0.1', int(address)), ServiceHandler)
+        print(f"Galaxy service listening on http://127.0.0.1:{int(address)}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        ServiceHandler.service.pool.shutdown()
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+
+    def __init__(self, path: str, timeout: float | None = None) -> None:
+        super().__init__('localhost', timeout=timeout)
+        self.unix_path = path
+
+    def connect(self) -> None:
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.unix_path)
+
+
+def request_galaxy(payload: dict, address: str | int = DEFAULT_PORT, timeout: float | None = None) -> tuple[np.ndarray, dict[str, slice], int]:
+    """Ask a running service for a galaxy, returning its star buffer, component slices and seed."""
+    if isinstance(address, str) and not address.isdigit():
+        connection = UnixHTTPConnection(address, timeout)
+    else:
+        connection = http.client.HTTPConnection('127.0.0.1', int(address), timeout=timeout)
+    try:
+        connection.request('POST', '/generate', json.dumps(payload), {'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        body = response.read()
+        if response.status != 200:
+            raise RuntimeError(f"Galaxy service error {response.status}: {json.loads(body).get('error')}")
+        metadata = json.loads(response.getheader('X-Galaxy'))
+    finally:
+        connection.close()
+
+    f = io.BytesIO(body)
+    np.lib.format.read_magic(f)
+    _, _, dtype = np.lib.format.read_array_header_1_0(f)
+    stars = np.frombuffer(body, dtype=dtype, offset=f.tell())
+    return stars, {name: slice(*bounds) for name, bounds in metadata['components'].items()}, metadata['seed']
+
+
+def main():
+    # python galaxy_service.py [port | unix socket path]
+    serve(sys.argv[1] if len(sys.argv) > 1 else DEFAULT_PORT)
+
+if __name__ == "__main__":
+    main()
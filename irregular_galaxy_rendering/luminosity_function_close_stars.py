@@ -1,11 +1,13 @@
 import numpy as np
-import scipy
 import matplotlib.pyplot as plt
-import pandas as pd
 import math
-from scipy.optimize import curve_fit
+import sys
+import os
 from scipy.interpolate import CubicSpline
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from spiral_galaxy_components.luminosity_function import LuminosityFunction
+
 
 def vector(r, theta, phi): 
     theta = math.radians(theta)
@@ -16,22 +18,20 @@ def vector(r, theta, phi):
     return np.array([x,y,z])
 
 
+if __name__ == '__main__': 
+    # Builds the histogram from parallax_greater_than_10.csv, or loads it from the cache
+    luminosity_function = LuminosityFunction()
+    bin_centers = luminosity_function.bin_centers
+    n = luminosity_function.counts
 
-df = pd.read_csv('parallax_greater_than_10.csv')
-df['distance'] = 1000/df['parallax']
-df['absolute_magnitude'] = df['phot_g_mean_mag'] - 5*np.log10(df['distance']/10)
-
-n, bins, patches = plt.hist(df['absolute_magnitude'], np.linspace(min(df['absolute_magnitude']), max(df['absolute_magnitude']), 100))
-
-bin_centers = (bins[:-1] + bins[1:]) / 2
-popt, _ = curve_fit(lambda x, a, b, c, d, e, f, g, h, i: a*x**8 + b*x**7 + c*x**6 + d*x**5 + e*x**4 + f*x**3 + g*x**2 + h*x + i, bin_centers, n)
+    plt.bar(bin_centers, n, width=bin_centers[1]-bin_centers[0])
 
-spline = CubicSpline(bin_centers, n)
+    spline = CubicSpline(bin_centers, n)
 
-x_fit = np.linspace(min(bin_centers), max(bin_centers), 100)
-y_fit = spline(x_fit)
-plt.plot(x_fit, y_fit, color='r', lw=2)
+    x_fit = np.linspace(min(bin_centers), max(bin_centers), 100)
+    y_fit = spline(x_fit)
+    plt.plot(x_fit, y_fit, color='r', lw=2)
 
 
-plt.xlim(max(bin_centers), min(bin_centers))
-plt.show()
+    plt.xlim(max(bin_centers), min(bin_centers))
+    plt.show()
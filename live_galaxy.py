@@ -0,0 +1,147 @@
+import importlib
+import os
+import time
+import numpy as np
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+import spiral_galaxy_components.config as config_module
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import COMPONENT_NAMES, component_index, component_parameters, generate_component
+from spiral_galaxy_components.helper import derive_seed
+from render import create_visualizer, set_star_points, star_point_cloud
+
+
+@dataclass
+class LiveGalaxy:
+
+    """
+    Interactive tuning loop: watches spiral_galaxy_components/config.py and, whenever it is saved,
+    regenerates only the components whose parameters changed on a background worker, then swaps
+    their point clouds in the open window. Every component keeps its seed, so unchanged components
+    never move and a component only changes where its parameters did.
+    """
+
+    config_name: str = 'default_config' # Config in config.py to follow
+    engine: str = 'tabulated'
+    seed: int | None = None
+    poll_interval: float = 0.25 # Seconds between checks of config.py
+    max_workers: int | None = None
+
+    config: config_module.SpiralGalaxyConfig = field(init=False)
+    buffers: dict[str, np.ndarray] = field(init=False, default_factory=dict) # Current stars of each component
+    _mtime: float = field(init=False, default=0.0)
+    _pending: dict[str, Future] = field(init=False, default_factory=dict)
+
+    def __post_init__(self) -> None:
+        if self.seed is None:
+            self.seed = np.random.SeedSequence().entropy
+        self._mtime = os.path.getmtime(config_module.__file__)
+        self.config = getattr(config_module, self.config_name)
+
+    def reload_config(self) -> config_module.SpiralGalaxyConfig | None:
+        """Return the edited config if config.py was saved since the last check, otherwise None."""
+        mtime = os.path.getmtime(config_module.__file__)
+        if mtime == self._mtime:
+            return None
+        self._mtime = mtime
+        try:
+            return getattr(importlib.reload(config_module), self.config_name)
+        except Exception as error:
+            # A half-written edit must not end the session
+            print(f"Could not load {self.config_name}: {error}")
+            return None
+
+    def changed_components(self, config: config_module.SpiralGalaxyConfig) -> list[str]:
+        # Reloading creates new parameter classes, so compare field values rather than the objects
+        return [
+            name for name in COMPONENT_NAMES
+            if asdict(component_parameters(config, name)) != asdict(component_parameters(self.config, name))
+        ]
+
+    def submit(self, executor: ProcessPoolExecutor, name: str) -> None:
+        """
+        Start regenerating a component. A job of an older edit still queued for it is cancelled; one
+        already running cannot be stopped, and its result is dropped when it finishes.
+        """
+        seed = derive_seed(self.seed, component_index(name))
+        if name in self._pending:
+            self._pending[name].cancel()
+        self._pending[name] = executor.submit(generate_component, name, component_parameters(self.config, name), self.engine, seed)
+
+    def collect(self) -> list[str]:
+        """Move finished jobs into buffers and return the names of the components that changed."""
+        changed = []
+        for name in [name for name, future in self._pending.items() if future.done()]:
+            future = self._pending.pop(name)
+            try:
+                self.buffers[name] = future.result()
+                changed.append(name)
+            except Exception as error:
+                print(f"Could not generate {name}: {error}")
+        return changed
+
+    def run(self) -> SpiralGalaxy:
+        """Show the galaxy until the window is closed and return it with the last generated components."""
+        vis = create_visualizer('Live galaxy')
+        geometries = {}
+        last_poll = 0.0
+
+        with ProcessPoolExecutor(self.max_workers) as executor:
+            for name in COMPONENT_NAMES:
+                self.submit(executor, name)
+
+            while vis.poll_events():
+                now = time.monotonic()
+                if now - last_poll > self.poll_interval:
+                    last_poll = now
+                    config = self.reload_config()
+                    if config is not None:
+                        changed = self.changed_components(config)
+                        self.config = config
+                        for name in changed:
+                            self.submit(executor, name)
+                        if changed:
+                            print(f"Regenerating {', '.join(changed)}")
+
+                for name in self.collect():
+                    stars = self.buffers[name]
+                    if name not in geometries:
+                        geometries[name] = star_point_cloud(stars)
+                        vis.add_geometry(geometries[name])
+                    else:
+                        # Swap this component's points in place, the other clouds are left untouched
+                        set_star_points(geometries[name], stars)
+                        vis.update_geometry(geometries[name])
+                vis.update_renderer()
+
+            # Queued jobs, including those replaced by newer edits, are cancelled rather than waited for
+            executor.shutdown(cancel_futures=True)
+
+        vis.destroy_window()
+        return self.galaxy()
+
+    def galaxy(self) -> SpiralGalaxy:
+        """A SpiralGalaxy holding the current components, with its seed, so it can be exported or reproduced."""
+        galaxy = SpiralGalaxy(self.config, self.engine, self.seed)
+        missing = [name for name in COMPONENT_NAMES if name not in self.buffers]
+        for name in missing:
+            self.buffers[name] = generate_component(name, component_parameters(self.config, name), self.engine, derive_seed(self.seed, component_index(name)))
+        galaxy.merge_components(self.buffers)
+        galaxy.set_components()
+        return galaxy
+
+
+def main():
+    import sys
+
+    # python live_galaxy.py [config_name], then edit and save spiral_galaxy_components/config.py
+    live = LiveGalaxy(*sys.argv[1:2])
+    print(f"Watching {config_module.__file__}, seed {live.seed}")
+    spiral_galaxy = live.run()
+
+    e = input("Export stars? (y/n): ")
+    if e.lower() == 'y':
+        spiral_galaxy.export()
+
+if __name__ == "__main__":
+    main()
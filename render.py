@@ -1,39 +1,178 @@
 import open3d as o3d
 import pandas as pd
 import numpy as np
-from colour_rendering.temp_to_rgb import temp_to_rgb
+import queue
+import threading
+import time
+from collections.abc import Iterable
+from colour_rendering.temp_to_rgb import temps_to_rgb
+from spiral_galaxy_components.shared_buffer import SharedStarBuffer
+from spiral_galaxy_components.quantize import QUANTIZED_SUFFIX, decode_stars, load_quantized
+from spiral_galaxy_components.star_buffer import star_buffer_to_dataframe
+
+def create_visualizer(window_name: str = 'Stars') -> o3d.visualization.Visualizer: 
+    # Set up a visualizer with black background and small point size
+    vis = o3d.visualization.Visualizer()
+    vis.create_window(window_name=window_name, width=1024, height=768)
+
+    # Customize rendering
+    render_option = vis.get_render_option()
+    render_option.background_color = np.array([0, 0, 0])  # Black background
+    render_option.point_size = 1.0  # Smaller point size for finer stars
+    render_option.show_coordinate_frame = False  # Hide XYZ axes
+
+    return vis
 
 def render_open3d(stars: pd.DataFrame) -> None: 
     # Extract coordinates and temperature
     points = stars[['XX', 'YY', 'ZZ']].values
 
-    # Convert temperatures to colors for each temperature
-    CC = [temp_to_rgb(temp, out_fmt='rgb') for temp in stars['T']]
+    # Convert temperatures to colors through the lookup table
+    CC = temps_to_rgb(stars['T'].values)
 
     # Create Open3D point cloud
     pcd = o3d.geometry.PointCloud()
     pcd.points = o3d.utility.Vector3dVector(points)
     pcd.colors = o3d.utility.Vector3dVector(CC)
 
-    # Set up a visualizer with black background and small point size
-    vis = o3d.visualization.Visualizer()
-    vis.create_window(window_name='Stars', width=1024, height=768)
+    vis = create_visualizer()
     vis.add_geometry(pcd)
 
-    # Customize rendering
-    render_option = vis.get_render_option()
-    render_option.background_color = np.array([0, 0, 0])  # Black background
-    render_option.point_size = 1.0  # Smaller point size for finer stars
-    render_option.show_coordinate_frame = False  # Hide XYZ axes
-
     # Run visualizer
     vis.run()
     vis.destroy_window()
 
 
+def set_star_points(pcd: o3d.geometry.PointCloud, stars: np.ndarray) -> None: 
+    """Replace the points of a point cloud with a star buffer, coloured by temperature."""
+    pcd.points = o3d.utility.Vector3dVector(np.column_stack([stars['XX'], stars['YY'], stars['ZZ']]).astype(np.float64))
+    pcd.colors = o3d.utility.Vector3dVector(temps_to_rgb(stars['T']))
+
+def star_point_cloud(stars: np.ndarray) -> o3d.geometry.PointCloud: 
+    pcd = o3d.geometry.PointCloud()
+    set_star_points(pcd, stars)
+    return pcd
+
+def render_open3d_progressive(chunks: Iterable[tuple[str, np.ndarray]]) -> dict[str, o3d.geometry.PointCloud]: 
+    """
+    Show stars as they arrive from an iterable of (name, star buffer) chunks.
+
+    The chunks are consumed on a background thread and the window runs a non-blocking event loop,
+    adding one point cloud per chunk, so it stays responsive while generation goes on. Closing the
+    window early still lets the iterable run to completion. Returns the point clouds by name.
+    """
+    ready = queue.Queue()
+    done = object()
+    errors = []
+
+    def consume() -> None: 
+        try: 
+            for chunk in chunks: 
+                ready.put(chunk)
+        except Exception as error: 
+            errors.append(error)
+        finally: 
+            ready.put(done)
+
+    producer = threading.Thread(target=consume, daemon=True)
+    producer.start()
+
+    vis = create_visualizer()
+    geometries = {}
+    finished = False
+    while vis.poll_events(): 
+        while not finished: 
+            try: 
+                chunk = ready.get(timeout=0.01)
+            except queue.Empty: 
+                break
+            if chunk is done: 
+                finished = True
+                break
+            name, stars = chunk
+            geometries[name] = star_point_cloud(stars)
+            # Widen the view to everything shown so far, the bulge alone would leave the disk off screen
+            vis.add_geometry(geometries[name])
+        vis.update_renderer()
+
+    vis.destroy_window()
+    producer.join()
+    if errors: 
+        raise errors[0]
+    return geometries
+
+
+def animate_open3d(rotation, temperatures: np.ndarray, steps_per_frame: int = 1) -> None: 
+    """Show a DifferentialRotation until the window is closed, stepping it once per frame."""
+    pcd = o3d.geometry.PointCloud()
+    pcd.points = o3d.utility.Vector3dVector(rotation.positions)
+    pcd.colors = o3d.utility.Vector3dVector(temps_to_rgb(temperatures))
+
+    # The rotation writes straight into the point cloud's memory, so frames allocate nothing
+    rotation.use_buffer(np.asarray(pcd.points))
+
+    vis = create_visualizer('Differential rotation')
+    vis.add_geometry(pcd)
+
+    while vis.poll_events(): 
+        rotation.step(steps_per_frame)
+        vis.update_geometry(pcd)
+        vis.update_renderer()
+
+    vis.destroy_window()
+
+
+def watch_shared_open3d(name: str, poll_interval: float = 0.2) -> None: 
+    """
+    Show the stars a generator publishes to shared memory, refreshing whenever a new version is
+    published, until the window is closed. Waits for the publisher if it has not started yet, and
+    attaches again when it replaces the segment, e.g. by a larger one.
+    """
+    buffer = None
+    pcd = o3d.geometry.PointCloud()
+    shown = False
+    shown_version = 0
+    last_poll = 0.0
+
+    vis = create_visualizer(f'Stars ({name})')
+    while vis.poll_events(): 
+        now = time.monotonic()
+        if now - last_poll > poll_interval: 
+            last_poll = now
+            if buffer is not None and buffer.retired(): 
+                buffer.close()
+                buffer, shown_version = None, 0
+            try: 
+                buffer = buffer or SharedStarBuffer.attach(name)
+            except (FileNotFoundError, ValueError): 
+                # Not created yet, or its header is not written yet: try again at the next poll
+                pass
+            published = buffer.stars() if buffer is not None and buffer.version() != shown_version else None
+            if published is not None: 
+                stars, _, version = published
+                set_star_points(pcd, stars)
+                # Only keep the copy if the publisher did not write over it meanwhile
+                if buffer.version() == version: 
+                    if not shown: 
+                        vis.add_geometry(pcd)
+                        shown = True
+                    else: 
+                        vis.update_geometry(pcd)
+                    shown_version = version
+                del stars, published
+        vis.update_renderer()
+
+    vis.destroy_window()
+    if buffer is not None: 
+        buffer.close()
+
+
 def render_open3d_file(file_dir: str) -> None: 
-    # Load CSV
-    stars = pd.read_csv(file_dir)
+    # Load CSV, or decode a quantized .gqz file
+    if file_dir.endswith(QUANTIZED_SUFFIX): 
+        stars = star_buffer_to_dataframe(decode_stars(load_quantized(file_dir)))
+    else: 
+        stars = pd.read_csv(file_dir)
 
     # Render DF
     render_open3d(stars)
@@ -43,12 +182,17 @@ def render_open3d_file(file_dir: str) -> None:
 if __name__ == '__main__': 
     import sys
 
+    # python render.py --shm <name> follows stars published to shared memory by SpiralGalaxy.publish()
+    if len(sys.argv) == 3 and sys.argv[1] == '--shm': 
+        watch_shared_open3d(sys.argv[2])
+        sys.exit()
+
     if len(sys.argv) == 2:
         file_path = sys.argv[1]
     elif len(sys.argv) == 1:
         file_path = input("Enter the relative path to the file you want to view: ").strip()
     else: 
-        raise ValueError("Usage: python render.py <path_to_csv_file>")
+        raise ValueError("Usage: python render.py <path_to_csv_or_gqz_file>")
     
     csv_path = sys.argv[1]
     render_open3d_file(file_dir=csv_path)
\ No newline at end of file
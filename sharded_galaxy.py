@@ -0,0 +1,359 @@
+import ipaddress
+import json
+import os
+import queue
+import secrets
+import socket
+import subprocess
+import sys
+import threading
+import time
+import numpy as np
+from collections.abc import Callable, Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from multiprocessing.managers import BaseManager
+from spiral_galaxy_components.components import CHUNK_SIZE, COMPONENT_NAMES, chunk_bounds, component_parameters, sample_component_chunks
+from spiral_galaxy_components.config import SpiralGalaxyConfig
+from spiral_galaxy_components.helper import derive_seed
+from spiral_galaxy_components.kinematics import assign_velocities, build_rotation_curve
+from spiral_galaxy_components.star_buffer import star_dtype
+
+MANIFEST_FORMAT = 'galaxy-shards 1'
+# Seed key of the per-shard velocity streams, as in the kinematics stage of SpiralGalaxy
+KINEMATICS_KEY = 5
+# Seconds between the heartbeats of a TCP worker, and of silence after which it is presumed dead
+HEARTBEAT_INTERVAL = 2.0
+HEARTBEAT_TIMEOUT = 30.0
+# Workers read the coordinator's key, in hex, from this environment variable or else from stdin,
+# never from the command line where every user of the machine can see it
+AUTHKEY_ENV = 'GALAXY_AUTHKEY'
+# The old built-in key, public and so refused for anything but loopback
+DEFAULT_AUTHKEY = b'galaxy'
+
+
+@dataclass(frozen=True)
+class Shard:
+
+    """A contiguous range of whole chunks of one component, written to one partition file."""
+
+    component: str
+    index: int # Position of the shard in the plan
+    first_chunk: int
+    last_chunk: int
+    start: int # First star of the shard within the component
+    stop: int
+
+    @property
+    def file_name(self) -> str:
+        return f'part-{self.index:05d}-{self.component}.npy'
+
+
+def plan_shards(config: SpiralGalaxyConfig, chunks_per_shard: int = 8, chunk_size: int = CHUNK_SIZE) -> list[Shard]:
+    """Split every component into shards of chunks_per_shard chunks, in buffer order."""
+    shards = []
+    for name in COMPONENT_NAMES:
+        bounds = chunk_bounds(component_parameters(config, name).n_stars, chunk_size)
+        for first in range(0, len(bounds), chunks_per_shard):
+            last = min(first + chunks_per_shard, len(bounds))
+            shards.append(Shard(name, len(shards), first, last, bounds[first][0], bounds[last - 1][1]))
+    return shards
+
+def run_shard(task: tuple[Shard, SpiralGalaxyConfig, int, int, str]) -> dict:
+    """
+    Generate one shard and write it to its partition, returning the partition's manifest entry.
+
+    The stars are those of the same chunks in SpiralGalaxy.generate_galaxy() with the same seed.
+    Velocities, if the config has kinematics, come from a stream of their own per shard.
+    """
+    shard, config, seed, chunk_size, output_dir = task
+    index = COMPONENT_NAMES.index(shard.component)
+    stars = sample_component_chunks(shard.component, component_parameters(config, shard.component), derive_seed(seed, index), shard.first_chunk, shard.last_chunk, chunk_size)
+
+    if config.kinematics_parameters is not None:
+        with_velocities = np.zeros(len(stars), dtype=star_dtype(True))
+        for column in stars.dtype.names:
+            with_velocities[column] = stars[column]
+        stars = with_velocities
+        curve = build_rotation_curve(config, config.kinematics_parameters)
+        rng = np.random.default_rng(derive_seed(seed, KINEMATICS_KEY, index, shard.first_chunk))
+        assign_velocities(stars, {shard.component: slice(0, len(stars))}, curve, config.kinematics_parameters, rng)
+
+    # Write to a temporary name first so a partition is never seen half written
+    path = os.path.join(output_dir, shard.file_name)
+    np.save(path + '.tmp.npy', stars)
+    os.replace(path + '.tmp.npy', path)
+    return {'file': shard.file_name, 'component': shard.component, 'start': shard.start, 'stop': shard.stop, 'n_stars': len(stars)}
+
+
+class LocalProcessBackend:
+
+    """Runs shards on a process pool on this machine."""
+
+    def __init__(self, n_workers: int | None = None) -> None:
+        self.n_workers = n_workers
+
+    def map(self, function: Callable, tasks: Iterable) -> Iterator:
+        with ProcessPoolExecutor(self.n_workers) as executor:
+            yield from executor.map(function, tasks)
+
+
+class _QueueManager(BaseManager):
+    pass
+
+def _serve_queue(q: queue.Queue) -> Callable[[], queue.Queue]:
+    return lambda: q
+
+
+class TCPQueueBackend:
+
+    """
+    Runs shards on workers anywhere on the network through a task and a result queue served by the
+    coordinator over TCP. Each worker runs
+
+        GALAXY_AUTHKEY=<authkey in hex> python sharded_galaxy.py worker <host> <port>
+
+    and pulls shards until the coordinator is done. The queue hands out pickled callables, so the
+    key must stay secret: by default a random one is made for every backend and printed when
+    serving beyond loopback, and the public DEFAULT_AUTHKEY is refused on other hosts. With spawn_local_workers > 0 the coordinator
+    starts that many workers on this machine itself, which stands in for a multi-node run.
+
+    Workers report every task they start and send heartbeats while they run. A worker whose process
+    exits or whose heartbeats stop for heartbeat_timeout seconds is presumed dead and its task is
+    handed out again, up to max_attempts times. The run fails when every local worker has exited,
+    or when no worker at all is alive for idle_timeout seconds.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, authkey: bytes | None = None, spawn_local_workers: int = 0,
+                 heartbeat_timeout: float = HEARTBEAT_TIMEOUT, idle_timeout: float = 300.0, max_attempts: int = 3) -> None:
+        if authkey == DEFAULT_AUTHKEY and not is_loopback(host):
+            raise ValueError(f'The default authkey is public; pass a secret one, or none for a random one, to serve on {host}')
+        self.host = host
+        self.port = port
+        self.authkey = authkey if authkey is not None else secrets.token_bytes(32)
+        self.spawn_local_workers = spawn_local_workers
+        self.heartbeat_timeout = heartbeat_timeout
+        self.idle_timeout = idle_timeout
+        self.max_attempts = max_attempts
+
+    def map(self, function: Callable, tasks: Iterable) -> Iterator:
+        tasks = list(tasks)
+        task_queue = queue.Queue()
+        result_queue = queue.Queue()
+        _QueueManager.register('tasks', callable=_serve_queue(task_queue))
+        _QueueManager.register('results', callable=_serve_queue(result_queue))
+        manager = _QueueManager(address=(self.host, self.port), authkey=self.authkey)
+        server = manager.get_server()
+        host, port = server.address
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f"Serving {len(tasks)} tasks on {host}:{port}")
+        if not is_loopback(self.host):
+            print(f"Start workers with {AUTHKEY_ENV}={self.authkey.hex()} python {os.path.basename(__file__)} worker {socket.gethostname()} {port}")
+
+        environment = {**os.environ, AUTHKEY_ENV: self.authkey.hex()}
+        workers = [
+            subprocess.Popen([sys.executable, os.path.abspath(__file__), 'worker', host, str(port)], env=environment)
+            for _ in range(self.spawn_local_workers)
+        ]
+        attempts = dict.fromkeys(range(len(tasks)), 1)
+
+        def hand_out_again(index: int, reason: str) -> None:
+            if attempts[index] >= self.max_attempts:
+                raise RuntimeError(f'Task {index} was lost {attempts[index]} times, last because {reason}')
+            attempts[index] += 1
+            print(f"Task {index} handed out again: {reason}")
+            task_queue.put((index, function, tasks[index]))
+
+        try:
+            for index, task in enumerate(tasks):
+                task_queue.put((index, function, task))
+
+            results = {}
+            running = {} # Task index each worker last started
+            last_seen = {} # Time of each live worker's last message
+            idle_since = unclaimed_since = time.monotonic()
+            while len(results) < len(tasks):
+                try:
+                    kind, worker, index, ok, result = result_queue.get(timeout=HEARTBEAT_INTERVAL)
+                    last_seen[worker] = time.monotonic()
+                    if kind == 'start':
+                        running[worker] = index
+                    elif kind == 'done':
+                        running.pop(worker, None)
+                        if not ok:
+                            raise RuntimeError(f'Task {index} failed on worker {worker}: {result}')
+                        # A task handed out twice may finish twice; both runs give the same result
+                        results.setdefault(index, result)
+                except queue.Empty:
+                    pass
+
+                now = time.monotonic()
+                exited = {(socket.gethostname(), process.pid) for process in workers if process.poll() is not None}
+                for worker in [worker for worker, seen in last_seen.items() if worker in exited or now - seen > self.heartbeat_timeout]:
+                    del last_seen[worker]
+                    index = running.pop(worker, None)
+                    if index is not None and index not in results:
+                        hand_out_again(index, f'worker {worker} {"exited" if worker in exited else "stopped sending heartbeats"}')
+
+                # A worker that died between taking a task and reporting it leaves the task unclaimed
+                unclaimed = set(range(len(tasks))) - results.keys() - set(running.values())
+                if not (task_queue.empty() and unclaimed):
+                    unclaimed_since = now
+                elif now - unclaimed_since > self.heartbeat_timeout:
+                    for index in sorted(unclaimed):
+                        hand_out_again(index, 'it was taken but never started')
+                    unclaimed_since = now
+
+                if last_seen or any(process.poll() is None for process in workers):
+                    idle_since = now
+                elif workers:
+                    raise RuntimeError(f'Every local worker exited with {len(tasks) - len(results)} tasks left')
+                elif now - idle_since > self.idle_timeout:
+                    raise TimeoutError(f'No worker has been alive for {self.idle_timeout:.0f} s with {len(tasks) - len(results)} tasks left')
+
+            for index in range(len(tasks)):
+                yield results[index]
+        except BaseException:
+            # Do not wait for local workers still busy with tasks of a failed run
+            for process in workers:
+                process.terminate()
+            raise
+        finally:
+            # Workers put the stop signal back so every other worker sees it too
+            task_queue.put(None)
+            for process in workers:
+                process.wait()
+            server.stop_event.set()
+
+
+def is_loopback(host: str) -> bool:
+    try:
+        return ipaddress.ip_address(socket.gethostbyname(host)).is_loopback
+    except (OSError, ValueError):
+        return False
+
+def read_authkey() -> bytes:
+    """The coordinator's key, from GALAXY_AUTHKEY or else a line of stdin, in hex."""
+    key = os.environ.get(AUTHKEY_ENV)
+    if key is None:
+        if sys.stdin.isatty():
+            print(f"{AUTHKEY_ENV} is not set, enter the coordinator's authkey: ", end='', file=sys.stderr, flush=True)
+        key = sys.stdin.readline()
+    return bytes.fromhex(key.strip())
+
+def run_worker(host: str, port: int, authkey: bytes) -> None:
+    """Pull tasks from a TCPQueueBackend coordinator until it signals the end, sending heartbeats meanwhile."""
+    _QueueManager.register('tasks')
+    _QueueManager.register('results')
+    manager = _QueueManager(address=(host, port), authkey=authkey)
+    manager.connect()
+    tasks = manager.tasks()
+    results = manager.results()
+    worker = (socket.gethostname(), os.getpid())
+    stopped = threading.Event()
+
+    def send_heartbeats() -> None:
+        try:
+            while not stopped.wait(HEARTBEAT_INTERVAL):
+                results.put(('heartbeat', worker, None, True, None))
+        except (OSError, EOFError):
+            # The coordinator is gone
+            return
+    threading.Thread(target=send_heartbeats, daemon=True).start()
+
+    try:
+        while True:
+            item = tasks.get()
+            if item is None:
+                tasks.put(None)
+                return
+            index, function, task = item
+            results.put(('start', worker, index, True, None))
+            try:
+                results.put(('done', worker, index, True, function(task)))
+            except Exception as error:
+                results.put(('done', worker, index, False, repr(error)))
+    finally:
+        stopped.set()
+
+
+def generate_sharded(config: SpiralGalaxyConfig, output_dir: str, seed: int | None = None, backend=None,
+                     chunks_per_shard: int = 8, chunk_size: int = CHUNK_SIZE) -> str:
+    """
+    Generate a galaxy as deterministic shards on a backend and write the manifest tying the
+    partitions into one dataset. Returns the manifest path.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    backend = backend or LocalProcessBackend()
+    os.makedirs(output_dir, exist_ok=True)
+
+    shards = plan_shards(config, chunks_per_shard, chunk_size)
+    print(f"\n---------- Sharded generation: {len(shards)} shards ----------")
+    start_time = time.perf_counter()
+    partitions = list(backend.map(run_shard, [(shard, config, seed, chunk_size, output_dir) for shard in shards]))
+
+    component_ranges = {}
+    offset = 0
+    for name in COMPONENT_NAMES:
+        n = sum(partition['n_stars'] for partition in partitions if partition['component'] == name)
+        component_ranges[name] = [offset, offset + n]
+        offset += n
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'seed': seed,
+        'chunk_size': chunk_size,
+        'n_stars': offset,
+        'dtype': np.lib.format.dtype_to_descr(star_dtype(config.kinematics_parameters is not None)),
+        'components': component_ranges,
+        'partitions': partitions,
+        'config': asdict(config),
+    }
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    print(f"{offset} stars in {len(partitions)} partitions written to {output_dir} in {time.perf_counter() - start_time:.1f} s")
+    return manifest_path
+
+
+def read_manifest(manifest_path: str) -> dict:
+    with open(manifest_path) as f:
+        manifest = json.load(f)
+    if manifest.get('format') != MANIFEST_FORMAT:
+        raise ValueError(f'{manifest_path} is not a sharded galaxy manifest')
+    return manifest
+
+def iter_partitions(manifest_path: str) -> Iterator[tuple[dict, np.ndarray]]:
+    """Yield every partition entry with its stars memory-mapped, in dataset order."""
+    manifest = read_manifest(manifest_path)
+    directory = os.path.dirname(os.path.abspath(manifest_path))
+    for partition in manifest['partitions']:
+        yield partition, np.load(os.path.join(directory, partition['file']), mmap_mode='r')
+
+def load_sharded(manifest_path: str) -> tuple[np.ndarray, dict[str, slice]]:
+    """Concatenate a sharded dataset into one star buffer with its component slices, for datasets that fit in memory."""
+    manifest = read_manifest(manifest_path)
+    stars = np.empty(manifest['n_stars'], dtype=np.lib.format.descr_to_dtype(manifest['dtype']))
+    start = 0
+    for _, partition in iter_partitions(manifest_path):
+        stars[start:start + len(partition)] = partition
+        start += len(partition)
+    return stars, {name: slice(*bounds) for name, bounds in manifest['components'].items()}
+
+
+def main():
+    # python sharded_galaxy.py <output_dir> [n_local_tcp_workers]
+    # or GALAXY_AUTHKEY=<hex> python sharded_galaxy.py worker <host> <port>, the key on stdin if not set
+    if len(sys.argv) == 4 and sys.argv[1] == 'worker':
+        run_worker(sys.argv[2], int(sys.argv[3]), read_authkey())
+        return
+
+    from spiral_galaxy_components.config import default_config
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else 'spiral_galaxy_shards'
+    backend = TCPQueueBackend(spawn_local_workers=int(sys.argv[2])) if len(sys.argv) > 2 else LocalProcessBackend()
+    generate_sharded(default_config, output_dir, backend=backend)
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,10 @@
 import numpy as np
 import pandas as pd
+import atexit
+import json
 import os
+from collections.abc import Iterator
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from copy import deepcopy
 from dataclasses import dataclass, field
 from spiral_galaxy_components.bulge import Bulge
@@ -8,13 +12,29 @@ from spiral_galaxy_components.bar import Bar
 from spiral_galaxy_components.disk import Disk
 from spiral_galaxy_components.spiral_arms import SpiralArms
 from spiral_galaxy_components.scattered_stars import ScatteredStars
+from spiral_galaxy_components.components import CHUNK_SIZE, COMPONENT_NAMES, build_component, component_parameters, component_star_buffer, component_view, generate_component, iter_component_chunks, sample_component
 from spiral_galaxy_components.config import *
+from spiral_galaxy_components.helper import derive_seed
+from spiral_galaxy_components.instrumentation import instrumented, stage
+from spiral_galaxy_components.kinematics import assign_velocities, build_rotation_curve
+from spiral_galaxy_components.memory_planner import MemoryPlan, choose_n_workers, plan_memory, print_memory_plan
+from spiral_galaxy_components.quantize import QUANTIZED_SUFFIX, encode_stars, print_round_trip_report, round_trip_report, save_quantized
+from spiral_galaxy_components.writer import BackgroundWriter, ChunkFile
+from spiral_galaxy_components.shared_buffer import SharedStarBuffer
+from spiral_galaxy_components.stratified import iter_stratified_stars
+from spiral_galaxy_components.star_buffer import STAR_COLUMNS, add_velocity_columns, make_star_buffer, star_buffer_to_dataframe
 
 
 @dataclass
 class SpiralGalaxy:
 
     config: SpiralGalaxyConfig = field(default_factory=lambda: deepcopy(default_config))
+    engine: str = 'tabulated'
+    seed: int | None = None
+    n_workers: int | None = None # Threads sharing the chunks of each component, defaults to the number of CPUs
+    chunk_size: int = CHUNK_SIZE
+    lean: bool = False # Keep only the star buffer: no component objects and no DataFrame, with either engine
+    memory_budget: int | None = None # Bytes the run must fit in, checked before generating and met by sampling fewer chunks at once
 
     bulge_parameters: BulgeParameters = field(init=False)
     bar_parameters: BarParameters = field(init=False)
@@ -22,11 +42,12 @@ class SpiralGalaxy:
     spiral_arm_parameters: SpiralArmParameters = field(init=False)
     scattered_stars_parameters: ScatteredStarParameters = field(init=False)
 
-    bulge: Bulge = field(init=False)
-    bar: Bar = field(init=False)
-    disk: Disk = field(init=False)
-    spiral_arms: SpiralArms = field(init=False)
-    scattered_stars: ScatteredStars = field(init=False)
+    # Component objects, None in lean mode. The tabulated engine makes them views of the star buffer, see set_components()
+    bulge: Bulge | None = field(init=False)
+    bar: Bar | None = field(init=False)
+    disk: Disk | None = field(init=False)
+    spiral_arms: SpiralArms | None = field(init=False)
+    scattered_stars: ScatteredStars | None = field(init=False)
 
     XX: np.ndarray = field(init=False) 
     YY: np.ndarray = field(init=False) 
@@ -34,12 +55,19 @@ class SpiralGalaxy:
     T: np.ndarray = field(init=False)
     B: np.ndarray = field(init=False)
     S: np.ndarray = field(init=False)
-    df: pd.DataFrame = field(init=False) 
+    df: pd.DataFrame | None = field(init=False) # None in lean mode, see dataframe()
+    stars: np.ndarray = field(init=False) # Compact structured buffer holding every star
+    component_slices: dict[str, slice] = field(init=False) # Slice of stars holding each component
+    shared: SharedStarBuffer | None = field(init=False, default=None, repr=False) # Shared memory the stars are published to
 
 
     def __post_init__(self) -> None: 
         print('\n------------- SPIRAL GALAXY GENERATION ------------\n')
 
+        # Record the entropy actually used so an unseeded run can be reproduced
+        if self.seed is None: 
+            self.seed = np.random.SeedSequence().entropy
+
         # Bulge parameters
         self.bulge_parameters = self.config.bulge_parameters
 
@@ -55,45 +83,293 @@ class SpiralGalaxy:
         # Scattered stars parameters
         self.scattered_stars_parameters = self.config.scattered_stars_parameters
 
+        if self.memory_budget is not None: 
+            self.fit_memory_budget()
+
+    @instrumented(count=lambda result, galaxy: len(galaxy.stars))
     def generate_galaxy(self) -> None: 
 
-        self.bulge = Bulge(self.bulge_parameters)
+        if self.engine == 'tabulated': 
+            self.generate_galaxy_chunked()
+            return
+
+        if self.lean: 
+            # Release every component object as soon as its stars are copied out
+            self.merge_components({
+                name: component_star_buffer(build_component(name, component_parameters(self.config, name), self.engine, derive_seed(self.seed, index)))
+                for index, name in enumerate(COMPONENT_NAMES)
+            })
+            self.set_components()
+            return
+
+        self.bulge = Bulge(self.bulge_parameters, self.engine, derive_seed(self.seed, 0))
 
-        self.bar = Bar(self.bar_parameters)
+        self.bar = Bar(self.bar_parameters, self.engine, derive_seed(self.seed, 1))
 
-        self.disk = Disk(self.disk_parameters)
+        self.disk = Disk(self.disk_parameters, self.engine, derive_seed(self.seed, 2))
 
-        self.spiral_arms = SpiralArms(self.spiral_arm_parameters)
+        self.spiral_arms = SpiralArms(self.spiral_arm_parameters, self.engine, derive_seed(self.seed, 3))
 
-        self.scattered_stars = ScatteredStars(self.scattered_stars_parameters)
+        self.scattered_stars = ScatteredStars(self.scattered_stars_parameters, self.engine, derive_seed(self.seed, 4))
         
-        self.XX = np.concatenate([self.bulge.XX, self.bar.XX, self.disk.XX, self.spiral_arms.XX, self.scattered_stars.XX])
-        self.YY = np.concatenate([self.bulge.YY, self.bar.YY, self.disk.YY, self.spiral_arms.YY, self.scattered_stars.YY])
-        self.ZZ = np.concatenate([self.bulge.ZZ, self.bar.ZZ, self.disk.ZZ, self.spiral_arms.ZZ, self.scattered_stars.ZZ])
-        self.T = np.concatenate([self.bulge.T, self.bar.T, self.disk.T, self.spiral_arms.T, self.scattered_stars.T])
-        self.B = np.concatenate([self.bulge.B, self.bar.B, self.disk.B, self.spiral_arms.B, self.scattered_stars.B])
-        self.S = np.concatenate([self.bulge.S, self.bar.S, self.disk.S, self.spiral_arms.S, self.scattered_stars.S])
-
-        self.df = pd.DataFrame({
-            'XX': self.XX, 
-            'YY': self.YY, 
-            'ZZ': self.ZZ, 
-            'T': self.T, 
-            'B': self.B, 
-            'S': self.S
-        })
+        components = {
+            'bulge': self.bulge, 
+            'bar': self.bar, 
+            'disk': self.disk, 
+            'spiral_arms': self.spiral_arms, 
+            'scattered_stars': self.scattered_stars
+        }
+        self.merge_components({name: component_star_buffer(component) for name, component in components.items()})
+
+    def plan_memory(self, output_format: str | None = 'csv') -> MemoryPlan: 
+        """Estimated peak memory of generating this galaxy and exporting it to output_format, and the file's size."""
+        return plan_memory(self.config, self.engine, output_format, self.chunk_size, self.n_workers, self.lean, self.memory_budget)
+
+    def fit_memory_budget(self, output_format: str | None = 'csv') -> None: 
+        """
+        Check the run against memory_budget before anything is allocated, lowering n_workers until it
+        fits. chunk_size is left alone, as it decides which stream every star is drawn from. Raises
+        MemoryError when a single worker does not fit either.
+        """
+        plan = self.plan_memory(output_format)
+        if not plan.fits: 
+            n_workers = choose_n_workers(self.config, self.memory_budget, self.n_workers, engine=self.engine, output_format=output_format, chunk_size=self.chunk_size, lean=self.lean)
+            if n_workers is None: 
+                print_memory_plan(plan)
+                raise MemoryError(f"{plan.n_stars} stars need about {plan.peak_bytes / 2**20:.0f} MiB, more than the budget of {self.memory_budget / 2**20:.0f} MiB; "
+                                  "try lean=True, a smaller chunk_size (which changes the stars), or sharded_galaxy.py to generate in parts")
+            print(f"Workers lowered from {plan.n_workers} to {n_workers} to fit the memory budget")
+            self.n_workers = n_workers
+            plan = self.plan_memory(output_format)
+        print_memory_plan(plan)
+
+    def write_run_record(self, output_path: str) -> None: 
+        """Write output_path.json with the seed, engine and chunk_size the exported stars were drawn with."""
+        record = {'seed': self.seed, 'engine': self.engine, 'chunk_size': self.chunk_size, 'n_stars': len(self.stars)}
+        with open(output_path + '.json', 'w') as f: 
+            json.dump(record, f, indent=1)
+
+    def generate_galaxy_chunked(self) -> None: 
+        """
+        Tabulated generation straight into the galaxy's star buffer. Every component is split into
+        chunks of chunk_size stars with their own streams, run on a thread pool of n_workers and
+        written into disjoint slices of the buffer, so a single huge component uses every core.
+        """
+        n_components = {name: component_parameters(self.config, name).n_stars for name in COMPONENT_NAMES}
+        self.stars = make_star_buffer(sum(n_components.values()), velocities=self.config.kinematics_parameters is not None)
+        self.component_slices = {}
+        start = 0
+        with ThreadPoolExecutor(self.n_workers) as executor: 
+            for index, name in enumerate(COMPONENT_NAMES): 
+                print(f"\n---------- {name.replace('_', ' ').title()} Rendering ----------")
+                self.component_slices[name] = slice(start, start + n_components[name])
+                with stage(name, n_components[name]): 
+                    sample_component(name, component_parameters(self.config, name), derive_seed(self.seed, index), self.stars[self.component_slices[name]], self.chunk_size, executor)
+                start += n_components[name]
+        self.finish_stars()
+        self.set_components()
+
+    def generate_and_export(self, output_file: str = "spiral_galaxy_stars.csv", use_process: bool = False, voxel_grid=None) -> None: 
+        """
+        generate_galaxy() and export() overlapped: every chunk goes to a background writer as soon as
+        it is drawn, so the file is written while the next chunk is generated. The stars and the
+        file are the same as generating first and exporting afterwards. output_file may end in
+        .csv or .npy. A galaxy_products.voxels.VoxelGrid given as voxel_grid is fed every chunk
+        too and finished alongside the file.
+        """
+        if self.engine != 'tabulated': 
+            raise ValueError("Overlapped export needs the 'tabulated' engine")
+        if os.path.splitext(output_file)[1] not in ('.csv', '.npy'): 
+            output_file += '.csv'
+        output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
+
+        kinematics = self.config.kinematics_parameters
+        n_components = {name: component_parameters(self.config, name).n_stars for name in COMPONENT_NAMES}
+        self.stars = make_star_buffer(sum(n_components.values()), velocities=kinematics is not None)
+        self.component_slices = {}
+        if kinematics is not None: 
+            print('\n---------- Kinematics ----------')
+            curve = build_rotation_curve(self.config, kinematics)
+            velocity_rng = np.random.default_rng(derive_seed(self.seed, 5))
+
+        start = 0
+        with stage('SpiralGalaxy.generate_and_export', len(self.stars)) as running: 
+            with BackgroundWriter(output_path, self.stars.dtype, len(self.stars), use_process=use_process) as writer: 
+                for index, name in enumerate(COMPONENT_NAMES): 
+                    print(f"\n---------- {name.replace('_', ' ').title()} Rendering ----------")
+                    self.component_slices[name] = slice(start, start + n_components[name])
+                    component = self.stars[self.component_slices[name]]
+                    for chunk in iter_component_chunks(name, component_parameters(self.config, name), derive_seed(self.seed, index), component, self.chunk_size): 
+                        if kinematics is not None: 
+                            # Chunks of chunk_size consume the velocity stream exactly as assign_velocities() does
+                            assign_velocities(component, {name: chunk}, curve, kinematics, velocity_rng, self.chunk_size)
+                        writer.write(component[chunk])
+                        if voxel_grid is not None: 
+                            voxel_grid.add(component[chunk])
+                        running.advance(len(component[chunk]))
+                    start += n_components[name]
+            running.record.bytes_written = os.path.getsize(output_path)
+        self.update_columns()
+        self.set_components()
+        self.write_run_record(output_path)
+
+        print(f"Stars exported to {output_path}")
+        if voxel_grid is not None: 
+            voxel_grid.finish()
+            print(f"Voxel fields exported to {voxel_grid.output_dir}")
+
+    def iter_components(self, max_workers: int | None = None) -> Iterator[tuple[str, np.ndarray]]: 
+        """
+        Generate the components in parallel processes and yield (name, star buffer) as each one finishes.
+
+        Every component keeps the seed it gets in generate_galaxy(), so the stars are identical,
+        only the order of arrival depends on how long each component takes.
+        """
+        with ProcessPoolExecutor(max_workers) as executor: 
+            futures = {
+                executor.submit(generate_component, name, component_parameters(self.config, name), self.engine, derive_seed(self.seed, index), self.chunk_size): name
+                for index, name in enumerate(COMPONENT_NAMES)
+            }
+            for future in as_completed(futures): 
+                yield futures[future], future.result()
+
+    def generate_galaxy_progressive(self, max_workers: int | None = None) -> Iterator[tuple[str, np.ndarray]]: 
+        """Like generate_galaxy(), but yields every component as soon as it is ready; the galaxy is complete once exhausted."""
+        buffers = {}
+        for name, stars in self.iter_components(max_workers): 
+            buffers[name] = stars
+            yield name, stars
+        self.merge_components(buffers)
+        self.set_components()
+
+    def merge_components(self, buffers: dict[str, np.ndarray]) -> None: 
+        """Copy every component's star buffer into its slice of one compact star buffer, in buffer order."""
+        n_total = sum(len(buffers[name]) for name in COMPONENT_NAMES)
+        self.stars = make_star_buffer(n_total, velocities=self.config.kinematics_parameters is not None)
+        self.component_slices = {}
+        start = 0
+        for name in COMPONENT_NAMES: 
+            self.component_slices[name] = slice(start, start + len(buffers[name]))
+            for column in STAR_COLUMNS: 
+                self.stars[column][self.component_slices[name]] = buffers[name][column]
+            start += len(buffers[name])
+        self.finish_stars()
+
+    def set_components(self) -> None: 
+        """
+        Point the component attributes at views of their slices of the star buffer, without drawing
+        any star again, or set them to None in lean mode.
+        """
+        for index, name in enumerate(COMPONENT_NAMES): 
+            component = None
+            if not self.lean: 
+                component = component_view(name, component_parameters(self.config, name), self.engine, derive_seed(self.seed, index), self.stars[self.component_slices[name]])
+            setattr(self, name, component)
+
+    def finish_stars(self) -> None: 
+        """Assign velocities if the config asks for them and point the columns at the star buffer."""
+        if self.config.kinematics_parameters is not None: 
+            self.assign_velocities(self.config.kinematics_parameters)
+        else: 
+            self.update_columns()
+
+    def generate_galaxy_stratified(self, max_stars: int | None = None, n_rounds: int = 1000) -> None: 
+        """
+        Generate the stars in a stratified, shuffled order across all components, so any prefix is an
+        unbiased preview of the galaxy. With max_stars only that prefix is generated, and it is exactly
+        the first max_stars stars of the full run. component_slices then holds arrays of star indices.
+        """
+        if self.engine != 'tabulated': 
+            raise ValueError("Stratified generation needs the 'tabulated' engine")
+
+        n_total = sum(component_parameters(self.config, name).n_stars for name in COMPONENT_NAMES)
+        n_total = n_total if max_stars is None else min(max_stars, n_total)
+        self.stars = make_star_buffer(n_total, velocities=self.config.kinematics_parameters is not None)
+        labels = np.empty(n_total, dtype=np.uint8)
+        start = 0
+        with stage('SpiralGalaxy.generate_galaxy_stratified', n_total) as running: 
+            for stars, component_labels in iter_stratified_stars(self.config, self.seed, n_rounds, max_stars): 
+                self.stars[start:start + len(stars)] = stars
+                labels[start:start + len(stars)] = component_labels
+                start += len(stars)
+                running.advance(len(stars))
+
+        self.component_slices = {name: np.flatnonzero(labels == index) for index, name in enumerate(COMPONENT_NAMES)}
+        self.update_columns()
+
+    def update_columns(self) -> None: 
+        """Point the column attributes and the DataFrame at the current star buffer."""
+        self.XX = self.stars['XX']
+        self.YY = self.stars['YY']
+        self.ZZ = self.stars['ZZ']
+        self.T = self.stars['T']
+        self.B = self.stars['B']
+        self.S = self.stars['S']
+        self.df = None if self.lean else star_buffer_to_dataframe(self.stars)
+
+    def dataframe(self, max_stars: int | None = None) -> pd.DataFrame: 
+        """The first max_stars stars as a DataFrame, built on the fly in lean mode."""
+        return self.df.iloc[:max_stars] if self.df is not None else star_buffer_to_dataframe(self.stars[:max_stars])
+
+    def assign_velocities(self, parameters: KinematicsParameters = default_kinematics_parameters) -> None: 
+        """Give every star a VX, VY, VZ from the rotation curve of the bulge + disk + halo mass model."""
+        print('\n---------- Kinematics ----------')
+        with stage('kinematics', len(self.stars)): 
+            self.stars = add_velocity_columns(self.stars)
+            curve = build_rotation_curve(self.config, parameters)
+            assign_velocities(self.stars, self.component_slices, curve, parameters, np.random.default_rng(derive_seed(self.seed, 5)), self.chunk_size)
+        self.update_columns()
+
+    def publish(self, name: str = 'spiral_galaxy') -> int: 
+        """
+        Publish the star buffer as named shared memory for viewers and analysis in other processes,
+        such as python render.py --shm spiral_galaxy. Publishing again bumps the version and
+        viewers refresh. The segment lives as long as this galaxy's process.
+        """
+        if self.shared is None or self.shared.name.lstrip('/') != name or self.stars.nbytes > self.shared.header[0]['capacity']: 
+            generation = 0
+            if self.shared is not None: 
+                # Closing flags the old segment retired, so viewers attach to the new one
+                generation = self.shared.generation() + 1
+                self.shared.close()
+            # Room for velocity columns to be added without reallocating
+            self.shared = SharedStarBuffer.create(name, make_star_buffer(len(self.stars), velocities=True).nbytes, generation)
+            atexit.register(self.shared.close)
+        version = self.shared.publish(self.stars, self.component_slices)
+        print(f"Stars published to shared memory {name!r}, version {version}")
+        return version
 
     # Render Galaxy
-    def render(self) -> None:
+    def render(self, max_stars: int | None = None) -> None:
         from render import render_open3d
-        render_open3d(self.df)
+        render_open3d(self.dataframe(max_stars))
+
+    def render_progressive(self, max_workers: int | None = None) -> None:
+        """Open the viewer straight away and add every component to it as soon as it is generated."""
+        from render import render_open3d_progressive
+        render_open3d_progressive(self.generate_galaxy_progressive(max_workers))
 
-    # Export stars to a CSV file
-    def export(self, output_file: str = "spiral_galaxy_stars.csv") -> None:
-        if output_file[-4:] != '.csv': 
+    # Export stars to a CSV file, or to a quantized .gqz file with fixed-point positions
+    # With max_stars only the first stars are written, a representative subsample after generate_galaxy_stratified()
+    def export(self, output_file: str = "spiral_galaxy_stars.csv", max_stars: int | None = None, max_error: float = 0.005) -> None:
+        if output_file[-4:] not in ('.csv', QUANTIZED_SUFFIX): 
             output_file += '.csv'
         output_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), output_file)
-        self.df.to_csv(output_path, index=False)
+        with stage('SpiralGalaxy.export', len(self.stars[:max_stars])) as running: 
+            if output_path.endswith(QUANTIZED_SUFFIX): 
+                quantized = encode_stars(self.stars[:max_stars], max_error)
+                save_quantized(output_path, quantized)
+                print_round_trip_report(round_trip_report(self.stars[:max_stars], quantized))
+            elif self.lean: 
+                # Blocks of chunk_size rows instead of a DataFrame of the whole galaxy
+                file = ChunkFile(output_path, 'csv', None, self.stars.dtype)
+                for start in range(0, len(self.stars[:max_stars]), self.chunk_size): 
+                    file.write(self.stars[:max_stars][start:start + self.chunk_size])
+                file.close()
+            else: 
+                self.df.iloc[:max_stars].to_csv(output_path, index=False)
+            running.record.bytes_written = os.path.getsize(output_path)
+        self.write_run_record(output_path)
 
         print(f"Stars exported to {output_path}")
 
@@ -101,8 +377,7 @@ class SpiralGalaxy:
 def main(): 
     spiral_galaxy = SpiralGalaxy()
 
-    spiral_galaxy.generate_galaxy()
-    spiral_galaxy.render()
+    spiral_galaxy.render_progressive()
 
     e = input("Export stars? (y/n): ")
     if e.lower() == 'y': 
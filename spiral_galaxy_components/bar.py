@@ -2,10 +2,13 @@ import numpy as np
 import pandas as pd
 import sys
 import os
-from tqdm import tqdm
 from copy import deepcopy
 from dataclasses import dataclass, field
 from .config import BarParameters, default_bar_parameters
+from .instrumentation import current_stage, instrumented
+from .luminosity_function import sample_brightness
+from .population import sample_population, sample_star_properties
+from .sampling import check_engine, inverse_cdf_table
 
 # bar twice as long
 
@@ -16,6 +19,8 @@ class Bar:
     """Initialize bar renderer with given parameters."""
 
     parameters: BarParameters = field(default_factory=lambda: deepcopy(default_bar_parameters)) # Copy of default_bar_parameters
+    engine: str = 'tabulated'
+    seed: int | np.random.SeedSequence | None = None
 
     n_stars: int = field(init=False)
     bar_length: float = field(init=False)
@@ -43,7 +48,11 @@ class Bar:
 
         print('\n---------- Bar Rendering ----------')
 
-        self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_bar()
+        check_engine(self.engine)
+        if self.engine == 'reference': 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_bar()
+        else: 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = sample_bar_stars(self.parameters, self.n_stars, np.random.default_rng(self.seed))
         self.df = pd.DataFrame({
             'XX': self.XX, 
             'YY': self.YY, 
@@ -53,6 +62,7 @@ class Bar:
             'S': self.S
         })
 
+    @instrumented
     def generate_galaxy_bar(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
         Generate the star positions in the galaxy bar.
@@ -72,7 +82,8 @@ class Bar:
         size = np.zeros(self.n_stars)
 
         print("\nGenerating bar stars...")
-        pbar = tqdm(total=self.n_stars, desc="Generating bar stars")
+        stage = current_stage()
+        stage.expect(self.n_stars)
         
         for i in range(self.n_stars): 
             r_x[i] = np.random.normal(0, bar_thickness_y/2)
@@ -98,9 +109,11 @@ class Bar:
                 x_candidate_value = np.random.uniform(lower_bound, upper_bound)
                 candidate_prob = np.random.uniform(0, 1)
                 if candidate_prob < x_distribution(x_candidate_value):
+                    stage.count_attempts(attempts + 1, 1)
                     return x_candidate_value
                 attempts += 1
             # If max attempts reached, return a value from the center region
+            stage.count_attempts(attempts, 0)
             return np.random.uniform(-0.6*center_length, 0.6*center_length)
         
         for i in range(self.n_stars):
@@ -117,9 +130,13 @@ class Bar:
             brightness[i] = self.brightness
             size[i] = self.size
             
-            pbar.update(1)
+            stage.advance()
         
-        pbar.close()
+        if self.parameters.sample_brightness: 
+            brightness = sample_brightness(self.n_stars, self.brightness)
+        if self.parameters.population is not None: 
+            temperature, brightness, size = sample_population(self.parameters.population, self.n_stars, self.brightness, self.size)
+
         print()
 
         return x, y, z, temperature, brightness, size
@@ -141,6 +158,35 @@ class Bar:
         print(f"Stars exported to {output_path}")
 
 
+
+def bar_x_density(x: np.ndarray, center_length: float) -> np.ndarray: 
+    """Vectorized form of the x_distribution used by Bar.generate_galaxy_bar."""
+    return np.where(x < -0.6*center_length, np.exp(-((x+0.6)/(center_length))**2), 
+                    np.where(x <= 0.6*center_length, 1.0, np.exp(-((x-0.6)/(center_length))**2)))
+
+def sample_bar_stars(parameters: BarParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized equivalent of Bar.generate_galaxy_bar, drawing every star at once from rng."""
+    bar_length = parameters.bar_length
+    center_length = bar_length/2
+    bar_thickness_y = bar_length*0.2
+
+    x_table = inverse_cdf_table(lambda x: bar_x_density(x, center_length), -center_length, center_length, key=('bar_x', center_length))
+    x = x_table.sample(n_stars, rng)
+
+    r_x = rng.normal(0, bar_thickness_y/2, n_stars) * (1+(x/(2*center_length))**2)**(-2.5)
+    theta_x = rng.uniform(0, 2*np.pi, n_stars)
+    y = r_x * np.cos(theta_x)
+    z = r_x * np.sin(theta_x)*(3/4)
+
+    # Add position jitter and set properties
+    x = x + rng.normal(0, bar_length/100, n_stars)
+    y = y + rng.normal(0, bar_length/100, n_stars)
+    z = z + rng.normal(0, bar_length/100, n_stars)
+    temperature, brightness, size = sample_star_properties(parameters, n_stars, rng)
+
+    return x, y, z, temperature, brightness, size
+
+
 def main(): 
     bar = Bar(default_bar_parameters)
 
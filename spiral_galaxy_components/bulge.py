@@ -2,10 +2,13 @@ import numpy as np
 import pandas as pd
 import sys
 import os
-from tqdm import tqdm
 from copy import deepcopy
 from dataclasses import dataclass, field
 from .config import BulgeParameters, default_bulge_parameters
+from .instrumentation import current_stage, instrumented
+from .luminosity_function import sample_brightness
+from .population import sample_population, sample_star_properties
+from .sampling import check_engine, sample_plummer_radius, sample_isotropic_directions
 
 @dataclass
 class Bulge: 
@@ -13,6 +16,8 @@ class Bulge:
     """Initialize bulge renderer with given parameters."""
 
     parameters: BulgeParameters = field(default_factory=lambda: deepcopy(default_bulge_parameters))
+    engine: str = 'tabulated'
+    seed: int | np.random.SeedSequence | None = None
 
     n_stars: int = field(init=False)
     bulge_radius: float = field(init=False)
@@ -40,7 +45,11 @@ class Bulge:
 
         print('\n---------- Bulge Rendering ----------')
 
-        self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_bulge()
+        check_engine(self.engine)
+        if self.engine == 'reference': 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_bulge()
+        else: 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = sample_bulge_stars(self.parameters, self.n_stars, np.random.default_rng(self.seed))
         self.df = pd.DataFrame({
             'XX': self.XX, 
             'YY': self.YY, 
@@ -50,6 +59,7 @@ class Bulge:
             'S': self.S
         })
 
+    @instrumented
     def generate_galaxy_bulge(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
 
         """
@@ -71,12 +81,17 @@ class Bulge:
         size = np.zeros(self.n_stars)
 
         print("\nGenerating bulge stars...")
+        stage = current_stage()
+        stage.expect(self.n_stars)
 
-        for i in tqdm(range(self.n_stars), desc="Generating bulge stars"):
+        for i in range(self.n_stars):
             # Generate radius using the Plummer model
             r = self.bulge_radius / np.sqrt(np.random.uniform(0, 1) ** (-2/3) - 1) - 1
+            attempts = 1
             while r > 4*self.bulge_radius: 
                 r = self.bulge_radius / np.sqrt(np.random.uniform(0, 1) ** (-2/3) - 1) - 1
+                attempts += 1
+            stage.count_attempts(attempts, 1)
 
             # Generate random angles for spherical coordinates
             theta = np.arccos(2 * np.random.uniform(0, 1) - 1)  # Polar angle
@@ -92,7 +107,13 @@ class Bulge:
             #temperature[i] = int(np.fix(np.random.normal(1000,400)))
             brightness[i] = self.brightness
             size[i] = self.size
+            stage.advance()
         
+        if self.parameters.sample_brightness: 
+            brightness = sample_brightness(self.n_stars, self.brightness)
+        if self.parameters.population is not None: 
+            temperature, brightness, size = sample_population(self.parameters.population, self.n_stars, self.brightness, self.size)
+
         print()
 
         return x, y, z, temperature, brightness, size
@@ -114,6 +135,24 @@ class Bulge:
         print(f"Stars exported to {output_path}")
 
 
+
+def sample_bulge_stars(parameters: BulgeParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized equivalent of Bulge.generate_galaxy_bulge, drawing every star at once from rng."""
+    bulge_radius = parameters.bulge_radius
+
+    # The reference loop shifts Plummer radii by -1 and redraws r > 4*bulge_radius,
+    # which is the Plummer distribution truncated at 4*bulge_radius + 1 before the shift
+    r = sample_plummer_radius(n_stars, bulge_radius, 4*bulge_radius + 1, rng) - 1
+    ux, uy, uz = sample_isotropic_directions(n_stars, rng)
+
+    x = r * ux + rng.normal(0, bulge_radius/20, n_stars)
+    y = r * uy + rng.normal(0, bulge_radius/20, n_stars)
+    z = r * uz + rng.normal(0, bulge_radius/20, n_stars)
+    temperature, brightness, size = sample_star_properties(parameters, n_stars, rng)
+
+    return x, y, z, temperature, brightness, size
+
+
 def main(): 
     bulge = Bulge(default_bulge_parameters)
 
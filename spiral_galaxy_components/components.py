@@ -0,0 +1,204 @@
+import numpy as np
+from collections.abc import Iterator
+from dataclasses import fields, replace
+from concurrent.futures import Executor, ProcessPoolExecutor
+from multiprocessing.shared_memory import SharedMemory
+from .bulge import Bulge, sample_bulge_stars
+from .bar import Bar, sample_bar_stars
+from .disk import Disk, sample_disk_stars
+from .spiral_arms import SpiralArms, SpiralArmLayout, build_spiral_arm_layout, sample_spiral_arm_stars
+from .scattered_stars import ScatteredStars, sample_scattered_stars
+from .config import SpiralGalaxyConfig, default_config
+from .helper import derive_seed
+from .shared_buffer import attach_shared_memory
+from .star_buffer import STAR_COLUMNS, fill_star_buffer, make_star_buffer, star_buffer_to_dataframe, star_dtype
+
+# Components of a spiral galaxy in buffer order, with their class, the config field of their
+# parameters and their vectorized sampler. The position of a component is also the key of its
+# seed, derive_seed(seed, index)
+COMPONENTS = {
+    'bulge': (Bulge, 'bulge_parameters', sample_bulge_stars),
+    'bar': (Bar, 'bar_parameters', sample_bar_stars),
+    'disk': (Disk, 'disk_parameters', sample_disk_stars),
+    'spiral_arms': (SpiralArms, 'spiral_arm_parameters', sample_spiral_arm_stars),
+    'scattered_stars': (ScatteredStars, 'scattered_stars_parameters', sample_scattered_stars),
+}
+COMPONENT_NAMES = tuple(COMPONENTS)
+
+# Stars per chunk when a component is split across workers
+CHUNK_SIZE = 1_000_000
+
+
+def component_index(name: str) -> int:
+    return COMPONENT_NAMES.index(name)
+
+def component_parameters(config: SpiralGalaxyConfig, name: str):
+    return getattr(config, COMPONENTS[name][1])
+
+def config_star_count(config: SpiralGalaxyConfig) -> int:
+    return sum(component_parameters(config, name).n_stars for name in COMPONENT_NAMES)
+
+def scaled_config(n_stars: int, config: SpiralGalaxyConfig = default_config) -> SpiralGalaxyConfig:
+    """config with every component scaled so the galaxy holds about n_stars stars."""
+    total = config_star_count(config)
+    changes = {}
+    for name, (_, field_name, _) in COMPONENTS.items():
+        parameters = getattr(config, field_name)
+        changes[field_name] = replace(parameters, n_stars=max(1, round(parameters.n_stars * n_stars / total)))
+    return replace(config, **changes)
+
+def component_sampler(name: str):
+    return COMPONENTS[name][2]
+
+def build_component(name: str, parameters, engine: str, seed: np.random.SeedSequence):
+    """Generate one component object from its parameters."""
+    component_class, _, _ = COMPONENTS[name]
+    return component_class(parameters, engine, seed)
+
+def component_view(name: str, parameters, engine: str, seed: np.random.SeedSequence, stars: np.ndarray):
+    """
+    A component object over stars already generated for it, without drawing them again: its columns
+    are views of stars and its parameter attributes are set as its __post_init__ does.
+    """
+    component_class, _, _ = COMPONENTS[name]
+    component = component_class.__new__(component_class)
+    component.parameters, component.engine, component.seed = parameters, engine, seed
+    for f in fields(component_class):
+        if not f.init and hasattr(parameters, f.name):
+            setattr(component, f.name, getattr(parameters, f.name))
+    component.XX, component.YY, component.ZZ, component.T, component.B, component.S = (stars[column] for column in STAR_COLUMNS)
+    component.df = star_buffer_to_dataframe(stars[list(STAR_COLUMNS)])
+    return component
+
+def component_star_buffer(component) -> np.ndarray:
+    """Copy a generated component's columns into a star buffer of its own."""
+    stars = make_star_buffer(len(component.XX))
+    fill_star_buffer(stars, (component.XX, component.YY, component.ZZ, component.T, component.B, component.S))
+    return stars
+
+def sample_chunk(name: str, parameters, n_stars: int, rng: np.random.Generator, layout: SpiralArmLayout | None = None) -> tuple[np.ndarray, ...]:
+    if name == 'spiral_arms':
+        return component_sampler(name)(parameters, n_stars, rng, layout)
+    return component_sampler(name)(parameters, n_stars, rng)
+
+def chunk_bounds(n_stars: int, chunk_size: int) -> list[tuple[int, int]]:
+    return [(start, min(start + chunk_size, n_stars)) for start in range(0, n_stars, chunk_size)]
+
+def fill_chunk(out: np.ndarray, name: str, parameters, seed: np.random.SeedSequence, chunk: int, layout: SpiralArmLayout | None = None) -> None:
+    """Draw chunk number chunk of a split component into out, the chunk's slice of a star buffer."""
+    fill_star_buffer(out, sample_chunk(name, parameters, len(out), np.random.default_rng(derive_seed(seed, chunk)), layout))
+
+def _fill_shared_chunk(task: tuple) -> None:
+    """Process pool task: attach to the shared buffer and fill one chunk's slice of it."""
+    shared_name, n_stars, name, parameters, seed, chunk, start, stop, layout = task
+    shared = attach_shared_memory(shared_name)
+    try:
+        out = np.ndarray(n_stars, dtype=star_dtype(), buffer=shared.buf)
+        fill_chunk(out[start:stop], name, parameters, seed, chunk, layout)
+        del out
+    finally:
+        shared.close()
+
+def sample_component(name: str, parameters, seed: np.random.SeedSequence, out: np.ndarray | None = None,
+                     chunk_size: int = CHUNK_SIZE, executor: Executor | None = None) -> np.ndarray:
+    """
+    Draw a component with the tabulated engine into out, a star buffer or a slice of one.
+
+    Components larger than chunk_size are split into fixed chunks, chunk c drawing from its own
+    stream derive_seed(seed, c) into its own disjoint slice of out, so chunks can run on any
+    executor and the stars only depend on the seed and chunk_size, not on the number of workers.
+    A thread pool writes into out directly, a process pool into shared memory copied to out at
+    the end. A component that fits in one chunk draws from the component's own stream, exactly
+    as the component classes do, and the spiral arm hotspots always come from that stream.
+    """
+    n_stars = parameters.n_stars
+    if out is None:
+        out = make_star_buffer(n_stars)
+    rng = np.random.default_rng(seed)
+    layout = build_spiral_arm_layout(parameters, rng) if name == 'spiral_arms' else None
+    bounds = chunk_bounds(n_stars, chunk_size)
+
+    if len(bounds) <= 1:
+        fill_star_buffer(out, sample_chunk(name, parameters, n_stars, rng, layout))
+        return out
+
+    if isinstance(executor, ProcessPoolExecutor):
+        shared = SharedMemory(create=True, size=max(star_dtype().itemsize * n_stars, 1))
+        try:
+            tasks = [(shared.name, n_stars, name, parameters, seed, chunk, start, stop, layout) for chunk, (start, stop) in enumerate(bounds)]
+            list(executor.map(_fill_shared_chunk, tasks))
+            stars = np.ndarray(n_stars, dtype=star_dtype(), buffer=shared.buf)
+            for column in STAR_COLUMNS:
+                out[column] = stars[column]
+            del stars
+        finally:
+            shared.close()
+            shared.unlink()
+        return out
+
+    def fill(chunk: int) -> None:
+        start, stop = bounds[chunk]
+        fill_chunk(out[start:stop], name, parameters, seed, chunk, layout)
+
+    if executor is None:
+        for chunk in range(len(bounds)):
+            fill(chunk)
+    else:
+        list(executor.map(fill, range(len(bounds))))
+    return out
+
+def iter_component_chunks(name: str, parameters, seed: np.random.SeedSequence, out: np.ndarray, chunk_size: int = CHUNK_SIZE):
+    """Draw a component into out one chunk at a time, yielding the slice of out each chunk filled."""
+    bounds = chunk_bounds(parameters.n_stars, chunk_size)
+    if len(bounds) <= 1:
+        sample_component(name, parameters, seed, out, chunk_size)
+        yield slice(0, len(out))
+        return
+
+    layout = build_spiral_arm_layout(parameters, np.random.default_rng(seed)) if name == 'spiral_arms' else None
+    for chunk, (start, stop) in enumerate(bounds):
+        fill_chunk(out[start:stop], name, parameters, seed, chunk, layout)
+        yield slice(start, stop)
+
+def sample_component_chunks(name: str, parameters, seed: np.random.SeedSequence, first_chunk: int, last_chunk: int, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """Star buffer of chunks [first_chunk, last_chunk) of a component, identical to those stars of sample_component()."""
+    bounds = chunk_bounds(parameters.n_stars, chunk_size)
+    if len(bounds) <= 1:
+        # A component of one chunk draws from its own stream and cannot be split further
+        return sample_component(name, parameters, seed, chunk_size=chunk_size) if first_chunk == 0 and last_chunk > 0 else make_star_buffer(0)
+
+    layout = build_spiral_arm_layout(parameters, np.random.default_rng(seed)) if name == 'spiral_arms' else None
+    offset = bounds[first_chunk][0]
+    out = make_star_buffer(bounds[last_chunk - 1][1] - offset)
+    for chunk in range(first_chunk, last_chunk):
+        start, stop = bounds[chunk]
+        fill_chunk(out[start - offset:stop - offset], name, parameters, seed, chunk, layout)
+    return out
+
+def iter_galaxy_chunks(config: SpiralGalaxyConfig, seed: np.random.SeedSequence, chunk_size: int = CHUNK_SIZE,
+                       names: tuple[str, ...] = COMPONENT_NAMES) -> Iterator[tuple[str, np.ndarray]]:
+    """
+    Draw a whole galaxy, or only the components in names, with the tabulated engine one chunk at a
+    time, yielding (component, star buffer) per chunk. The stars are those of
+    SpiralGalaxy.generate_galaxy() with the same seed and chunk_size, in buffer order, but only one
+    chunk is ever held, so a single pass over a galaxy of any size runs in constant memory.
+    """
+    if not isinstance(seed, np.random.SeedSequence):
+        # Every component must derive its stream from the same root
+        seed = np.random.SeedSequence(seed)
+    for index, name in enumerate(COMPONENT_NAMES):
+        if name not in names:
+            continue
+        parameters = component_parameters(config, name)
+        for chunk in range(len(chunk_bounds(parameters.n_stars, chunk_size))):
+            yield name, sample_component_chunks(name, parameters, derive_seed(seed, index), chunk, chunk + 1, chunk_size)
+
+def generate_component(name: str, parameters, engine: str, seed: np.random.SeedSequence, chunk_size: int = CHUNK_SIZE) -> np.ndarray:
+    """
+    Generate one component straight into a star buffer.
+
+    Module level so it can be sent to worker processes; only the compact buffer travels back.
+    """
+    if engine == 'tabulated':
+        return sample_component(name, parameters, seed, chunk_size=chunk_size)
+    return component_star_buffer(build_component(name, parameters, engine, seed))
@@ -1,4 +1,17 @@
-from dataclasses import dataclass, field
+from dataclasses import dataclass, field, replace
+
+@dataclass(frozen=True)
+class PopulationParameters: 
+    age: float # Gyr, stars whose main-sequence lifetime is shorter are gone
+    min_mass: float = 0.08 # Solar masses
+    max_mass: float = 100.0 # Solar masses
+    imf_breaks: tuple[float, ...] = (0.08, 0.5) # Kroupa (2001) broken power law
+    imf_slopes: tuple[float, ...] = (0.3, 1.3, 2.3)
+
+old_population: PopulationParameters = PopulationParameters(age=10.0)
+intermediate_population: PopulationParameters = PopulationParameters(age=3.0)
+young_population: PopulationParameters = PopulationParameters(age=0.1)
+
 
 @dataclass(frozen=True)
 class BulgeParameters: 
@@ -8,6 +21,8 @@ class BulgeParameters:
     temp_sd: float
     brightness: float
     size: float
+    sample_brightness: bool = False # Draw per-star B from the Gaia luminosity function
+    population: PopulationParameters | None = None # Draw T, B and S from an IMF instead
 
 default_bulge_parameters: BulgeParameters = BulgeParameters(
     n_stars=5000, 
@@ -27,6 +42,8 @@ class BarParameters:
     temp_sd: float
     brightness: float
     size: float
+    sample_brightness: bool = False # Draw per-star B from the Gaia luminosity function
+    population: PopulationParameters | None = None # Draw T, B and S from an IMF instead
 
 default_bar_parameters: BarParameters = BarParameters(
     n_stars=10000, 
@@ -49,6 +66,8 @@ class DiskParameters:
     temp_sd: float
     brightness: float
     size: float
+    sample_brightness: bool = False # Draw per-star B from the Gaia luminosity function
+    population: PopulationParameters | None = None # Draw T, B and S from an IMF instead
 
 default_disk_parameters: DiskParameters = DiskParameters(
     n_stars=35000, 
@@ -78,6 +97,8 @@ class SpiralArmParameters:
     temp_sd: float
     brightness: float
     size: float
+    sample_brightness: bool = False # Draw per-star B from the Gaia luminosity function
+    population: PopulationParameters | None = None # Draw T, B and S from an IMF instead
 
 default_spiral_arm_parameters: SpiralArmParameters = SpiralArmParameters(
     n_stars=49000, 
@@ -105,6 +126,8 @@ class ScatteredStarParameters:
     temp_sd: float
     brightness: float
     size: float
+    sample_brightness: bool = False # Draw per-star B from the Gaia luminosity function
+    population: PopulationParameters | None = None # Draw T, B and S from an IMF instead
 
 default_scattered_stars_parameters: ScatteredStarParameters = ScatteredStarParameters(
     n_stars=1000, 
@@ -117,6 +140,29 @@ default_scattered_stars_parameters: ScatteredStarParameters = ScatteredStarParam
 )
 
 
+@dataclass(frozen=True)
+class KinematicsParameters: 
+    bulge_mass: float # Solar masses, Plummer sphere with the bulge radius as scale
+    disk_mass: float # Solar masses, exponential disk with the disk r0 as scale
+    halo_velocity: float # km/s, asymptotic circular velocity of the isothermal halo
+    halo_core_radius: float # kpc
+    bulge_dispersion: float # km/s, per axis
+    disk_dispersion: float # km/s, per axis, for the bar, disk and arms
+    halo_dispersion: float # km/s, per axis, for the scattered stars
+    max_radius: float = 200.0 # kpc, extent of the rotation curve grid
+    n_grid: int = 4096
+
+default_kinematics_parameters: KinematicsParameters = KinematicsParameters(
+    bulge_mass=1.5e10, 
+    disk_mass=5.0e10, 
+    halo_velocity=180.0, 
+    halo_core_radius=5.0, 
+    bulge_dispersion=100.0, 
+    disk_dispersion=20.0, 
+    halo_dispersion=150.0
+)
+
+
 @dataclass(frozen=True)
 class SpiralGalaxyConfig: 
     bulge_parameters: BulgeParameters
@@ -124,6 +170,7 @@ class SpiralGalaxyConfig:
     disk_parameters: DiskParameters
     spiral_arm_parameters: SpiralArmParameters
     scattered_stars_parameters: ScatteredStarParameters
+    kinematics_parameters: KinematicsParameters | None = None # Assign VX, VY, VZ after generation
 
 default_config: SpiralGalaxyConfig = SpiralGalaxyConfig(
     
@@ -137,4 +184,19 @@ default_config: SpiralGalaxyConfig = SpiralGalaxyConfig(
 
     scattered_stars_parameters=default_scattered_stars_parameters
 
+)
+
+# Old bulge, bar and halo, intermediate-age disk and young arms
+population_synthesis_config: SpiralGalaxyConfig = SpiralGalaxyConfig(
+
+    bulge_parameters=replace(default_bulge_parameters, population=old_population), 
+
+    bar_parameters=replace(default_bar_parameters, population=old_population), 
+
+    disk_parameters=replace(default_disk_parameters, population=intermediate_population), 
+
+    spiral_arm_parameters=replace(default_spiral_arm_parameters, population=young_population), 
+
+    scattered_stars_parameters=replace(default_scattered_stars_parameters, population=old_population)
+
 )
\ No newline at end of file
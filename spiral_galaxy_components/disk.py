@@ -2,19 +2,27 @@ import numpy as np
 import pandas as pd
 import sys
 import os
-from tqdm import tqdm
 from copy import deepcopy
 from dataclasses import dataclass, field
 from spiral_galaxy_components.config import DiskParameters, default_disk_parameters
+from spiral_galaxy_components.instrumentation import current_stage, instrumented
+from spiral_galaxy_components.luminosity_function import sample_brightness
+from spiral_galaxy_components.population import sample_population, sample_star_properties
+from spiral_galaxy_components.sampling import check_engine, inverse_cdf_table
 
 # 10% extremely thin - 100 pc from side to side, magnetars
 
+# Fraction of disk stars in the thick component, the rest use thin_height
+THICK_FRACTION = 0.9
+
 @dataclass
 class Disk:
 
     """Initialize bar renderer with given parameters."""
 
     parameters: DiskParameters = field(default_factory=lambda: deepcopy(default_disk_parameters)) # Copy of default_disk_parameters
+    engine: str = 'tabulated'
+    seed: int | np.random.SeedSequence | None = None
 
     n_stars: int = field(init=False)
     r0: float = field(init=False)
@@ -48,7 +56,11 @@ class Disk:
 
         print('\n---------- Disk Rendering ----------')
 
-        self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_disk()
+        check_engine(self.engine)
+        if self.engine == 'reference': 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_galaxy_disk()
+        else: 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = sample_disk_stars(self.parameters, self.n_stars, np.random.default_rng(self.seed))
         self.df = pd.DataFrame({
             'XX': self.XX, 
             'YY': self.YY, 
@@ -65,6 +77,7 @@ class Disk:
     #     # Sample phi uniformly
     #     phi = np.random.uniform(0, 2*np.pi, size=N)
     
+    @instrumented
     def generate_galaxy_disk(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """
         Generate star positions for the general galactic disk.
@@ -84,11 +97,12 @@ class Disk:
         size = np.zeros(self.n_stars)
 
         print("\nGenerating disk stars...")
-        pbar = tqdm(total=self.n_stars, desc="Generating disk stars")
+        stage = current_stage()
+        stage.expect(self.n_stars)
         i = 0
         max_attempts = 1000  # Maximum attempts per star to prevent infinite loops
         
-        n_thick_stars = int(self.n_stars * 0.9)
+        n_thick_stars = int(self.n_stars * THICK_FRACTION)
         while i < self.n_stars:
             if i < n_thick_stars: 
                 scale_height = self.norm_height
@@ -107,6 +121,8 @@ class Disk:
                     break
                 attempts += 1
             
+            stage.count_attempts(min(attempts + 1, max_attempts), int(attempts < max_attempts))
+
             # If we've exceeded max attempts, use a simpler method
             if attempts >= max_attempts:
                 theta = np.random.uniform(0, 2*np.pi)
@@ -124,10 +140,14 @@ class Disk:
             brightness[i] = self.brightness
             size[i] = self.size
             
-            pbar.update(1)
+            stage.advance()
             i += 1
 
-        pbar.close()
+        if self.parameters.sample_brightness: 
+            brightness = sample_brightness(self.n_stars, self.brightness)
+        if self.parameters.population is not None: 
+            temperature, brightness, size = sample_population(self.parameters.population, self.n_stars, self.brightness, self.size)
+
         print()
 
         return np.array(x), np.array(y), np.array(z), temperature, brightness, size
@@ -147,6 +167,28 @@ class Disk:
         self.df.to_csv(output_path, index=False)
 
         print(f"Stars exported to {output_path}")
+
+
+def sample_disk_stars(parameters: DiskParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized equivalent of Disk.generate_galaxy_disk, drawing every star at once from rng."""
+    r0 = parameters.r0
+    cutoff_radius = parameters.cutoff_radius
+
+    # Accepting uniform points in the plane with probability 2^(-r/r0) gives a radial density r*2^(-r/r0)
+    r_table = inverse_cdf_table(lambda r: r*np.exp2(-r/r0), 0, cutoff_radius, key=('disk_r', r0, cutoff_radius))
+    r = r_table.sample(n_stars, rng)
+    theta = rng.uniform(0, 2*np.pi, n_stars)
+
+    # Thick and thin stars are mixed rather than split by index so any subset of stars is representative
+    scale_height = np.where(rng.random(n_stars) < THICK_FRACTION, parameters.norm_height, parameters.thin_height)
+
+    x = r * np.cos(theta)
+    y = r * np.sin(theta)
+    z = rng.normal(0, 1, n_stars) * scale_height/2
+    temperature, brightness, size = sample_star_properties(parameters, n_stars, rng)
+
+    return x, y, z, temperature, brightness, size
+
     
 
 def main(): 
@@ -1,4 +1,5 @@
 import random
+import numpy as np
 from math import floor
 
 def even_div(n: int, d: int) -> list[int]: 
@@ -37,6 +38,12 @@ def proportional_div(n: int, proportions: list[float]) -> list[int]:
 
     return result
 
+def uneven_alpha(variation: float) -> float: 
+    """Gamma shape parameter used to draw uneven weights, from 200 (nearly even) to 0.2 (very uneven)."""
+    alpha_high = 200.0 
+    alpha_low  = 0.2 
+    return (alpha_low ** variation) * (alpha_high ** (1.0 - variation))
+
 def uneven_div(n: int, d: int, variation: float = 0.5) -> list[int]:
     if d <= 0 or n <= 0: 
         raise ValueError('d and n must be positive integers')
@@ -45,9 +52,7 @@ def uneven_div(n: int, d: int, variation: float = 0.5) -> list[int]:
     if not (0.0 <= variation <= 1.0):
         raise ValueError("variation must be between 0 and 1")
 
-    alpha_high = 200.0 
-    alpha_low  = 0.2 
-    alpha = (alpha_low ** variation) * (alpha_high ** (1.0 - variation))
+    alpha = uneven_alpha(variation)
 
     weights = [random.gammavariate(alpha, 1.0) for _ in range(d)]
     total_w = sum(weights)
@@ -74,4 +79,10 @@ def uneven_div(n: int, d: int, variation: float = 0.5) -> list[int]:
     for i in frac_indices[:need]:
         parts[i] += 1
 
-    return parts
\ No newline at end of file
+    return parts
+
+def derive_seed(seed: int | np.random.SeedSequence | None, *key: int) -> np.random.SeedSequence: 
+    """Derive an independent, reproducible seed sequence for the stream identified by key."""
+    if not isinstance(seed, np.random.SeedSequence): 
+        seed = np.random.SeedSequence(seed)
+    return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + tuple(key))
@@ -0,0 +1,334 @@
+import functools
+import json
+import math
+import os
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import TextIO
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+@dataclass
+class StageRecord:
+
+    """Measurements of one stage of a run, sent to the sink when the stage ends."""
+
+    stage: str
+    n_stars: int = 0
+    parent: str | None = None # Enclosing stage on the same thread
+    wall_seconds: float = 0.0
+    cpu_seconds: float = 0.0 # Of the whole process, so it includes other threads working for the stage
+    start_rss_bytes: int | None = None # Resident memory of the process when the stage started
+    peak_rss_bytes: int | None = None # Peak resident memory of the process during the stage, see PeakTracker
+    process_peak_rss_bytes: int | None = None # Peak resident memory of the process since it started
+    stars_per_second: float | None = None
+    attempts: int = 0 # Candidates drawn by rejection sampling
+    accepted: int = 0
+    bytes_written: int = 0
+
+    @property
+    def acceptance_rate(self) -> float | None:
+        """Fraction of rejection-sampling candidates accepted, None for stages without rejection."""
+        return self.accepted / self.attempts if self.attempts else None
+
+    @property
+    def rss_growth_bytes(self) -> int | None:
+        """How far the stage's peak rose above the memory in use when it started."""
+        if self.peak_rss_bytes is None or self.start_rss_bytes is None:
+            return None
+        return self.peak_rss_bytes - self.start_rss_bytes
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), 'acceptance_rate': self.acceptance_rate, 'rss_growth_bytes': self.rss_growth_bytes}
+
+
+def peak_rss_bytes() -> int | None:
+    """Peak resident memory of the process over its whole life, including peaks reset by stages."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return max(peak if sys.platform == 'darwin' else peak * 1024, _peaks.process_peak or 0)
+
+def current_rss_bytes() -> int | None:
+    """Resident memory of the process now, None where /proc is not available."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class PeakTracker:
+
+    """
+    Peak resident memory of every running stage. A stage's peak is the process peak if it rose
+    during the stage, and otherwise the larger of the memory in use at its start and end.
+
+    With set_peak_reset(True), on Linux, the kernel's peak (VmHWM) is instead reset when a stage
+    starts, after folding it into the peak of every stage still running on any thread, so each
+    stage sees the exact peak of its own span. This resets the peak the whole process reports, so
+    it is only done when asked for.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.running = {} # id of the stage: its peak so far
+        self.process_peak = None
+        self.resettable = False
+
+    def high_water_mark(self) -> int | None:
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def _fold(self) -> None:
+        # Only needed while resetting: otherwise the kernel's peak is the process's own
+        if not self.resettable:
+            return
+        peak = self.high_water_mark()
+        if peak is not None:
+            for key, (reset, stage_peak) in self.running.items():
+                if reset:
+                    self.running[key] = (reset, max(stage_peak or 0, peak))
+            self.process_peak = max(self.process_peak or 0, peak)
+
+    def start(self, key: int, start_rss: int | None) -> None:
+        with self.lock:
+            self._fold()
+            if self.resettable:
+                try:
+                    with open('/proc/self/clear_refs', 'w') as f:
+                        f.write('5')
+                except OSError:
+                    self.resettable = False
+            self.running[key] = (True, start_rss) if self.resettable else (False, peak_rss_bytes())
+
+    def finish(self, key: int, start_rss: int | None, end_rss: int | None) -> int | None:
+        with self.lock:
+            self._fold()
+            reset, peak = self.running.pop(key)
+        if reset:
+            return peak
+        # Without the reset only a rise of the process peak is attributable to the stage
+        end_peak = peak_rss_bytes()
+        if end_peak is not None and peak is not None and end_peak > peak:
+            return end_peak
+        known = [rss for rss in (start_rss, end_rss) if rss is not None]
+        return max(known) if known else None
+
+_peaks = PeakTracker()
+
+def set_peak_reset(enabled: bool) -> bool:
+    """Reset the kernel's peak RSS at every stage start for exact per-stage peaks (Linux only), returning the previous setting."""
+    with _peaks.lock:
+        previous, _peaks.resettable = _peaks.resettable, enabled and sys.platform.startswith('linux')
+    return previous
+
+
+# ---------- Sinks ----------
+
+class NullSink:
+
+    """
+    Drops everything; stages still time themselves, but progress updates cost one comparison and
+    memory is not measured.
+    """
+
+    wants_progress = False
+    wants_memory = False
+
+    def progress(self, record: StageRecord, done: int) -> None:
+        pass
+
+    def finish(self, record: StageRecord) -> None:
+        pass
+
+
+class JsonLinesSink:
+
+    """Appends every finished stage to a file as one JSON object per line."""
+
+    wants_progress = False
+    wants_memory = True
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'a')
+        self.lock = threading.Lock()
+
+    def progress(self, record: StageRecord, done: int) -> None:
+        pass
+
+    def finish(self, record: StageRecord) -> None:
+        line = json.dumps({'time': time.time(), **record.as_dict()})
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class ProgressSink:
+
+    """
+    A text progress bar redrawn at most once per min_interval seconds, and a summary line for
+    every finished stage. Stages report progress in steps of about 1 % of their stars, so even
+    per-star loops only reach the sink a hundred times.
+    """
+
+    wants_progress = True
+    wants_memory = True
+
+    def __init__(self, stream: TextIO | None = None, min_interval: float = 0.2, width: int = 30) -> None:
+        self.stream = stream or sys.stderr
+        self.min_interval = min_interval
+        self.width = width
+        self.last_draw = 0.0
+        self.lock = threading.Lock()
+
+    def progress(self, record: StageRecord, done: int) -> None:
+        now = time.monotonic()
+        if now - self.last_draw < self.min_interval or not record.n_stars:
+            return
+        with self.lock:
+            self.last_draw = now
+            fraction = min(done / record.n_stars, 1.0)
+            filled = int(fraction * self.width)
+            self.stream.write(f"\r{record.stage} [{'#' * filled}{'-' * (self.width - filled)}] {fraction:4.0%}")
+            self.stream.flush()
+
+    def finish(self, record: StageRecord) -> None:
+        line = f"{record.stage}: {record.n_stars} stars in {record.wall_seconds:.3f} s"
+        if record.stars_per_second is not None:
+            line += f" ({record.stars_per_second:,.0f} stars/s)"
+        line += f", cpu {record.cpu_seconds:.3f} s"
+        if record.peak_rss_bytes is not None:
+            line += f", peak RSS {record.peak_rss_bytes / 2**20:.0f} MiB"
+            if record.rss_growth_bytes is not None:
+                line += f" ({record.rss_growth_bytes / 2**20:+.0f} MiB)"
+        if record.acceptance_rate is not None:
+            line += f", acceptance {record.acceptance_rate:.1%}"
+        if record.bytes_written:
+            line += f", {record.bytes_written / 2**20:.1f} MiB written"
+        with self.lock:
+            self.stream.write(f"\r{line}\033[K\n")
+            self.stream.flush()
+
+
+# Production batch runs have no terminal and get the silent sink
+_sink = ProgressSink() if sys.stderr is not None and sys.stderr.isatty() else NullSink()
+
+def get_sink():
+    return _sink
+
+def set_sink(sink) -> object:
+    """Send the stages of every thread to sink from now on, returning the previous sink."""
+    global _sink
+    previous, _sink = _sink, sink
+    return previous
+
+@contextmanager
+def use_sink(sink) -> Iterator:
+    previous = set_sink(sink)
+    try:
+        yield sink
+    finally:
+        set_sink(previous)
+
+
+# ---------- Stages ----------
+
+class Stage:
+
+    """A running stage: its record, which the stage's code may add counts to, and its progress."""
+
+    def __init__(self, record: StageRecord, sink) -> None:
+        self.record = record
+        self.sink = sink
+        self.done = 0
+        self.expect(record.n_stars)
+
+    def expect(self, n_stars: int) -> None:
+        """Set the stars the stage will make, which its progress is measured against."""
+        self.record.n_stars = n_stars
+        self.step = max(n_stars // 100, 1)
+        self.next_report = self.done + self.step if self.sink.wants_progress else math.inf
+
+    def advance(self, n: int = 1) -> None:
+        """Count n more stars done, cheap enough to call once per star."""
+        self.done += n
+        if self.done >= self.next_report:
+            self.next_report = self.done + self.step
+            self.sink.progress(self.record, self.done)
+
+    def count_attempts(self, attempts: int, accepted: int) -> None:
+        self.record.attempts += attempts
+        self.record.accepted += accepted
+
+
+_stages = threading.local()
+_no_stage = Stage(StageRecord('none'), NullSink())
+
+def current_stage() -> Stage:
+    """Innermost running stage of this thread, or one discarding everything outside any stage."""
+    stack = getattr(_stages, 'stack', None)
+    return stack[-1] if stack else _no_stage
+
+@contextmanager
+def stage(name: str, n_stars: int = 0) -> Iterator[Stage]:
+    """Measure the enclosed code as one stage and send its record to the current sink at the end."""
+    stack = _stages.__dict__.setdefault('stack', [])
+    sink = _sink
+    running = Stage(StageRecord(name, n_stars, parent=stack[-1].record.stage if stack else None), sink)
+    stack.append(running)
+    wall, cpu = time.perf_counter(), time.process_time()
+    # The silent sink of production runs skips every memory measurement
+    measure_memory = getattr(sink, 'wants_memory', True)
+    if measure_memory:
+        start_rss = current_rss_bytes()
+        running.record.start_rss_bytes = start_rss
+        _peaks.start(id(running), start_rss)
+    try:
+        yield running
+    finally:
+        stack.pop()
+        record = running.record
+        record.wall_seconds = time.perf_counter() - wall
+        record.cpu_seconds = time.process_time() - cpu
+        if measure_memory:
+            record.peak_rss_bytes = _peaks.finish(id(running), start_rss, current_rss_bytes())
+            record.process_peak_rss_bytes = peak_rss_bytes()
+        record.stars_per_second = record.n_stars / record.wall_seconds if record.wall_seconds > 0 else None
+    sink.finish(record)
+
+def instrumented(function: Callable | None = None, *, name: str | None = None, count: Callable | None = None) -> Callable:
+    """
+    Run every call of a generator function as a stage named after it. The stars are counted with
+    count(result, *args), by default the length of the first array the function returns.
+    """
+    if function is None:
+        return functools.partial(instrumented, name=name, count=count)
+
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        with stage(name or function.__qualname__) as running:
+            result = function(*args, **kwargs)
+            running.record.n_stars = count(result, *args) if count is not None else len(result[0])
+        return result
+
+    return wrapper
@@ -0,0 +1,122 @@
+import numpy as np
+from functools import lru_cache
+from dataclasses import dataclass
+from scipy.special import i0e, i1e, k0e, k1e
+from .config import SpiralGalaxyConfig, KinematicsParameters
+
+# Gravitational constant in kpc (km/s)^2 / solar mass
+G = 4.30091e-6
+
+# Components whose stars follow the rotation curve, the others are pressure supported
+ROTATING_COMPONENTS = ('bar', 'disk', 'spiral_arms')
+
+
+def plummer_circular_velocity(r: np.ndarray, mass: float, scale: float) -> np.ndarray:
+    """Circular velocity in km/s of a Plummer sphere at radius r (kpc)."""
+    return np.sqrt(G * mass * r**2 / (r**2 + scale**2)**1.5)
+
+def exponential_disk_circular_velocity(r: np.ndarray, mass: float, scale_length: float) -> np.ndarray:
+    """Circular velocity in km/s of a razor-thin exponential disk (Freeman 1970)."""
+    # The velocity vanishes at the centre, where k0e(0) would be infinite
+    y = np.maximum(r / (2 * scale_length), 1e-12)
+    sigma_0 = mass / (2 * np.pi * scale_length**2)
+    # The exponentially scaled Bessel functions keep the products finite at large y
+    bessel = i0e(y) * k0e(y) - i1e(y) * k1e(y)
+    return np.sqrt(np.clip(4 * np.pi * G * sigma_0 * scale_length * y**2 * bessel, 0, None))
+
+def isothermal_halo_circular_velocity(r: np.ndarray, velocity: float, core_radius: float) -> np.ndarray:
+    """Circular velocity in km/s of a cored pseudo-isothermal halo."""
+    r = np.maximum(r, 1e-12)
+    return velocity * np.sqrt(1 - core_radius / r * np.arctan(r / core_radius))
+
+
+@dataclass(frozen=True)
+class RotationCurve:
+
+    """Circular velocity tabulated on a uniform radial grid starting at 0."""
+
+    max_radius: float
+    velocity: np.ndarray
+
+    def __call__(self, r: np.ndarray) -> np.ndarray:
+        """Linearly interpolate the circular velocity, constant beyond max_radius."""
+        position = np.minimum(r * ((len(self.velocity) - 1) / self.max_radius), len(self.velocity) - 1)
+        index = np.minimum(position.astype(np.int64), len(self.velocity) - 2)
+        frac = position - index
+        return self.velocity[index] + frac * (self.velocity[index + 1] - self.velocity[index])
+
+    def angular_velocity(self, r: np.ndarray) -> np.ndarray:
+        """Omega(r) = v_c(r) / r in km/s/kpc."""
+        return self(r) / np.maximum(r, self.max_radius / (len(self.velocity) - 1))
+
+
+@lru_cache(maxsize=None)
+def build_rotation_curve(config: SpiralGalaxyConfig, parameters: KinematicsParameters) -> RotationCurve:
+    """Tabulate the bulge + disk + halo circular velocity for a galaxy configuration."""
+    r = np.linspace(0, parameters.max_radius, parameters.n_grid)
+    # The disk density falls as 2^(-r/r0), an exponential with scale length r0/ln 2
+    disk_scale_length = config.disk_parameters.r0 / np.log(2)
+
+    v_squared = (
+        plummer_circular_velocity(r, parameters.bulge_mass, config.bulge_parameters.bulge_radius)**2
+        + exponential_disk_circular_velocity(r, parameters.disk_mass, disk_scale_length)**2
+        + isothermal_halo_circular_velocity(r, parameters.halo_velocity, parameters.halo_core_radius)**2
+    )
+    return RotationCurve(parameters.max_radius, np.sqrt(v_squared))
+
+def component_dispersion(name: str, parameters: KinematicsParameters) -> float:
+    if name == 'bulge':
+        return parameters.bulge_dispersion
+    if name == 'scattered_stars':
+        return parameters.halo_dispersion
+    return parameters.disk_dispersion
+
+def component_size(component_slice: slice | np.ndarray) -> int:
+    """Number of stars in a component slice (with no step) or array of star indices."""
+    if isinstance(component_slice, slice):
+        return component_slice.stop - component_slice.start
+    return len(component_slice)
+
+def index_chunks(component_slice: slice | np.ndarray, n_stars: int, chunk_size: int):
+    """Split a slice, or an array of star indices, into chunks of at most chunk_size stars."""
+    if isinstance(component_slice, slice):
+        start, stop, _ = component_slice.indices(n_stars)
+        for chunk_start in range(start, stop, chunk_size):
+            yield slice(chunk_start, min(chunk_start + chunk_size, stop))
+    else:
+        for chunk_start in range(0, len(component_slice), chunk_size):
+            yield component_slice[chunk_start:chunk_start + chunk_size]
+
+def assign_velocities(stars: np.ndarray, component_slices: dict[str, slice | np.ndarray], curve: RotationCurve, parameters: KinematicsParameters, rng: np.random.Generator, chunk_size: int = 1_000_000) -> None:
+    """
+    Fill the VX, VY, VZ columns of a star buffer in place.
+
+    Rotating components get the circular velocity at their cylindrical radius plus an isotropic
+    dispersion, the bulge and halo only their dispersion. Stars are processed in chunks so the
+    temporaries stay bounded however large the buffer is.
+
+    Parameters:
+        stars (np.ndarray): Star buffer with velocity columns.
+        component_slices (dict): Slice, or array of indices, of the buffer holding each component's stars.
+        curve (RotationCurve): Circular velocity of the galaxy.
+        parameters (KinematicsParameters): Dispersions of the components.
+        rng (np.random.Generator): Random generator for the dispersions.
+    """
+    for name, component_slice in component_slices.items():
+        dispersion = component_dispersion(name, parameters)
+        for index in index_chunks(component_slice, len(stars), chunk_size):
+            n = component_size(index)
+            vx = rng.normal(0, dispersion, n)
+            vy = rng.normal(0, dispersion, n)
+            vz = rng.normal(0, dispersion, n)
+            if name in ROTATING_COMPONENTS:
+                x = stars['XX'][index].astype(np.float64)
+                y = stars['YY'][index].astype(np.float64)
+                r = np.hypot(x, y)
+                # Rotate clockwise seen from +z so the logarithmic arms are trailing
+                v_over_r = curve(r) / np.maximum(r, 1e-12)
+                vx += y * v_over_r
+                vy -= x * v_over_r
+            stars['VX'][index] = vx
+            stars['VY'][index] = vy
+            stars['VZ'][index] = vz
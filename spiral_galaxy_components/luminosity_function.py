@@ -0,0 +1,116 @@
+import numpy as np
+import pandas as pd
+import os
+from dataclasses import dataclass, field
+from scipy.interpolate import CubicSpline
+from .sampling import InverseCDFTable
+
+# Absolute G magnitude of the Sun, used as the zero point of the brightness scale
+SUN_ABSOLUTE_MAGNITUDE = 4.67
+
+default_catalogue_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'irregular_galaxy_rendering', 'parallax_greater_than_10.csv')
+default_cache_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'luminosity_function_cache.npz')
+
+
+def iter_absolute_magnitudes(catalogue_path: str, chunk_size: int = 1_000_000):
+    """Yield absolute G magnitudes of the catalogue stars, reading the CSV in chunks."""
+    for chunk in pd.read_csv(catalogue_path, usecols=['parallax', 'phot_g_mean_mag'], chunksize=chunk_size):
+        chunk = chunk[chunk['parallax'] > 0].dropna()
+        distance = 1000/chunk['parallax'].to_numpy()
+        yield chunk['phot_g_mean_mag'].to_numpy() - 5*np.log10(distance/10)
+
+
+def magnitude_to_brightness(magnitude: np.ndarray, brightness: float) -> np.ndarray:
+    """Convert absolute magnitudes to B values, where a Sun-like star has B = brightness."""
+    return brightness * 10**(-0.4*(magnitude - SUN_ABSOLUTE_MAGNITUDE))
+
+
+@dataclass
+class LuminosityFunction:
+
+    """Inverse-CDF sampler of absolute magnitudes fitted to the Gaia close-star catalogue."""
+
+    catalogue_path: str = default_catalogue_path
+    cache_path: str | None = default_cache_path
+    n_bins: int = 100
+    n_table: int = 4096
+    chunk_size: int = 1_000_000
+
+    bin_centers: np.ndarray = field(init=False)
+    counts: np.ndarray = field(init=False)
+    magnitude_table: np.ndarray = field(init=False)
+
+    def __post_init__(self) -> None:
+        if not self.load_cache():
+            self.build()
+            self.save_cache()
+
+    def cache_key(self) -> str:
+        stat = os.stat(self.catalogue_path)
+        return f'{os.path.abspath(self.catalogue_path)}:{stat.st_size}:{stat.st_mtime_ns}:{self.n_bins}:{self.n_table}'
+
+    def load_cache(self) -> bool:
+        """Load the tables from the cache file, returning False if it is missing or stale."""
+        if self.cache_path is None or not os.path.exists(self.cache_path):
+            return False
+        cache = np.load(self.cache_path)
+        # Without the catalogue the cache is the only source, so it is used as is
+        if os.path.exists(self.catalogue_path) and str(cache['key']) != self.cache_key():
+            return False
+        self.bin_centers = cache['bin_centers']
+        self.counts = cache['counts']
+        self.magnitude_table = cache['magnitude_table']
+        return True
+
+    def save_cache(self) -> None:
+        if self.cache_path is None:
+            return
+        np.savez(self.cache_path, key=self.cache_key(), bin_centers=self.bin_centers, counts=self.counts, magnitude_table=self.magnitude_table)
+
+    def build(self) -> None:
+        """Histogram the catalogue, fit a cubic spline and tabulate its inverse CDF."""
+        if not os.path.exists(self.catalogue_path):
+            raise FileNotFoundError(f'Gaia catalogue not found at {self.catalogue_path} and no cached luminosity function at {self.cache_path}')
+
+        # First pass finds the magnitude range, second pass fills the histogram
+        lower, upper = np.inf, -np.inf
+        for magnitude in iter_absolute_magnitudes(self.catalogue_path, self.chunk_size):
+            if len(magnitude):
+                lower = min(lower, magnitude.min())
+                upper = max(upper, magnitude.max())
+        if not lower < upper:
+            raise ValueError(f'Not enough stars in {self.catalogue_path} to build a luminosity function')
+
+        bins = np.linspace(lower, upper, self.n_bins)
+        counts = np.zeros(len(bins) - 1)
+        for magnitude in iter_absolute_magnitudes(self.catalogue_path, self.chunk_size):
+            counts += np.histogram(magnitude, bins)[0]
+
+        self.bin_centers = (bins[:-1] + bins[1:]) / 2
+        self.counts = counts
+
+        # The spline can undershoot between bins, so negative densities are clipped by the table
+        spline = CubicSpline(self.bin_centers, self.counts)
+        self.magnitude_table = InverseCDFTable.from_density(spline, self.bin_centers[0], self.bin_centers[-1], self.n_table).quantiles
+
+    def sample_magnitudes(self, n_stars: int, rng: np.random.Generator | None = None) -> np.ndarray:
+        """Draw absolute magnitudes by linear interpolation in the inverse-CDF table."""
+        u = np.random.uniform(0, 1, n_stars) if rng is None else rng.random(n_stars)
+        return InverseCDFTable(self.magnitude_table).ppf(u)
+
+    def sample_brightness(self, n_stars: int, brightness: float, rng: np.random.Generator | None = None) -> np.ndarray:
+        return magnitude_to_brightness(self.sample_magnitudes(n_stars, rng), brightness)
+
+
+_luminosity_function: LuminosityFunction | None = None
+
+def get_luminosity_function() -> LuminosityFunction:
+    """Return the process-wide luminosity function, building or loading it on first use."""
+    global _luminosity_function
+    if _luminosity_function is None:
+        _luminosity_function = LuminosityFunction()
+    return _luminosity_function
+
+def sample_brightness(n_stars: int, brightness: float, rng: np.random.Generator | None = None) -> np.ndarray:
+    """Draw per-star B values from the Gaia luminosity function."""
+    return get_luminosity_function().sample_brightness(n_stars, brightness, rng)
@@ -0,0 +1,142 @@
+import os
+from dataclasses import dataclass
+from .components import CHUNK_SIZE, COMPONENT_NAMES, chunk_bounds, component_parameters
+from .config import SpiralGalaxyConfig
+from .instrumentation import current_rss_bytes
+from .star_buffer import STAR_COLUMNS, VELOCITY_COLUMNS, star_dtype
+
+# Working memory per star, measured with tracemalloc on the default config
+SAMPLING_BYTES_PER_STAR = 80 # Tabulated sampling of one chunk
+REFERENCE_BYTES_PER_STAR = 200 # A reference loop while it runs
+REFERENCE_RETAINED_BYTES_PER_STAR = 96 # float64 columns and DataFrame every component object keeps
+VIEW_RETAINED_BYTES_PER_STAR = 24 # DataFrame of a component object over the star buffer, see component_view()
+KINEMATICS_BYTES_PER_STAR = 32 # Velocities of one chunk
+QUANTIZE_BYTES_PER_STAR = 120 # Encoding and round-trip check of a .gqz export
+CSV_WRITER_BYTES = 24 * 2**20 # pandas formats CSV in blocks of rows
+CSV_BYTES_PER_VALUE = 9.0 # Average width of one float32 column in a CSV row, with its separator
+# Fixed costs on top of the stars, measured as peak RSS against the plan
+PROCESS_BYTES = 128 * 2**20 # Interpreter, numpy, scipy and pandas, used where the process's RSS cannot be read
+CACHE_BYTES = 16 * 2**20 # Sampling tables, rotation curves and population caches, and code imported on first use
+SAFETY_MARGIN = 0.1 # Fraction added to the whole estimate
+
+OUTPUT_FORMATS = ('csv', 'gqz', 'npy')
+
+
+@dataclass(frozen=True)
+class MemoryPlan:
+
+    """Estimated memory of a SpiralGalaxy run, per stage, and the size of its output."""
+
+    n_stars: int
+    chunk_size: int
+    n_workers: int
+    lean: bool
+    stage_bytes: dict[str, int] # Peak bytes of every stage on top of the fixed ones, in run order
+    output_bytes: int
+    budget: int | None = None
+    fixed_bytes: int = PROCESS_BYTES + CACHE_BYTES # Resident before the run starts, plus the caches it builds
+
+    @property
+    def peak_bytes(self) -> int:
+        """Peak resident memory of the whole process, with the safety margin."""
+        return int((self.fixed_bytes + max(self.stage_bytes.values())) * (1 + SAFETY_MARGIN))
+
+    @property
+    def fits(self) -> bool:
+        return self.budget is None or self.peak_bytes <= self.budget
+
+
+def output_size(n_stars: int, velocities: bool, output_format: str | None) -> int:
+    """Estimated bytes of an exported file."""
+    n_columns = len(STAR_COLUMNS) + (len(VELOCITY_COLUMNS) if velocities else 0)
+    if output_format is None:
+        return 0
+    if output_format == 'csv':
+        return int(n_stars * n_columns * CSV_BYTES_PER_VALUE)
+    if output_format == 'npy':
+        return n_stars * star_dtype(velocities).itemsize
+    if output_format == 'gqz':
+        # 16-bit positions and log indices, float32 velocities
+        return n_stars * (2 * len(STAR_COLUMNS) + (4 * len(VELOCITY_COLUMNS) if velocities else 0))
+    raise ValueError(f'Unknown output format {output_format!r}, expected one of {OUTPUT_FORMATS}')
+
+def plan_memory(config: SpiralGalaxyConfig, engine: str = 'tabulated', output_format: str | None = 'csv', chunk_size: int = CHUNK_SIZE,
+                n_workers: int | None = None, lean: bool = False, budget: int | None = None) -> MemoryPlan:
+    """
+    Estimate the peak memory of generating a galaxy from config, assigning velocities if the config
+    has kinematics, and exporting it to output_format (None for no export), before running it.
+
+    Parameters:
+        config (SpiralGalaxyConfig): Galaxy to plan for.
+        engine (str): 'tabulated' or 'reference'.
+        output_format (str): 'csv', 'gqz', 'npy' or None.
+        chunk_size (int): Stars per chunk of a split component.
+        n_workers (int): Threads sampling chunks, defaults to the number of CPUs.
+        lean (bool): Plan for SpiralGalaxy(lean=True), which keeps no component objects and no DataFrame.
+        budget (int): Bytes available, to check the plan against.
+
+    The budget is for the whole process: what it holds already, read from its RSS, the caches the
+    run builds and SAFETY_MARGIN are added to the stars' own memory.
+    """
+    velocities = config.kinematics_parameters is not None
+    counts = {name: component_parameters(config, name).n_stars for name in COMPONENT_NAMES}
+    n_stars = sum(counts.values())
+    n_workers = n_workers or os.cpu_count() or 1
+    star_bytes = star_dtype().itemsize
+    buffer = n_stars * star_dtype(velocities).itemsize
+    dataframe = 0 if lean else buffer
+    stages = {}
+
+    if engine == 'tabulated':
+        # The largest chunks of one component sampled at once, one per worker
+        in_flight = max(sum(sorted((stop - start for start, stop in chunk_bounds(n, chunk_size)), reverse=True)[:n_workers]) for n in counts.values())
+        stages['generation'] = buffer + in_flight * SAMPLING_BYTES_PER_STAR
+        retained = 0 if lean else n_stars * VIEW_RETAINED_BYTES_PER_STAR
+    elif lean:
+        # One component object at a time, each copied into a compact buffer and released before the next
+        compact = n_stars * star_bytes
+        stages['generation'] = max(compact + max(counts.values()) * REFERENCE_BYTES_PER_STAR, compact + buffer)
+        retained = 0
+    else:
+        # Every component object is kept, then copied into compact buffers and merged
+        retained = n_stars * REFERENCE_RETAINED_BYTES_PER_STAR
+        last = counts[COMPONENT_NAMES[-1]]
+        stages['generation'] = max(retained + last * (REFERENCE_BYTES_PER_STAR - REFERENCE_RETAINED_BYTES_PER_STAR), retained + n_stars * star_bytes + buffer)
+
+    if velocities:
+        stages['kinematics'] = retained + buffer + min(chunk_size, max(counts.values())) * KINEMATICS_BYTES_PER_STAR
+
+    stages['dataframe'] = retained + buffer + dataframe
+
+    if output_format == 'csv':
+        # A lean galaxy writes blocks of chunk_size rows instead of one DataFrame
+        stages['export'] = retained + buffer + (min(chunk_size, n_stars) * star_dtype(velocities).itemsize if lean else dataframe) + CSV_WRITER_BYTES
+    elif output_format == 'gqz':
+        stages['export'] = retained + buffer + dataframe + n_stars * QUANTIZE_BYTES_PER_STAR
+    elif output_format == 'npy':
+        stages['export'] = retained + buffer + dataframe
+
+    fixed = (current_rss_bytes() or PROCESS_BYTES) + CACHE_BYTES
+    return MemoryPlan(n_stars, chunk_size, n_workers, lean, stages, output_size(n_stars, velocities, output_format), budget, fixed)
+
+def choose_n_workers(config: SpiralGalaxyConfig, budget: int, n_workers: int | None = None, **plan_options) -> int | None:
+    """
+    Most workers, up to n_workers (the number of CPUs by default), whose plan fits the budget, or
+    None when a single one does not. Fewer workers sample fewer chunks at once but leave the chunks,
+    and so the stars, unchanged; the chunk size is the caller's to choose.
+    """
+    n_workers = n_workers or os.cpu_count() or 1
+    for workers in range(n_workers, 0, -1):
+        if plan_memory(config, n_workers=workers, budget=budget, **plan_options).fits:
+            return workers
+    return None
+
+def print_memory_plan(plan: MemoryPlan) -> None:
+    print('\n---------- Memory plan ----------')
+    print(f"{plan.n_stars} stars, chunks of {plan.chunk_size} on {plan.n_workers} workers{', lean' if plan.lean else ''}")
+    print(f"{'fixed':<12} {plan.fixed_bytes / 2**20:10.1f} MiB")
+    for stage, stage_bytes in plan.stage_bytes.items():
+        print(f"{stage:<12} {stage_bytes / 2**20:10.1f} MiB")
+    print(f"Peak: {plan.peak_bytes / 2**20:.1f} MiB with a {SAFETY_MARGIN:.0%} margin, output: {plan.output_bytes / 2**20:.1f} MiB")
+    if plan.budget is not None:
+        print(f"Budget: {plan.budget / 2**20:.1f} MiB, {'fits' if plan.fits else 'does NOT fit'}")
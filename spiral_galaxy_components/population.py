@@ -0,0 +1,109 @@
+import numpy as np
+from functools import lru_cache
+from dataclasses import dataclass
+from .config import PopulationParameters
+from .luminosity_function import sample_brightness
+from .sampling import InverseCDFTable, sample_temperature
+
+# Effective temperature of the Sun in K
+SUN_TEMPERATURE = 5772.0
+
+
+def main_sequence_luminosity(mass: np.ndarray) -> np.ndarray:
+    """Main-sequence luminosity in solar units from the piecewise mass-luminosity relation."""
+    return np.select(
+        [mass < 0.43, mass < 2, mass < 55],
+        [0.23 * mass**2.3, mass**4, 1.4 * mass**3.5],
+        32000 * mass
+    )
+
+def main_sequence_radius(mass: np.ndarray) -> np.ndarray:
+    """Main-sequence radius in solar units."""
+    return np.where(mass < 1, mass**0.8, mass**0.57)
+
+def main_sequence_temperature(mass: np.ndarray) -> np.ndarray:
+    """Effective temperature in K from the Stefan-Boltzmann law, L = R^2 T^4 in solar units."""
+    return SUN_TEMPERATURE * (main_sequence_luminosity(mass) / main_sequence_radius(mass)**2)**0.25
+
+def turnoff_mass(age: float) -> float:
+    """Mass whose main-sequence lifetime, 10 Gyr * M^-2.5, equals age in Gyr."""
+    return (10 / age)**(1 / 2.5)
+
+def broken_power_law_imf(mass: np.ndarray, breaks: tuple[float, ...], slopes: tuple[float, ...]) -> np.ndarray:
+    """Continuous broken power law dN/dm proportional to m^-slope, with slopes changing at breaks."""
+    if len(slopes) != len(breaks) + 1:
+        raise ValueError('imf_slopes must have one more entry than imf_breaks')
+
+    imf = mass**(-slopes[0])
+    norm = 1.0
+    for i, m_break in enumerate(breaks):
+        # Scale each segment so the IMF is continuous at the break
+        norm *= m_break**(slopes[i+1] - slopes[i])
+        imf = np.where(mass >= m_break, norm * mass**(-slopes[i+1]), imf)
+    return imf
+
+
+@dataclass(frozen=True)
+class PopulationTables:
+
+    """Temperature, luminosity and radius of equal-probability mass bins of a population."""
+
+    mass: np.ndarray
+    temperature: np.ndarray
+    luminosity: np.ndarray
+    radius: np.ndarray
+
+    def sample(self, n_stars: int, rng: np.random.Generator | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Draw T (K), L and R (solar units) for n_stars with a single random bin index per star."""
+        if rng is None:
+            index = np.random.randint(0, len(self.mass), n_stars)
+        else:
+            index = rng.integers(0, len(self.mass), n_stars)
+        return self.temperature[index], self.luminosity[index], self.radius[index]
+
+
+@lru_cache(maxsize=None)
+def population_tables(population: PopulationParameters, n_bins: int = 65536) -> PopulationTables:
+    """
+    Build, once per population, the tables mapping a bin index to stellar properties.
+
+    The bins are equal-probability slices of the IMF, each represented by its median mass, so
+    sampling is a single integer draw and one gather per column, about the cost of a normal draw.
+    """
+    max_mass = min(population.max_mass, turnoff_mass(population.age))
+    if not population.min_mass < max_mass:
+        raise ValueError(f'No main-sequence stars left between {population.min_mass} and {max_mass} solar masses at age {population.age} Gyr')
+
+    # Tabulating in log mass keeps the resolution even across the IMF's dynamic range
+    log_mass_table = InverseCDFTable.from_density(
+        lambda log_m: np.exp(log_m) * broken_power_law_imf(np.exp(log_m), population.imf_breaks, population.imf_slopes),
+        np.log(population.min_mass),
+        np.log(max_mass),
+        n_bins + 1
+    )
+    mass = np.exp(log_mass_table.ppf((np.arange(n_bins) + 0.5) / n_bins))
+
+    return PopulationTables(
+        mass=mass,
+        temperature=main_sequence_temperature(mass),
+        luminosity=main_sequence_luminosity(mass),
+        radius=main_sequence_radius(mass)
+    )
+
+def sample_population(population: PopulationParameters, n_stars: int, brightness: float, size: float, rng: np.random.Generator | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Draw T, B and S columns for a population, with B and S scaled so a Sun-like star has the component's brightness and size."""
+    temperature, luminosity, radius = population_tables(population).sample(n_stars, rng)
+    return temperature, brightness * luminosity, size * radius
+
+def sample_star_properties(parameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Draw the T, B and S columns of any component from its parameters."""
+    if parameters.population is not None:
+        return sample_population(parameters.population, n_stars, parameters.brightness, parameters.size, rng)
+
+    temperature = sample_temperature(n_stars, parameters.temp_mean, parameters.temp_sd, rng)
+    if parameters.sample_brightness:
+        brightness = sample_brightness(n_stars, parameters.brightness, rng)
+    else:
+        brightness = np.full(n_stars, parameters.brightness)
+    size = np.full(n_stars, parameters.size)
+    return temperature, brightness, size
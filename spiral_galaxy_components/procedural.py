@@ -0,0 +1,410 @@
+import numpy as np
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+from scipy.special import ndtr, ndtri
+from scipy.stats import qmc
+from .bar import bar_x_density
+from .components import COMPONENT_NAMES, component_index, component_parameters
+from .config import BarParameters, BulgeParameters, DiskParameters, ScatteredStarParameters, SpiralArmParameters, SpiralGalaxyConfig
+from .disk import THICK_FRACTION
+from .helper import derive_seed
+from .population import sample_star_properties
+from .sampling import inverse_cdf_table, plummer_cdf, plummer_radius
+from .spiral_arms import SpiralArmLayout, build_spiral_arm_layout
+from .star_buffer import fill_star_buffer, make_star_buffer
+
+# Seed key after the component indices 0-4, the kinematics stage 5 and the stratified shuffle 6
+CELL_KEY = 8
+# Cell indices are offset to be non-negative in the derived seeds
+CELL_OFFSET = 1 << 20
+
+# Jitter standard deviations around a cell within which a component's unjittered points are proposed
+JITTER_REACH = 5.0
+# Uniform variates used by every proposal's draw()
+DIMENSIONS = 4
+# Fixed scrambled Sobol points: the per-cell integrals are deterministic and independent of the seed
+QUADRATURE_POINTS = qmc.Sobol(DIMENSIONS, seed=0).random(1024)
+# Largest batch of candidates drawn at once when placing a cell's stars
+MAX_BATCH = 1 << 20
+
+
+# ---------- Geometry ----------
+
+def radial_range(lower: np.ndarray, upper: np.ndarray) -> tuple[float, float]:
+    """Nearest and farthest distance of the box [lower, upper] from the origin, in any number of dimensions."""
+    nearest = np.clip(0.0, lower, upper)
+    farthest = np.maximum(np.abs(lower), np.abs(upper))
+    return float(np.linalg.norm(nearest)), float(np.linalg.norm(farthest))
+
+def azimuth_range(lower: np.ndarray, upper: np.ndarray) -> tuple[float, float]:
+    """Start and width of the azimuths covered by the box [lower, upper] in the plane of its first two axes."""
+    if lower[0] <= 0 <= upper[0] and lower[1] <= 0 <= upper[1]:
+        return 0.0, 2*np.pi
+    centre = np.arctan2(lower[1] + upper[1], lower[0] + upper[0])
+    # The rectangle is convex and misses the origin, so its extreme azimuths are at corners
+    corners = np.arctan2([lower[1], lower[1], upper[1], upper[1]], [lower[0], upper[0], lower[0], upper[0]])
+    offset = (corners - centre + np.pi) % (2*np.pi) - np.pi
+    return float(centre + offset.min()), float(offset.max() - offset.min())
+
+def polar_range(lower: np.ndarray, upper: np.ndarray, nearest: float, farthest: float) -> tuple[float, float]:
+    """Bounds of cos(polar angle) over the box, given its radial_range()."""
+    if nearest == 0:
+        return -1.0, 1.0
+    low = lower[2] / (farthest if lower[2] >= 0 else nearest)
+    high = upper[2] / (nearest if upper[2] >= 0 else farthest)
+    return max(low, -1.0), min(high, 1.0)
+
+
+# ---------- Normal distributions ----------
+
+def normal_mass(mean: np.ndarray, sd: float | np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Probability of N(mean, sd) in [lower, upper], negative when lower > upper."""
+    a = (lower - mean) / sd
+    b = (upper - mean) / sd
+    # Upper tails are mirrored onto lower ones, where ndtr keeps its precision
+    sign = np.where(a + b > 0, -1.0, 1.0)
+    return sign * (ndtr(sign * b) - ndtr(sign * a))
+
+def truncated_normal_ppf(u: np.ndarray, mean: np.ndarray, sd: float | np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Quantile u of N(mean, sd) restricted to [lower, upper], accurate in either tail."""
+    a = (lower - mean) / sd
+    b = (upper - mean) / sd
+    sign = np.where(a + b > 0, -1.0, 1.0)
+    low = ndtr(sign * a)
+    x = ndtri(low + u * (ndtr(sign * b) - low))
+    return np.clip(mean + sd * sign * x, lower, upper)
+
+
+# ---------- Conditioned samplers ----------
+
+@dataclass(frozen=True)
+class CellProposal:
+
+    """
+    A component's stars before their jitter, conditioned on an enclosure of a box: mass is the
+    fraction of the component inside the enclosure and draw() maps (n, DIMENSIONS) uniforms to
+    points in it, each with the probability weight <= bound of any restriction mass leaves out.
+    """
+
+    mass: float
+    draw: Callable[[np.ndarray], tuple[np.ndarray, np.ndarray]] | None = None
+    bound: float = 1.0
+
+def spherical_proposal(lower: np.ndarray, upper: np.ndarray, radial_mass: float, draw_radius: Callable[[np.ndarray, np.ndarray], np.ndarray]) -> CellProposal:
+    """Isotropic directions towards the box, at radii from draw_radius(u, v) holding radial_mass."""
+    nearest, farthest = radial_range(lower, upper)
+    low, high = polar_range(lower, upper, nearest, farthest)
+    start, width = azimuth_range(lower, upper)
+    mass = radial_mass * (high - low)/2 * width/(2*np.pi)
+    if mass <= 0:
+        return CellProposal(0.0)
+
+    def draw(u: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        r = draw_radius(u[:, 0], u[:, 1])
+        cos_theta = low + u[:, 2] * (high - low)
+        sin_theta = np.sqrt(1 - cos_theta**2)
+        phi = start + u[:, 3] * width
+        return np.column_stack([r * sin_theta * np.cos(phi), r * sin_theta * np.sin(phi), r * cos_theta]), np.ones(len(u))
+    return CellProposal(mass, draw)
+
+def bulge_proposal(parameters: BulgeParameters, lower: np.ndarray, upper: np.ndarray) -> CellProposal:
+    """Plummer radii shifted by -1 as in sample_bulge_stars, restricted to the shells reaching the box."""
+    scale = parameters.bulge_radius
+    max_radius = 4*scale + 1
+    nearest, farthest = radial_range(lower, upper)
+    # |r - 1| in [nearest, farthest] from Plummer radii r beyond 1 and, reflected, inside it
+    branches = np.array([[1 + nearest, min(1 + farthest, max_radius)], [max(1 - farthest, 0.0), 1 - nearest]])
+    cdf = plummer_cdf(branches, scale)
+    masses = np.clip(cdf[:, 1] - cdf[:, 0], 0, None)
+
+    def draw_radius(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        branch = (u * masses.sum() >= masses[0]).astype(np.int64)
+        r = plummer_radius(np.maximum(cdf[branch, 0] + v * masses[branch], np.finfo(float).tiny), scale)
+        return np.abs(r - 1)
+    return spherical_proposal(lower, upper, masses.sum() / plummer_cdf(max_radius, scale), draw_radius)
+
+def bar_proposal(parameters: BarParameters, lower: np.ndarray, upper: np.ndarray) -> CellProposal:
+    """The bar's x table restricted to the box, and the part of each cross-section reaching it."""
+    center_length = parameters.bar_length/2
+    x_table = inverse_cdf_table(lambda x: bar_x_density(x, center_length), -center_length, center_length, key=('bar_x', center_length))
+    low, high = x_table.cdf([lower[0], upper[0]])
+    if high <= low:
+        return CellProposal(0.0)
+
+    # The cross-section is a half-normal radius at a uniform angle in the plane (y, z / (3/4))
+    section_lower = np.array([lower[1], lower[2] / (3/4)])
+    section_upper = np.array([upper[1], upper[2] / (3/4)])
+    nearest, farthest = radial_range(section_lower, section_upper)
+    start, width = azimuth_range(section_lower, section_upper)
+
+    # The weight 2 * normal_mass(0, sd, nearest, farthest) peaks at sd_peak over sd, and sd is monotonic in |x|
+    x_range = x_table.ppf(np.array([low, high]))
+    sd_range = parameters.bar_length*0.1 * (1+(np.array([0.0 if x_range[0] <= 0 <= x_range[1] else np.abs(x_range).min(), np.abs(x_range).max()])/(2*center_length))**2)**(-2.5)
+    sd_peak = np.sqrt((farthest**2 - nearest**2) / (2*np.log(farthest / nearest))) if nearest > 0 else 0.0
+    bound = 2*normal_mass(0.0, np.clip(sd_peak, sd_range[1], sd_range[0]), nearest, farthest) * width/(2*np.pi)
+
+    def draw(u: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        x = x_table.ppf(low + u[:, 0] * (high - low))
+        sd = parameters.bar_length*0.1 * (1+(x/(2*center_length))**2)**(-2.5)
+        r = truncated_normal_ppf(u[:, 1], 0.0, sd, nearest, farthest)
+        angle = start + u[:, 2] * width
+        weight = 2*normal_mass(0.0, sd, nearest, farthest) * width/(2*np.pi)
+        return np.column_stack([x, r * np.cos(angle), r * np.sin(angle) * (3/4)]), weight
+    return CellProposal(float(high - low), draw, float(bound))
+
+def disk_proposal(parameters: DiskParameters, lower: np.ndarray, upper: np.ndarray) -> CellProposal:
+    """The disk's r table restricted to the annulus and azimuths of the box, thick and thin heights to its z range."""
+    r0 = parameters.r0
+    cutoff_radius = parameters.cutoff_radius
+    r_table = inverse_cdf_table(lambda r: r*np.exp2(-r/r0), 0, cutoff_radius, key=('disk_r', r0, cutoff_radius))
+    low, high = r_table.cdf(radial_range(lower[:2], upper[:2]))
+    start, width = azimuth_range(lower, upper)
+    sd = np.array([parameters.norm_height, parameters.thin_height]) / 2
+    z_masses = np.array([THICK_FRACTION, 1 - THICK_FRACTION]) * np.clip(normal_mass(0.0, sd, lower[2], upper[2]), 0, None)
+    mass = (high - low) * width/(2*np.pi) * z_masses.sum()
+    if mass <= 0:
+        return CellProposal(0.0)
+
+    def draw(u: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        r = r_table.ppf(low + u[:, 0] * (high - low))
+        theta = start + u[:, 1] * width
+        scale_height = sd[(u[:, 2] * z_masses.sum() >= z_masses[0]).astype(np.int64)]
+        z = truncated_normal_ppf(u[:, 3], 0.0, scale_height, lower[2], upper[2])
+        return np.column_stack([r * np.cos(theta), r * np.sin(theta), z]), np.ones(len(u))
+    return CellProposal(float(mass), draw)
+
+def spiral_arm_proposal(parameters: SpiralArmParameters, lower: np.ndarray, upper: np.ndarray, layout: SpiralArmLayout) -> CellProposal:
+    """
+    Every hotspot's normal theta restricted to the windings of its arm that pass through the box:
+    the radii r0 exp(k theta) of the box's annulus, intersected with the azimuths of the box.
+    """
+    nearest, farthest = radial_range(lower[:2], upper[:2])
+    start, width = azimuth_range(lower, upper)
+    mean = layout.mean_theta[:, None]
+    sd = layout.sd_theta[:, None]
+    offset = layout.theta_offset[:, None]
+
+    # Hotspots hold no stars beyond 8 standard deviations
+    low = max(np.log(nearest / parameters.r0) / parameters.k if nearest > 0 else -np.inf, float(np.min(mean - 8*sd)))
+    high = min(np.log(farthest / parameters.r0) / parameters.k, float(np.max(mean + 8*sd)))
+    if high <= low:
+        return CellProposal(0.0)
+    if width < 2*np.pi:
+        # theta + theta_offset in [start, start + width] + 2 pi n
+        windings = np.arange(np.floor((low + offset.min() - start - width) / (2*np.pi)), np.ceil((high + offset.max() - start) / (2*np.pi)) + 1)
+        a = np.maximum(low, start - offset + 2*np.pi*windings)
+        b = np.minimum(high, start + width - offset + 2*np.pi*windings)
+    else:
+        a = np.full_like(mean, low)
+        b = np.full_like(mean, high)
+    shape = np.broadcast_shapes(a.shape, mean.shape)
+    a, b, mean, sd, offset = (np.broadcast_to(v, shape).ravel() for v in (a, b, mean, sd, offset))
+    weights = np.broadcast_to(layout.weights[:, None] / layout.weights.sum(), shape).ravel()
+    masses = weights * np.clip(normal_mass(mean, sd, a, b), 0, None)
+    cumulative = np.cumsum(masses)
+    if cumulative[-1] <= 0:
+        return CellProposal(0.0)
+
+    def draw(u: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        interval = np.minimum(np.searchsorted(cumulative, u[:, 0] * cumulative[-1], side='right'), len(masses) - 1)
+        theta = truncated_normal_ppf(u[:, 1], mean[interval], sd[interval], a[interval], b[interval])
+        r = parameters.r0 * np.exp(parameters.k * theta)
+        angle = theta + offset[interval]
+        return np.column_stack([r * np.cos(angle), r * np.sin(angle), np.zeros(len(u))]), np.ones(len(u))
+    return CellProposal(float(cumulative[-1]), draw)
+
+def scattered_star_proposal(parameters: ScatteredStarParameters, lower: np.ndarray, upper: np.ndarray) -> CellProposal:
+    """Normal radii as in sample_scattered_stars, restricted to the shells reaching the box."""
+    mean = 4/3 * parameters.galaxy_radius
+    sd = 4/9 * parameters.galaxy_radius
+    nearest, farthest = radial_range(lower, upper)
+    # A negative radius places the star on the opposite direction, so |r| in [nearest, farthest]
+    branches = np.array([[nearest, farthest], [-farthest, -nearest]])
+    masses = np.clip(normal_mass(mean, sd, branches[:, 0], branches[:, 1]), 0, None)
+
+    def draw_radius(u: np.ndarray, v: np.ndarray) -> np.ndarray:
+        branch = (u * masses.sum() >= masses[0]).astype(np.int64)
+        return np.abs(truncated_normal_ppf(v, mean, sd, branches[branch, 0], branches[branch, 1]))
+    return spherical_proposal(lower, upper, float(masses.sum()), draw_radius)
+
+def component_jitter(name: str, parameters) -> np.ndarray:
+    """Standard deviation of the normal jitter each component's sampler adds to x, y and z."""
+    if name == 'bulge':
+        return np.full(3, parameters.bulge_radius/20)
+    if name == 'bar':
+        return np.full(3, parameters.bar_length/100)
+    if name == 'spiral_arms':
+        return np.array([parameters.spiral_distribution/2, parameters.spiral_distribution/2, parameters.z_distribution/2])
+    return np.zeros(3)
+
+PROPOSALS = {
+    'bulge': bulge_proposal,
+    'bar': bar_proposal,
+    'disk': disk_proposal,
+    'spiral_arms': spiral_arm_proposal,
+    'scattered_stars': scattered_star_proposal,
+}
+
+
+def jitter_probability(points: np.ndarray, jitter: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Probability that the jitter moves each point into the box, an indicator on axes without jitter."""
+    probability = np.ones(len(points))
+    for axis in range(len(jitter)):
+        if jitter[axis] > 0:
+            probability *= normal_mass(points[:, axis], jitter[axis], lower[axis], upper[axis])
+        else:
+            probability *= (points[:, axis] >= lower[axis]) & (points[:, axis] < upper[axis])
+    return probability
+
+def jitter_bounds(jitter: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> np.ndarray:
+    """Largest jitter_probability() along each axis, that of a point at the centre of the box."""
+    half = (upper - lower) / 2
+    return np.array([normal_mass(0.0, jitter[axis], -half[axis], half[axis]) if jitter[axis] > 0 else 1.0 for axis in range(3)])
+
+def integrate_cell(proposal: CellProposal, jitter: np.ndarray, lower: np.ndarray, upper: np.ndarray) -> tuple[float, float]:
+    """
+    Fraction of a component's stars inside the box, integrated over the proposal with the fixed
+    QUADRATURE_POINTS, and the rate at which sample_in_cell() accepts the proposal's candidates.
+    """
+    if proposal.mass <= 0:
+        return 0.0, 0.0
+    points, weights = proposal.draw(QUADRATURE_POINTS)
+    probability = float(np.mean(weights * jitter_probability(points, jitter, lower, upper)))
+    return float(proposal.mass * probability), probability / (proposal.bound * np.prod(jitter_bounds(jitter, lower, upper)))
+
+def sample_in_cell(proposal: CellProposal, jitter: np.ndarray, lower: np.ndarray, upper: np.ndarray, n_stars: int, acceptance: float, rng: np.random.Generator) -> np.ndarray:
+    """
+    (n_stars, 3) positions of a component's stars conditioned on the box: candidates from the
+    proposal are accepted with their probability of being jittered into the box, then jittered
+    by normals truncated to it.
+    """
+    axis_bounds = jitter_bounds(jitter, lower, upper)
+    batch = min(int(n_stars / max(acceptance, 1e-6) * 1.25) + 64, MAX_BATCH)
+    accepted = []
+    found = 0
+    while found < n_stars:
+        points, weights = proposal.draw(rng.random((batch, DIMENSIONS)))
+        threshold = rng.random(batch) * proposal.bound * np.prod(axis_bounds)
+        # One axis at a time, dropping candidates that the remaining axes could no longer accept
+        for axis in range(3):
+            weights = weights * jitter_probability(points[:, axis:axis + 1], jitter[axis:axis + 1], lower[axis:axis + 1], upper[axis:axis + 1])
+            keep = threshold < weights * np.prod(axis_bounds[axis + 1:])
+            points, weights, threshold = points[keep], weights[keep], threshold[keep]
+        accepted.append(points)
+        found += len(points)
+    points = np.concatenate(accepted)[:n_stars]
+    for axis in range(3):
+        if jitter[axis] > 0:
+            points[:, axis] = truncated_normal_ppf(rng.random(n_stars), points[:, axis], jitter[axis], lower[axis], upper[axis])
+    return points
+
+
+@dataclass
+class ProceduralGalaxy:
+
+    """
+    Deep-zoom generation of a spiral galaxy, one spatial cell at a time.
+
+    The expected count of every component in a cell is its analytic density integrated over the
+    cell, so no cell the galaxy reaches is left empty. Each cell draws a Poisson number of stars
+    around that count times the density multiplier and places them with the component's own
+    sampler conditioned on the cell, from a seed derived from the cell's coordinates. A region
+    therefore always holds the same stars and costs time proportional to its volume and star
+    count, not to the galaxy. Integrals and generated cells are kept in LRU caches.
+    """
+
+    config: SpiralGalaxyConfig
+    seed: int | None = None
+    cell_size: float = 0.5 # kpc, width of the cells in x and y
+    cell_height: float = 0.1 # kpc, height of the cells, resolving the thin disk
+    cache_size: int = 4096 # Generated cells kept in memory
+
+    layout: SpiralArmLayout = field(init=False)
+    _cache: OrderedDict = field(init=False, default_factory=OrderedDict)
+    _integrals: OrderedDict = field(init=False, default_factory=OrderedDict)
+
+    def __post_init__(self) -> None:
+        if self.seed is None:
+            self.seed = np.random.SeedSequence().entropy
+        # The same hotspots as the spiral arms of SpiralGalaxy with this seed
+        self.layout = build_spiral_arm_layout(self.config.spiral_arm_parameters, np.random.default_rng(derive_seed(self.seed, component_index('spiral_arms'))))
+
+    @property
+    def cell_shape(self) -> np.ndarray:
+        return np.array([self.cell_size, self.cell_size, self.cell_height])
+
+    def cell_bounds(self, cell: tuple[int, int, int]) -> tuple[np.ndarray, np.ndarray]:
+        lower = np.asarray(cell) * self.cell_shape
+        return lower, lower + self.cell_shape
+
+    def proposal(self, name: str, lower: np.ndarray, upper: np.ndarray) -> tuple[CellProposal, np.ndarray]:
+        """Proposal of a component for the box, reaching JITTER_REACH jitters around it, and the jitter."""
+        parameters = component_parameters(self.config, name)
+        jitter = component_jitter(name, parameters)
+        reach = JITTER_REACH * jitter
+        if name == 'spiral_arms':
+            return spiral_arm_proposal(parameters, lower - reach, upper + reach, self.layout), jitter
+        return PROPOSALS[name](parameters, lower - reach, upper + reach), jitter
+
+    def cell_integrals(self, cell: tuple[int, int, int]) -> np.ndarray:
+        """(n_components, 2) fraction of each component's stars in the cell and the acceptance of its sampler."""
+        if cell in self._integrals:
+            self._integrals.move_to_end(cell)
+            return self._integrals[cell]
+        lower, upper = self.cell_bounds(cell)
+        integrals = np.array([integrate_cell(*self.proposal(name, lower, upper), lower, upper) for name in COMPONENT_NAMES])
+        self._remember(self._integrals, cell, integrals)
+        return integrals
+
+    def expected_stars(self, cell: tuple[int, int, int], multiplier: float = 1.0) -> np.ndarray:
+        """Expected number of stars of every component in the cell."""
+        n_stars = np.array([component_parameters(self.config, name).n_stars for name in COMPONENT_NAMES])
+        return self.cell_integrals(cell)[:, 0] * n_stars * multiplier
+
+    def generate_cell(self, cell: tuple[int, int, int], multiplier: float) -> np.ndarray:
+        """Star buffer of the cell with integer coordinates cell, spanning cell * cell_shape to the next cell."""
+        key = (cell, multiplier)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        lower, upper = self.cell_bounds(cell)
+        i, j, k = (int(index) + CELL_OFFSET for index in cell)
+        acceptance = self.cell_integrals(cell)[:, 1]
+        buffers = []
+        for index, (name, expected) in enumerate(zip(COMPONENT_NAMES, self.expected_stars(cell, multiplier))):
+            if expected == 0:
+                continue
+            rng = np.random.default_rng(derive_seed(self.seed, CELL_KEY, index, i, j, k))
+            n = rng.poisson(expected)
+            if n == 0:
+                continue
+            position = sample_in_cell(*self.proposal(name, lower, upper), lower, upper, n, acceptance[index], rng)
+            stars = make_star_buffer(n)
+            fill_star_buffer(stars, (position[:, 0], position[:, 1], position[:, 2], *sample_star_properties(component_parameters(self.config, name), n, rng)))
+            buffers.append(stars)
+        stars = np.concatenate(buffers) if buffers else make_star_buffer(0)
+
+        self._remember(self._cache, key, stars)
+        return stars
+
+    def generate_region(self, lower: tuple[float, float, float], upper: tuple[float, float, float], multiplier: float = 1.0) -> np.ndarray:
+        """Star buffer of every star inside the box [lower, upper] at multiplier times the config's density."""
+        lower = np.asarray(lower, dtype=np.float64)
+        upper = np.asarray(upper, dtype=np.float64)
+        first = np.floor(lower / self.cell_shape).astype(np.int64)
+        last = np.floor(upper / self.cell_shape).astype(np.int64)
+        cells = np.stack(np.meshgrid(*[np.arange(first[axis], last[axis] + 1) for axis in range(3)], indexing='ij'), axis=-1).reshape(-1, 3)
+        stars = np.concatenate([self.generate_cell(tuple(int(index) for index in cell), multiplier) for cell in cells])
+
+        # Cells on the edge of the region reach past it
+        inside = np.ones(len(stars), dtype=bool)
+        for axis, column in enumerate(('XX', 'YY', 'ZZ')):
+            inside &= (stars[column] >= lower[axis]) & (stars[column] <= upper[axis])
+        return stars[inside]
+
+    def _remember(self, cache: OrderedDict, key, value) -> None:
+        cache[key] = value
+        if len(cache) > self.cache_size:
+            cache.popitem(last=False)
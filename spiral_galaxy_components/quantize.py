@@ -0,0 +1,165 @@
+import numpy as np
+from dataclasses import dataclass
+from .star_buffer import VELOCITY_COLUMNS, make_star_buffer
+
+# Quantized star files are .npz archives with this suffix
+QUANTIZED_SUFFIX = '.gqz'
+POSITION_BITS = (16, 32)
+LOG_COLUMNS = ('T', 'B', 'S')
+LOG_LEVELS = 2**16 - 1
+
+
+@dataclass
+class QuantizedStars:
+
+    """
+    Stars with fixed-point positions and log-quantized T, B and S.
+
+    Positions are unsigned offsets of position_bits bits within the bounding box of their chunk of
+    chunk_size consecutive stars, so the error is at most half a step, (box side) / (2^bits - 1) / 2.
+    T, B and S are 16-bit indices of a log-spaced grid over each column's range, a constant
+    relative error, and exact for constant columns. Any velocities stay float32.
+    """
+
+    chunk_size: int
+    lower: np.ndarray # (n_chunks, 3) lower corner of each chunk's box, kpc
+    step: np.ndarray # (n_chunks, 3) size of one position step in each chunk, kpc
+    positions: np.ndarray # (N, 3) uint16 or uint32
+    log_ranges: dict[str, np.ndarray] # (2,) range of T, B and S
+    log_indices: dict[str, np.ndarray] # (N,) uint16 grid index of T, B and S
+    columns: dict[str, np.ndarray] # VX, VY, VZ as float32, if present
+
+    @property
+    def position_bits(self) -> int:
+        return self.positions.dtype.itemsize * 8
+
+    @property
+    def nbytes(self) -> int:
+        arrays = (self.lower, self.step, self.positions, *self.log_ranges.values(), *self.log_indices.values(), *self.columns.values())
+        return sum(a.nbytes for a in arrays)
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+
+def chunk_boxes(positions: np.ndarray, chunk_size: int) -> tuple[np.ndarray, np.ndarray]:
+    """Lower and upper corners of the bounding box of every chunk of chunk_size stars."""
+    starts = np.arange(0, len(positions), chunk_size)
+    return np.minimum.reduceat(positions, starts, axis=0), np.maximum.reduceat(positions, starts, axis=0)
+
+def choose_position_bits(lower: np.ndarray, upper: np.ndarray, max_error: float) -> int:
+    """Fewest bits of POSITION_BITS keeping every chunk's error below max_error kpc."""
+    for bits in POSITION_BITS:
+        if ((upper - lower).max(initial=0.0) / (2**bits - 1)) / 2 <= max_error:
+            return bits
+    return POSITION_BITS[-1]
+
+def log_quantize(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Range and uint16 indices of positive values on a log-spaced grid."""
+    values = np.maximum(values.astype(np.float64), 1e-30)
+    value_range = np.array([values.min(), values.max()]) if len(values) else np.ones(2)
+    log_span = np.log(value_range[1] / value_range[0])
+    if log_span == 0:
+        return value_range, np.zeros(len(values), dtype=np.uint16)
+    return value_range, np.rint(np.log(values / value_range[0]) * (LOG_LEVELS / log_span)).astype(np.uint16)
+
+def log_dequantize(value_range: np.ndarray, index: np.ndarray) -> np.ndarray:
+    low, high = value_range
+    return low * np.exp(index * (np.log(high / low) / LOG_LEVELS))
+
+def encode_stars(stars: np.ndarray, max_error: float = 0.005, chunk_size: int = 65536, position_bits: int | None = None) -> QuantizedStars:
+    """
+    Quantize a star buffer.
+
+    Parameters:
+        stars (np.ndarray): Star buffer.
+        max_error (float): Largest position error allowed in kpc, used to choose between 16 and 32 bit offsets.
+        chunk_size (int): Stars sharing one bounding box.
+        position_bits (int): Force 16 or 32 bit offsets instead.
+    """
+    positions = np.column_stack([stars['XX'], stars['YY'], stars['ZZ']]).astype(np.float64)
+    n = len(positions)
+    if n == 0:
+        lower = upper = np.zeros((0, 3))
+    else:
+        lower, upper = chunk_boxes(positions, chunk_size)
+    bits = position_bits or choose_position_bits(lower, upper, max_error)
+    if bits not in POSITION_BITS:
+        raise ValueError(f'position_bits must be one of {POSITION_BITS}')
+    levels = 2**bits - 1
+    step = np.maximum(upper - lower, 1e-30) / levels
+
+    chunk = np.arange(n) // chunk_size
+    offsets = np.rint((positions - lower[chunk]) / step[chunk])
+    quantized_positions = np.clip(offsets, 0, levels).astype(np.uint16 if bits == 16 else np.uint32)
+
+    log_ranges = {}
+    log_indices = {}
+    for name in LOG_COLUMNS:
+        log_ranges[name], log_indices[name] = log_quantize(stars[name])
+
+    columns = {name: stars[name].astype(np.float32) for name in VELOCITY_COLUMNS if name in stars.dtype.names}
+    return QuantizedStars(chunk_size, lower, step, quantized_positions, log_ranges, log_indices, columns)
+
+def decode_stars(quantized: QuantizedStars, dtype: np.dtype = np.float32) -> np.ndarray:
+    """Rebuild a star buffer from quantized stars."""
+    n = len(quantized)
+    stars = make_star_buffer(n, velocities='VX' in quantized.columns, dtype=dtype)
+    chunk = np.arange(n) // quantized.chunk_size
+    positions = quantized.lower[chunk] + quantized.positions * quantized.step[chunk]
+    for axis, name in enumerate(('XX', 'YY', 'ZZ')):
+        stars[name] = positions[:, axis]
+    for name in LOG_COLUMNS:
+        stars[name] = log_dequantize(quantized.log_ranges[name], quantized.log_indices[name])
+    for name, column in quantized.columns.items():
+        stars[name] = column
+    return stars
+
+
+def save_quantized(path: str, quantized: QuantizedStars, compress: bool = False) -> str:
+    if not path.endswith(QUANTIZED_SUFFIX):
+        path += QUANTIZED_SUFFIX
+    arrays = {
+        'chunk_size': np.array(quantized.chunk_size),
+        'lower': quantized.lower,
+        'step': quantized.step,
+        'positions': quantized.positions,
+        **{f'range_{name}': value_range for name, value_range in quantized.log_ranges.items()},
+        **{f'index_{name}': index for name, index in quantized.log_indices.items()},
+        **{f'column_{name}': column for name, column in quantized.columns.items()},
+    }
+    # np.savez adds .npz to names without it, so write through a file object
+    with open(path, 'wb') as f:
+        (np.savez_compressed if compress else np.savez)(f, **arrays)
+    return path
+
+def load_quantized(path: str) -> QuantizedStars:
+    with np.load(path) as data:
+        def prefixed(prefix: str) -> dict[str, np.ndarray]:
+            return {key[len(prefix):]: data[key] for key in data.files if key.startswith(prefix)}
+        return QuantizedStars(int(data['chunk_size']), data['lower'], data['step'], data['positions'], prefixed('range_'), prefixed('index_'), prefixed('column_'))
+
+
+def round_trip_report(stars: np.ndarray, quantized: QuantizedStars) -> dict[str, float]:
+    """Errors of decoding quantized against the original stars, and the storage saved."""
+    decoded = decode_stars(quantized, dtype=np.float64)
+    error = np.sqrt(sum((decoded[name] - stars[name].astype(np.float64))**2 for name in ('XX', 'YY', 'ZZ')))
+    relative = {name: np.abs(decoded[name] / np.maximum(stars[name].astype(np.float64), 1e-30) - 1) for name in LOG_COLUMNS}
+    float64_bytes = len(stars) * 8 * len(stars.dtype.names)
+    return {
+        'n_stars': len(stars),
+        'position_bits': quantized.position_bits,
+        'max_position_error_kpc': float(error.max(initial=0.0)),
+        'rms_position_error_kpc': float(np.sqrt(np.mean(error**2))) if len(stars) else 0.0,
+        **{f'max_{name}_relative_error': float(relative[name].max(initial=0.0)) for name in LOG_COLUMNS},
+        'quantized_bytes': quantized.nbytes,
+        'float64_bytes': float64_bytes,
+        'compression': float64_bytes / max(quantized.nbytes, 1),
+    }
+
+def print_round_trip_report(report: dict[str, float]) -> None:
+    print('\n---------- Quantization ----------')
+    print(f"{report['n_stars']} stars, {report['position_bits']} bit positions")
+    print(f"Position error: max {report['max_position_error_kpc'] * 1000:.3f} pc, rms {report['rms_position_error_kpc'] * 1000:.3f} pc")
+    print(f"T, B, S error: max {report['max_T_relative_error']:.2e}, {report['max_B_relative_error']:.2e}, {report['max_S_relative_error']:.2e} relative")
+    print(f"{report['quantized_bytes']} bytes instead of {report['float64_bytes']} as float64 ({report['compression']:.1f}x smaller)")
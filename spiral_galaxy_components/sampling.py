@@ -0,0 +1,169 @@
+import numpy as np
+from collections.abc import Callable, Hashable
+from dataclasses import dataclass
+from scipy.special import ndtr, ndtri
+
+# Generation engines understood by the component classes:
+# 'tabulated' draws every star at once from cached tables, 'reference' runs the original per-star loops
+ENGINES = ('tabulated', 'reference')
+
+# Temperatures below this are clipped out of the normal draws, planck() gives meaningless colours there
+MIN_TEMPERATURE = 1000.0
+
+
+def check_engine(engine: str) -> None: 
+    if engine not in ENGINES: 
+        raise ValueError(f"engine must be one of {ENGINES}, got {engine!r}")
+
+
+@dataclass(frozen=True)
+class InverseCDFTable:
+
+    """Inverse CDF of a 1D density tabulated on a uniform grid of quantiles."""
+
+    quantiles: np.ndarray
+
+    @classmethod
+    def from_density(cls, density: Callable[[np.ndarray], np.ndarray], lower: float, upper: float, n_points: int = 4096) -> 'InverseCDFTable':
+        """
+        Tabulate the inverse CDF of an unnormalized density on [lower, upper].
+
+        Parameters:
+            density (callable): Vectorized, non-negative density function.
+            lower (float): Lower bound of the support.
+            upper (float): Upper bound of the support.
+            n_points (int): Number of grid points used for the CDF and its inverse.
+        """
+        if not lower < upper:
+            raise ValueError('lower must be less than upper')
+
+        # Sample the density more finely than the table so the inverse is accurate in the tails
+        grid = np.linspace(lower, upper, 8*n_points)
+        pdf = np.clip(np.asarray(density(grid), dtype=float), 0, None)
+        cdf = np.concatenate([[0.0], np.cumsum((pdf[1:] + pdf[:-1]) / 2 * np.diff(grid))])
+        if cdf[-1] <= 0:
+            raise ValueError('density must be positive somewhere in [lower, upper]')
+        cdf /= cdf[-1]
+
+        # Keep only strictly increasing CDF points so the inverse is well defined
+        keep = np.concatenate([[True], np.diff(cdf) > 0])
+        keep[-1] = True
+        return cls(np.interp(np.linspace(0, 1, n_points), cdf[keep], grid[keep]))
+
+    def ppf(self, u: np.ndarray) -> np.ndarray:
+        """Map uniform variates in [0, 1] to samples by linear interpolation in the table."""
+        position = np.asarray(u) * (len(self.quantiles) - 1)
+        index = np.minimum(position.astype(np.int64), len(self.quantiles) - 2)
+        frac = position - index
+        return self.quantiles[index] + frac * (self.quantiles[index + 1] - self.quantiles[index])
+
+    def cdf(self, x: np.ndarray) -> np.ndarray:
+        """Inverse of ppf, the fraction of the distribution below x."""
+        return np.interp(x, self.quantiles, np.linspace(0, 1, len(self.quantiles)))
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        return self.ppf(rng.random(n))
+
+
+@dataclass(frozen=True)
+class AliasTable:
+
+    """Walker alias table for O(1) sampling of a discrete distribution."""
+
+    probability: np.ndarray
+    alias: np.ndarray
+
+    @classmethod
+    def from_weights(cls, weights: np.ndarray) -> 'AliasTable':
+        weights = np.asarray(weights, dtype=float)
+        if weights.ndim != 1 or len(weights) == 0:
+            raise ValueError('weights must be a non-empty 1D array')
+        if np.any(weights < 0) or weights.sum() <= 0:
+            raise ValueError('weights must be non-negative with a positive sum')
+
+        n = len(weights)
+        scaled = weights * n / weights.sum()
+        probability = np.ones(n)
+        alias = np.arange(n)
+
+        small = [i for i in range(n) if scaled[i] < 1.0]
+        large = [i for i in range(n) if scaled[i] >= 1.0]
+        while small and large:
+            s = small.pop()
+            l = large.pop()
+            probability[s] = scaled[s]
+            alias[s] = l
+            scaled[l] -= 1.0 - scaled[s]
+            if scaled[l] < 1.0:
+                small.append(l)
+            else:
+                large.append(l)
+        # Whatever is left over is 1 up to rounding error and keeps probability 1
+
+        return cls(probability, alias)
+
+    def sample(self, n: int, rng: np.random.Generator) -> np.ndarray:
+        """Draw n indices distributed according to the table's weights."""
+        index = rng.integers(0, len(self.probability), n)
+        use_alias = rng.random(n) >= self.probability[index]
+        return np.where(use_alias, self.alias[index], index)
+
+
+_table_cache: dict[Hashable, InverseCDFTable | AliasTable] = {}
+
+def inverse_cdf_table(density: Callable[[np.ndarray], np.ndarray], lower: float, upper: float, n_points: int = 4096, key: Hashable | None = None) -> InverseCDFTable:
+    """Build an InverseCDFTable, reusing a cached one when the same key was seen before."""
+    if key is None:
+        return InverseCDFTable.from_density(density, lower, upper, n_points)
+    key = ('inverse_cdf', key, lower, upper, n_points)
+    if key not in _table_cache:
+        _table_cache[key] = InverseCDFTable.from_density(density, lower, upper, n_points)
+    return _table_cache[key]
+
+def alias_table(weights: np.ndarray, key: Hashable | None = None) -> AliasTable:
+    """Build an AliasTable, reusing a cached one when the same key was seen before."""
+    if key is None:
+        return AliasTable.from_weights(weights)
+    key = ('alias', key)
+    if key not in _table_cache:
+        _table_cache[key] = AliasTable.from_weights(weights)
+    return _table_cache[key]
+
+def clear_table_cache() -> None:
+    _table_cache.clear()
+
+
+# Analytic forms
+
+def plummer_cdf(r: float | np.ndarray, scale: float) -> float | np.ndarray:
+    """Fraction of a Plummer sphere's mass inside radius r."""
+    return r**3 / (r**2 + scale**2)**1.5
+
+def plummer_radius(u: np.ndarray, scale: float) -> np.ndarray:
+    """Inverse of plummer_cdf, mapping uniform variates to Plummer radii."""
+    return scale / np.sqrt(u**(-2/3) - 1)
+
+def sample_plummer_radius(n: int, scale: float, max_radius: float, rng: np.random.Generator) -> np.ndarray:
+    """Draw Plummer radii truncated at max_radius, without rejection."""
+    u = rng.uniform(0, plummer_cdf(max_radius, scale), n)
+    # u = 0 would give a zero division in plummer_radius
+    u = np.maximum(u, np.finfo(float).tiny)
+    return plummer_radius(u, scale)
+
+def sample_truncated_normal(n: int, mean: float, sd: float, rng: np.random.Generator, lower: float = -np.inf, upper: float = np.inf) -> np.ndarray:
+    """Draw from a normal distribution restricted to [lower, upper] by inverse transform."""
+    if sd <= 0:
+        return np.full(n, np.clip(mean, lower, upper), dtype=float)
+    u = rng.uniform(ndtr((lower - mean) / sd), ndtr((upper - mean) / sd), n)
+    return np.clip(mean + sd * ndtri(u), lower, upper)
+
+def sample_temperature(n: int, mean: float, sd: float, rng: np.random.Generator) -> np.ndarray:
+    """Draw star temperatures from a normal distribution clipped at MIN_TEMPERATURE."""
+    return sample_truncated_normal(n, mean, sd, rng, lower=MIN_TEMPERATURE)
+
+def sample_isotropic_directions(n: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Draw unit vectors uniformly distributed on the sphere."""
+    cos_theta = rng.uniform(-1, 1, n)
+    sin_theta = np.sqrt(1 - cos_theta**2)
+    phi = rng.uniform(0, 2*np.pi, n)
+    return sin_theta * np.cos(phi), sin_theta * np.sin(phi), cos_theta
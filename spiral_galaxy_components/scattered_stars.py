@@ -2,10 +2,13 @@ import numpy as np
 import pandas as pd
 import sys
 import os
-from tqdm import tqdm
 from copy import deepcopy
 from dataclasses import dataclass, field
 from spiral_galaxy_components.config import ScatteredStarParameters, default_scattered_stars_parameters
+from spiral_galaxy_components.instrumentation import current_stage, instrumented
+from spiral_galaxy_components.luminosity_function import sample_brightness
+from spiral_galaxy_components.population import sample_population, sample_star_properties
+from spiral_galaxy_components.sampling import check_engine, sample_isotropic_directions
 
 
 @dataclass
@@ -14,6 +17,8 @@ class ScatteredStars:
     """Initialize scattered star renderer with given parameters."""
 
     parameters: ScatteredStarParameters = field(default_factory=lambda: deepcopy(default_scattered_stars_parameters)) # Copy of default_scattered_stars_parameters
+    engine: str = 'tabulated'
+    seed: int | np.random.SeedSequence | None = None
 
     n_stars: int = field(init=False)
     galaxy_radius: float = field(init=False)
@@ -43,7 +48,11 @@ class ScatteredStars:
 
         print('\n---------- Scattered Stars Rendering ----------')
 
-        self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_scattered_stars()
+        check_engine(self.engine)
+        if self.engine == 'reference': 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_scattered_stars()
+        else: 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = sample_scattered_stars(self.parameters, self.n_stars, np.random.default_rng(self.seed))
         self.df = pd.DataFrame({
             'XX': self.XX, 
             'YY': self.YY, 
@@ -53,6 +62,7 @@ class ScatteredStars:
             'S': self.S
         })
 
+    @instrumented
     def generate_scattered_stars(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """Generate scattered stars within a spherical volume."""
         x = []
@@ -63,7 +73,9 @@ class ScatteredStars:
         size = []
         
         print("\nGenerating scattered stars...")
-        for _ in tqdm(range(self.n_stars), desc="Generating scattered stars"):
+        stage = current_stage()
+        stage.expect(self.n_stars)
+        for _ in range(self.n_stars):
             phi = np.random.uniform(0, 2 * np.pi)
             cos_theta = np.random.uniform(-1, 1)
             theta = np.arccos(cos_theta)
@@ -78,7 +90,13 @@ class ScatteredStars:
             temperature.append(np.random.normal(self.temp_mean, self.temp_sd))
             brightness.append(self.brightness)
             size.append(self.size)
+            stage.advance()
         
+        if self.parameters.sample_brightness: 
+            brightness = sample_brightness(self.n_stars, self.brightness)
+        if self.parameters.population is not None: 
+            temperature, brightness, size = sample_population(self.parameters.population, self.n_stars, self.brightness, self.size)
+
         print()
 
         return np.array(x), np.array(y), np.array(z), np.array(temperature), np.array(brightness), np.array(size)
@@ -100,6 +118,22 @@ class ScatteredStars:
         print(f"Stars exported to {output_path}")
 
 
+
+def sample_scattered_stars(parameters: ScatteredStarParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized equivalent of ScatteredStars.generate_scattered_stars, drawing every star at once from rng."""
+    galaxy_radius = parameters.galaxy_radius
+
+    ux, uy, uz = sample_isotropic_directions(n_stars, rng)
+    r = rng.normal(4/3 * galaxy_radius, 4/9 * galaxy_radius, n_stars)
+
+    x = r * ux
+    y = r * uy
+    z = r * uz
+    temperature, brightness, size = sample_star_properties(parameters, n_stars, rng)
+
+    return x, y, z, temperature, brightness, size
+
+
 def main(): 
     scattered_stars = ScatteredStars(default_scattered_stars_parameters)
 
@@ -0,0 +1,153 @@
+import json
+import numpy as np
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+
+# Layout of a shared star buffer: a fixed header, then the star records
+#   magic, version, n_stars, capacity in bytes, length of the JSON schema, generation, retired
+#   flag, then the schema itself
+# The version is odd while the publisher is writing and even once the stars are consistent. A
+# segment replaced by a new one of the same name is flagged retired, and the new one's generation
+# is one more, so readers know to attach again
+MAGIC = b'GALAXY02'
+HEADER_DTYPE = np.dtype([('magic', 'S8'), ('version', '<u8'), ('n_stars', '<u8'), ('capacity', '<u8'), ('schema_size', '<u8'),
+                         ('generation', '<u8'), ('retired', '<u8')])
+HEADER_SIZE = 4096
+# Segments this process created and has not unlinked, which its resource tracker already holds
+_created: set[str] = set()
+
+
+def attach_shared_memory(name: str) -> SharedMemory:
+    """
+    Attach to an existing segment without letting this process's resource tracker unlink it at
+    exit, which before Python 3.13 would destroy the segment under its owner.
+    """
+    try:
+        return SharedMemory(name, track=False)
+    except TypeError:
+        shared = SharedMemory(name)
+        # The tracker keeps one entry per name: leave the creator's if the creator is this process
+        if shared._name not in _created:
+            resource_tracker.unregister(shared._name, 'shared_memory')
+        return shared
+
+
+class SharedStarBuffer:
+
+    """
+    A star buffer in named shared memory, published by one process and read zero-copy by others.
+
+    Use SharedStarBuffer.create() in the generator and publish() every new set of stars; readers
+    call SharedStarBuffer.attach(), check version() and read stars() once it changes.
+    """
+
+    def __init__(self, shared: SharedMemory, owner: bool) -> None:
+        self.shared = shared
+        self.owner = owner
+        self.header = np.ndarray(1, dtype=HEADER_DTYPE, buffer=shared.buf)
+
+    @classmethod
+    def create(cls, name: str, capacity: int, generation: int = 0) -> 'SharedStarBuffer':
+        """
+        Create a segment holding up to capacity bytes of stars, replacing a stale one of the same
+        name, which is flagged retired for its readers.
+        """
+        try:
+            # Attached with tracking, so unlink() unregisters what this attach registered
+            stale = SharedMemory(name)
+            if stale.size >= HEADER_SIZE:
+                header = np.ndarray(1, dtype=HEADER_DTYPE, buffer=stale.buf)
+                if header[0]['magic'] == MAGIC:
+                    generation = max(generation, int(header[0]['generation']) + 1)
+                    header[0]['retired'] = 1
+                del header
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        buffer = cls(SharedMemory(name, create=True, size=HEADER_SIZE + capacity), owner=True)
+        _created.add(buffer.shared._name)
+        # The magic goes last, so a reader attaching meanwhile sees a header that is not ready
+        buffer.header[0] = (b'', 0, 0, capacity, 0, generation, 0)
+        buffer.header[0]['magic'] = MAGIC
+        return buffer
+
+    @classmethod
+    def attach(cls, name: str) -> 'SharedStarBuffer':
+        """
+        Attach to a published segment. Raises FileNotFoundError if there is none yet, and
+        ValueError if it is not a star buffer, or while its creator has not written the header.
+        """
+        shared = attach_shared_memory(name)
+        if shared.size < HEADER_SIZE:
+            shared.close()
+            raise ValueError(f'Shared memory {name!r} is not a star buffer')
+        buffer = cls(shared, owner=False)
+        if buffer.header[0]['magic'] != MAGIC:
+            buffer.close()
+            raise ValueError(f'Shared memory {name!r} is not a star buffer')
+        return buffer
+
+    @property
+    def name(self) -> str:
+        return self.shared.name
+
+    def version(self) -> int:
+        return int(self.header[0]['version'])
+
+    def generation(self) -> int:
+        return int(self.header[0]['generation'])
+
+    def retired(self) -> bool:
+        """Whether the publisher has closed or replaced this segment, e.g. by a larger one."""
+        return bool(self.header[0]['retired'])
+
+    def publish(self, stars: np.ndarray, component_slices: dict[str, slice] | None = None) -> int:
+        """Copy stars and their schema into the segment and bump the version, which is returned."""
+        schema = json.dumps({
+            'dtype': np.lib.format.dtype_to_descr(stars.dtype),
+            'components': {name: [s.start, s.stop] for name, s in (component_slices or {}).items() if isinstance(s, slice)},
+        }).encode()
+        if HEADER_DTYPE.itemsize + len(schema) > HEADER_SIZE:
+            raise ValueError('Star buffer schema does not fit in the shared header')
+        if stars.nbytes > self.header[0]['capacity']:
+            raise ValueError(f"{stars.nbytes} bytes of stars do not fit in {self.header[0]['capacity']} bytes of shared memory")
+
+        self.header[0]['version'] += 1
+        self.shared.buf[HEADER_DTYPE.itemsize:HEADER_DTYPE.itemsize + len(schema)] = schema
+        np.ndarray(len(stars), dtype=stars.dtype, buffer=self.shared.buf, offset=HEADER_SIZE)[:] = stars
+        self.header[0]['n_stars'] = len(stars)
+        self.header[0]['schema_size'] = len(schema)
+        self.header[0]['version'] += 1
+        return self.version()
+
+    def schema(self) -> dict:
+        size = int(self.header[0]['schema_size'])
+        return json.loads(bytes(self.shared.buf[HEADER_DTYPE.itemsize:HEADER_DTYPE.itemsize + size])) if size else {}
+
+    def stars(self) -> tuple[np.ndarray, dict[str, slice], int] | None:
+        """
+        Zero-copy view of the published stars with their component slices and version, or None
+        while nothing consistent is published. The view changes under the reader when the publisher
+        writes again; compare version() afterwards to know whether what was read is consistent.
+        """
+        version = self.version()
+        if version == 0 or version % 2:
+            return None
+        schema = self.schema()
+        stars = np.ndarray(int(self.header[0]['n_stars']), dtype=np.lib.format.descr_to_dtype(schema['dtype']), buffer=self.shared.buf, offset=HEADER_SIZE)
+        if self.version() != version:
+            return None
+        return stars, {name: slice(*bounds) for name, bounds in schema['components'].items()}, version
+
+    def close(self) -> None:
+        """Detach, and destroy the segment if this process created it."""
+        if self.header is None:
+            return
+        if self.owner:
+            self.header[0]['retired'] = 1
+        self.header = None
+        self.shared.close()
+        if self.owner:
+            self.shared.unlink()
+            _created.discard(self.shared._name)
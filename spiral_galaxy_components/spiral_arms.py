@@ -2,10 +2,13 @@ import numpy as np
 import pandas as pd
 import sys
 import os
-from tqdm import tqdm
 from copy import deepcopy
 from dataclasses import dataclass, field
 from spiral_galaxy_components.config import SpiralArmParameters, default_spiral_arm_parameters
+from spiral_galaxy_components.instrumentation import current_stage, instrumented
+from spiral_galaxy_components.luminosity_function import sample_brightness
+from spiral_galaxy_components.population import sample_population, sample_star_properties
+from spiral_galaxy_components.sampling import AliasTable, check_engine
 from spiral_galaxy_components.helper import *
 
 
@@ -14,6 +17,8 @@ class SpiralArms:
     """Initialize spiral arm renderer with given parameters."""
 
     parameters: SpiralArmParameters = field(default_factory=lambda: deepcopy(default_spiral_arm_parameters)) # Copy of default_spiral_arm_parameters
+    engine: str = 'tabulated'
+    seed: int | np.random.SeedSequence | None = None
 
     n_stars: int = field(init=False)
     star_prop: tuple[float] = field(init=False)
@@ -55,7 +60,11 @@ class SpiralArms:
 
         print('\n---------- Spiral Arms Generation ----------')
 
-        self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_spiral_arms()
+        check_engine(self.engine)
+        if self.engine == 'reference': 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = self.generate_spiral_arms()
+        else: 
+            self.XX, self.YY, self.ZZ, self.T, self.B, self.S = sample_spiral_arm_stars(self.parameters, self.n_stars, np.random.default_rng(self.seed))
         self.df = pd.DataFrame({
             'XX': self.XX, 
             'YY': self.YY, 
@@ -97,8 +106,6 @@ class SpiralArms:
             sd_theta = np.random.uniform(self.max_theta/1000, self.max_theta/20, num_hotspots)
         num_stars_ls = uneven_div(num_stars, num_hotspots, 0.5)
 
-        pbar = tqdm(total=num_stars, desc=f"Generating {'main' if main_arm else 'secondary'} arm stars", leave=False)
-
         for i in range(num_hotspots):
 
             mean_theta_i = mean_theta[i]
@@ -114,19 +121,17 @@ class SpiralArms:
             theta.extend(theta_temp)
             r.extend(r_temp)
             
-            pbar.update(num_stars_i)
-        
-        pbar.close()
+            current_stage().advance(num_stars_i)
         
         return np.array(x), np.array(y), np.array(z), np.array(r), np.array(theta)
     
+    @instrumented
     def generate_spiral_arms(self) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
         """Generate all spiral arms."""
     
 
         print("\nStarting spiral arms generation...")
-
-        pbar = tqdm(total=self.num_main_arms, desc="Main arms progress")
+        current_stage().expect(self.n_stars)
 
         prop = proportional_div(self.n_stars, self.star_prop)
         num_main_stars, num_secondary_stars = prop[0], prop[1]
@@ -153,10 +158,6 @@ class SpiralArms:
             y_all.extend(list(y))
             z_all.extend(list(z))
 
-            pbar.update(1)
-
-        pbar.close()
-
         print(f"\nGenerating {self.num_secondary_arms} main spiral arms...")
 
         for i in range(self.num_secondary_arms):
@@ -170,15 +171,15 @@ class SpiralArms:
             y_all.extend(list(y))
             z_all.extend(list(z))
 
-            pbar.update(1)
-
-        pbar.close()
-
         print("\nCombining all spiral arms...\n")
         
         temperature = np.random.normal(self.temp_mean, self.temp_sd, self.n_stars)
         brightness = np.full(self.n_stars, self.brightness)
         size = np.full(self.n_stars, self.size)
+        if self.parameters.sample_brightness: 
+            brightness = sample_brightness(self.n_stars, self.brightness)
+        if self.parameters.population is not None: 
+            temperature, brightness, size = sample_population(self.parameters.population, self.n_stars, self.brightness, self.size)
         
         return x_all, y_all, z_all, temperature, brightness, size
         
@@ -199,6 +200,66 @@ class SpiralArms:
         print(f"Stars exported to {output_path}")
 
 
+@dataclass(frozen=True)
+class SpiralArmLayout: 
+    """Hotspots of every arm, drawn once per galaxy so stars can then be sampled independently."""
+
+    theta_offset: np.ndarray
+    mean_theta: np.ndarray
+    sd_theta: np.ndarray
+    weights: np.ndarray # Share of the component's stars in every hotspot
+    alias: AliasTable
+
+def build_spiral_arm_layout(parameters: SpiralArmParameters, rng: np.random.Generator) -> SpiralArmLayout: 
+    """Draw the hotspots of all main and secondary arms the same way SpiralArms.generate_arm_star_locations does."""
+    theta_offset: list[np.ndarray] = []
+    mean_theta: list[np.ndarray] = []
+    sd_theta: list[np.ndarray] = []
+    weights: list[np.ndarray] = []
+
+    max_theta = parameters.max_theta
+    arm_groups = [
+        (True, parameters.num_main_arms, parameters.star_prop[0], (25, 35)), 
+        (False, parameters.num_secondary_arms, parameters.star_prop[1], (8, 12))
+    ]
+    for main_arm, num_arms, prop, hotspot_range in arm_groups: 
+        for arm in range(num_arms): 
+            num_hotspots = rng.integers(*hotspot_range)
+            theta_offset.append(np.full(num_hotspots, (2 * np.pi / num_arms) * arm))
+            mean_theta.append(np.linspace(0, max_theta, num_hotspots) + rng.normal(0, max_theta/10, num_hotspots))
+            if main_arm: 
+                sd_theta.append(rng.uniform(max_theta/50, max_theta/10, num_hotspots))
+            else: 
+                sd_theta.append(rng.uniform(max_theta/1000, max_theta/20, num_hotspots))
+            # Same uneven split of the arm's stars between hotspots as uneven_div
+            w = rng.gamma(uneven_alpha(0.5), 1.0, num_hotspots)
+            weights.append(w / w.sum() * prop / num_arms)
+
+    return SpiralArmLayout(
+        theta_offset=np.concatenate(theta_offset), 
+        mean_theta=np.concatenate(mean_theta), 
+        sd_theta=np.concatenate(sd_theta), 
+        weights=np.concatenate(weights), 
+        alias=AliasTable.from_weights(np.concatenate(weights))
+    )
+
+def sample_spiral_arm_stars(parameters: SpiralArmParameters, n_stars: int, rng: np.random.Generator, layout: SpiralArmLayout | None = None) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Vectorized equivalent of SpiralArms.generate_spiral_arms, drawing every star at once from rng."""
+    if layout is None: 
+        layout = build_spiral_arm_layout(parameters, rng)
+
+    hotspot = layout.alias.sample(n_stars, rng)
+    theta = rng.normal(layout.mean_theta[hotspot], layout.sd_theta[hotspot])
+    r = parameters.r0 * np.exp(parameters.k * theta)
+
+    x = r * np.cos(theta + layout.theta_offset[hotspot]) + rng.normal(0, parameters.spiral_distribution/2, n_stars)
+    y = r * np.sin(theta + layout.theta_offset[hotspot]) + rng.normal(0, parameters.spiral_distribution/2, n_stars)
+    z = rng.normal(0, parameters.z_distribution/2, n_stars)
+    temperature, brightness, size = sample_star_properties(parameters, n_stars, rng)
+
+    return x, y, z, temperature, brightness, size
+
+
 def main(): 
     spiral_arms = SpiralArms(default_spiral_arm_parameters)
 
@@ -0,0 +1,40 @@
+import numpy as np
+import pandas as pd
+
+# Columns of every exported star, in CSV order
+STAR_COLUMNS = ('XX', 'YY', 'ZZ', 'T', 'B', 'S')
+# Optional velocity columns in km/s, filled by the kinematics stage
+VELOCITY_COLUMNS = ('VX', 'VY', 'VZ')
+
+
+def star_dtype(velocities: bool = False, dtype: np.dtype = np.float32) -> np.dtype:
+    """
+    Structured dtype of one star, with all columns in a single compact record. Columns are float32
+    by default, about 7 significant digits, where the CSV of the original components was float64.
+    """
+    columns = STAR_COLUMNS + VELOCITY_COLUMNS if velocities else STAR_COLUMNS
+    return np.dtype([(column, dtype) for column in columns])
+
+def make_star_buffer(n_stars: int, velocities: bool = False, dtype: np.dtype = np.float32) -> np.ndarray:
+    """Allocate an uninitialized star buffer for n_stars."""
+    return np.empty(n_stars, dtype=star_dtype(velocities, dtype))
+
+def has_velocities(stars: np.ndarray) -> bool:
+    return all(column in stars.dtype.names for column in VELOCITY_COLUMNS)
+
+def fill_star_buffer(stars: np.ndarray, columns: tuple[np.ndarray, ...]) -> None:
+    """Copy (XX, YY, ZZ, T, B, S) arrays into a star buffer or a slice of one."""
+    for name, column in zip(STAR_COLUMNS, columns):
+        stars[name] = column
+
+def add_velocity_columns(stars: np.ndarray) -> np.ndarray:
+    """Return a copy of the buffer with zeroed velocity columns, or the buffer itself if it already has them."""
+    if has_velocities(stars):
+        return stars
+    with_velocities = np.zeros(len(stars), dtype=star_dtype(True, stars.dtype[0]))
+    for name in STAR_COLUMNS:
+        with_velocities[name] = stars[name]
+    return with_velocities
+
+def star_buffer_to_dataframe(stars: np.ndarray) -> pd.DataFrame:
+    return pd.DataFrame({name: stars[name] for name in stars.dtype.names})
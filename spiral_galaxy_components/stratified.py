@@ -0,0 +1,68 @@
+import numpy as np
+from collections.abc import Iterator
+from .components import COMPONENT_NAMES, component_index, component_parameters, component_sampler
+from .config import SpiralGalaxyConfig
+from .helper import derive_seed
+from .kinematics import assign_velocities, build_rotation_curve
+from .spiral_arms import build_spiral_arm_layout
+from .star_buffer import fill_star_buffer, make_star_buffer
+
+# Seed keys next to the component indices 0-4, matching the kinematics stage of SpiralGalaxy
+KINEMATICS_KEY = 5
+SHUFFLE_KEY = 6
+
+
+def stratified_round_counts(totals: list[int], n_rounds: int) -> np.ndarray:
+    """
+    Stars of each component in each round, an (n_rounds, n_components) array.
+
+    After r rounds a component has exactly floor(total * r / n_rounds) stars, so every round
+    boundary holds each component in proportion to within one star.
+    """
+    totals = np.asarray(totals, dtype=np.int64)
+    cumulative = totals[None, :] * np.arange(n_rounds + 1)[:, None] // n_rounds
+    return np.diff(cumulative, axis=0)
+
+def iter_stratified_stars(config: SpiralGalaxyConfig, seed: int | np.random.SeedSequence, n_rounds: int = 1000, max_stars: int | None = None) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+    """
+    Generate a galaxy as n_rounds stratified rounds, yielding (stars, component index) per round.
+
+    Each round draws its share of every component from its own stream, derive_seed(seed, component,
+    round), and shuffles the stars of the round together. Since the vectorized samplers draw stars
+    independently, every prefix of the stream is an unbiased subsample of the whole galaxy, and
+    stopping at max_stars yields exactly the first max_stars stars of the full run. The spiral arm
+    hotspots are drawn once from the arms' galaxy seed, so the arms have the same layout as
+    SpiralGalaxy.generate_galaxy() with the same seed.
+    """
+    totals = [component_parameters(config, name).n_stars for name in COMPONENT_NAMES]
+    counts = stratified_round_counts(totals, n_rounds)
+    layout = build_spiral_arm_layout(config.spiral_arm_parameters, np.random.default_rng(derive_seed(seed, component_index('spiral_arms'))))
+
+    kinematics = config.kinematics_parameters
+    curve = build_rotation_curve(config, kinematics) if kinematics is not None else None
+
+    remaining = sum(totals) if max_stars is None else min(max_stars, sum(totals))
+    for round_index, round_counts in enumerate(counts):
+        if remaining <= 0:
+            return
+        stars = make_star_buffer(int(round_counts.sum()), velocities=kinematics is not None)
+        labels = np.repeat(np.arange(len(COMPONENT_NAMES), dtype=np.uint8), round_counts)
+        slices = {}
+        start = 0
+        for index, (name, n) in enumerate(zip(COMPONENT_NAMES, round_counts)):
+            rng = np.random.default_rng(derive_seed(seed, index, round_index))
+            parameters = component_parameters(config, name)
+            if name == 'spiral_arms':
+                columns = component_sampler(name)(parameters, n, rng, layout)
+            else:
+                columns = component_sampler(name)(parameters, n, rng)
+            slices[name] = slice(start, start + n)
+            fill_star_buffer(stars[slices[name]], columns)
+            start += n
+
+        if kinematics is not None:
+            assign_velocities(stars, slices, curve, kinematics, np.random.default_rng(derive_seed(seed, KINEMATICS_KEY, round_index)))
+
+        order = np.random.default_rng(derive_seed(seed, SHUFFLE_KEY, round_index)).permutation(len(stars))[:remaining]
+        remaining -= len(order)
+        yield stars[order], labels[order]
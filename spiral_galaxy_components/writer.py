@@ -0,0 +1,129 @@
+import numpy as np
+import multiprocessing as mp
+import os
+import queue
+import threading
+from .star_buffer import star_buffer_to_dataframe
+
+FORMATS = ('csv', 'npy')
+
+
+class ChunkFile:
+
+    """Appends star buffer chunks to a CSV file, or to a .npy file whose length is known in advance."""
+
+    def __init__(self, path: str, fmt: str, n_stars: int | None, dtype: np.dtype) -> None:
+        self.file = open(path, 'wb') if fmt == 'npy' else open(path, 'w', newline='')
+        self.fmt = fmt
+        self.header = True
+        if fmt == 'npy':
+            if n_stars is None:
+                raise ValueError('Writing a .npy file needs n_stars up front')
+            np.lib.format.write_array_header_1_0(self.file, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False, 'shape': (n_stars,)})
+
+    def write(self, stars: np.ndarray) -> None:
+        if self.fmt == 'npy':
+            self.file.write(np.ascontiguousarray(stars).tobytes())
+        else:
+            star_buffer_to_dataframe(stars).to_csv(self.file, index=False, header=self.header)
+            self.header = False
+
+    def close(self) -> None:
+        self.file.close()
+
+
+def _write_from_queue(chunks, path: str, fmt: str, n_stars: int | None, dtype: np.dtype) -> None:
+    """Writer loop of the background thread or process, until a None chunk."""
+    file = ChunkFile(path, fmt, n_stars, dtype)
+    try:
+        while (stars := chunks.get()) is not None:
+            file.write(stars)
+    finally:
+        file.close()
+
+
+class BackgroundWriter:
+
+    """
+    Exports star buffer chunks on a background thread or process while the next ones are generated.
+
+    Chunks go through a bounded queue of max_pending chunks, so one chunk is being written while
+    the next is produced, and a producer running ahead of the disk blocks rather than buffering the
+    whole galaxy. A thread writes the caller's arrays without copying them; CSV formatting holds
+    the GIL, so use_process=True moves it to another process at the cost of sending each chunk.
+    """
+
+    def __init__(self, path: str, dtype: np.dtype, n_stars: int | None = None, max_pending: int = 2, use_process: bool = False) -> None:
+        self.path = path
+        self.fmt = os.path.splitext(path)[1][1:].lower()
+        if self.fmt not in FORMATS:
+            raise ValueError(f'Unknown export format {self.fmt!r}, expected one of {FORMATS}')
+        self.n_stars = n_stars
+        self.written = 0
+        self.errors = []
+
+        if use_process:
+            self.chunks = mp.Queue(max_pending)
+            self.worker = mp.Process(target=_write_from_queue, args=(self.chunks, path, self.fmt, n_stars, dtype), daemon=True)
+        else:
+            self.chunks = queue.Queue(max_pending)
+            self.worker = threading.Thread(target=self._run_thread, args=(path, dtype), daemon=True)
+        self.worker.start()
+
+    def _run_thread(self, path: str, dtype: np.dtype) -> None:
+        try:
+            _write_from_queue(self.chunks, path, self.fmt, self.n_stars, dtype)
+        except Exception as error:
+            self.errors.append(error)
+            # Keep draining so the producer is never left blocked on a full queue
+            while self.chunks.get() is not None:
+                pass
+
+    def _put(self, item: np.ndarray | None) -> None:
+        while True:
+            try:
+                self.chunks.put(item, timeout=1.0)
+                return
+            except queue.Full:
+                if not self.worker.is_alive():
+                    raise RuntimeError(f'The writer of {self.path} stopped')
+
+    def write(self, stars: np.ndarray) -> None:
+        """Queue a chunk, blocking while max_pending chunks are waiting. The chunk must not be modified afterwards."""
+        self._put(stars)
+        self.written += len(stars)
+
+    def close(self) -> None:
+        """Wait for every queued chunk to be written."""
+        if self.worker.is_alive():
+            self._put(None)
+        self.worker.join()
+        if self.errors:
+            raise self.errors[0]
+        if isinstance(self.worker, mp.Process) and self.worker.exitcode != 0:
+            raise RuntimeError(f'Writing {self.path} failed with exit code {self.worker.exitcode}')
+        if self.n_stars is not None and self.written != self.n_stars:
+            raise ValueError(f'{self.written} stars written to {self.path}, expected {self.n_stars}')
+
+    def abort(self) -> None:
+        """Stop the writer without waiting for a complete file, and remove the partial file."""
+        if isinstance(self.worker, mp.Process):
+            self.worker.terminate()
+        elif self.worker.is_alive():
+            try:
+                self._put(None)
+            except RuntimeError:
+                pass
+        self.worker.join()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __enter__(self) -> 'BackgroundWriter':
+        return self
+
+    def __exit__(self, *exc) -> None:
+        # An error in the with block propagates as it is, rather than as a count mismatch of close()
+        if exc[0] is not None:
+            self.abort()
+            return
+        self.close()
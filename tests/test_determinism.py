@@ -0,0 +1,34 @@
+import contextlib
+import io
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import COMPONENT_NAMES, component_parameters, scaled_config
+
+CONFIG = scaled_config(60_000)
+
+
+def generate(**options) -> SpiralGalaxy:
+    with contextlib.redirect_stdout(io.StringIO()):
+        galaxy = SpiralGalaxy(options.pop('config', CONFIG), **options)
+        galaxy.generate_galaxy()
+    return galaxy
+
+
+def test_tabulated_stars_do_not_depend_on_the_number_of_workers():
+    one = generate(seed=7, chunk_size=5_000, n_workers=1)
+    four = generate(seed=7, chunk_size=5_000, n_workers=4)
+    assert one.stars.tobytes() == four.stars.tobytes()
+    assert one.component_slices == four.component_slices
+
+def test_tabulated_stars_repeat_with_the_seed():
+    assert generate(seed=7, chunk_size=5_000).stars.tobytes() == generate(seed=7, chunk_size=5_000).stars.tobytes()
+    assert generate(seed=7).stars.tobytes() != generate(seed=8).stars.tobytes()
+
+def test_chunk_size_only_changes_components_it_splits():
+    small = generate(seed=7, chunk_size=5_000, n_workers=2)
+    large = generate(seed=7, chunk_size=100_000, n_workers=2)
+    for name in COMPONENT_NAMES:
+        if component_parameters(CONFIG, name).n_stars <= 5_000:
+            assert small.stars[small.component_slices[name]].tobytes() == large.stars[large.component_slices[name]].tobytes()
+
+def test_lean_runs_draw_the_same_stars():
+    assert generate(seed=7, chunk_size=5_000, lean=True).stars.tobytes() == generate(seed=7, chunk_size=5_000).stars.tobytes()
@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+import pytest
+
+resource = pytest.importorskip('resource')
+
+REPO_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+# Runs in a fresh process, so its peak RSS is the run's alone
+MEASURE_RUN = """
+import contextlib, io, json, resource, sys
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import scaled_config
+n_stars, lean, output_file = int(sys.argv[1]), sys.argv[2] == 'lean', sys.argv[3]
+galaxy = SpiralGalaxy(scaled_config(n_stars), seed=1, n_workers=1, lean=lean)
+plan = galaxy.plan_memory(output_file.rsplit('.', 1)[1])
+with contextlib.redirect_stdout(io.StringIO()):
+    galaxy.generate_galaxy()
+    galaxy.export(output_file)
+peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+print(json.dumps({'planned': plan.peak_bytes, 'measured': peak}))
+"""
+
+
+@pytest.mark.parametrize('lean', ['full', 'lean'])
+@pytest.mark.parametrize('suffix', ['csv', 'gqz'])
+def test_plan_covers_measured_peak_rss(tmp_path, lean, suffix):
+    output_file = str(tmp_path / f'stars.{suffix}')
+    result = subprocess.run([sys.executable, '-c', MEASURE_RUN, '1000000', lean, output_file],
+                            cwd=REPO_DIR, capture_output=True, text=True, check=True)
+    memory = json.loads(result.stdout.strip().splitlines()[-1])
+    assert memory['measured'] <= memory['planned']
+    # Not so cautious that budgets become useless
+    assert memory['planned'] <= 1.5 * memory['measured']
@@ -0,0 +1,46 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import scaled_config
+from spiral_galaxy_components.config import default_config, default_kinematics_parameters
+from dataclasses import replace
+
+CONFIG = scaled_config(30_000)
+
+
+def galaxy(config=CONFIG) -> SpiralGalaxy:
+    with contextlib.redirect_stdout(io.StringIO()):
+        return SpiralGalaxy(config, seed=11, chunk_size=4_000, n_workers=2)
+
+
+@pytest.mark.parametrize('use_process', [False, True])
+def test_csv_is_byte_identical_to_generate_then_export(tmp_path, use_process):
+    overlapped, sequential = galaxy(), galaxy()
+    with contextlib.redirect_stdout(io.StringIO()):
+        overlapped.generate_and_export(str(tmp_path / 'overlapped.csv'), use_process=use_process)
+        sequential.generate_galaxy()
+        sequential.export(str(tmp_path / 'sequential.csv'))
+    assert (tmp_path / 'overlapped.csv').read_bytes() == (tmp_path / 'sequential.csv').read_bytes()
+    assert overlapped.stars.tobytes() == sequential.stars.tobytes()
+
+def test_npy_holds_the_generated_stars_with_velocities(tmp_path):
+    config = replace(CONFIG, kinematics_parameters=default_kinematics_parameters)
+    overlapped, sequential = galaxy(config), galaxy(config)
+    with contextlib.redirect_stdout(io.StringIO()):
+        overlapped.generate_and_export(str(tmp_path / 'overlapped.npy'))
+        sequential.generate_galaxy()
+    assert np.load(tmp_path / 'overlapped.npy').tobytes() == sequential.stars.tobytes()
+
+def test_failed_run_leaves_no_partial_file(tmp_path, monkeypatch):
+    import spiral_galaxy
+
+    def failing_chunks(*args, **kwargs):
+        yield from []
+        raise RuntimeError('sampling failed')
+
+    monkeypatch.setattr(spiral_galaxy, 'iter_component_chunks', failing_chunks)
+    with pytest.raises(RuntimeError, match='sampling failed'), contextlib.redirect_stdout(io.StringIO()):
+        galaxy().generate_and_export(str(tmp_path / 'stars.csv'))
+    assert not (tmp_path / 'stars.csv').exists()
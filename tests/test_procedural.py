@@ -0,0 +1,48 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import config_star_count, scaled_config
+from spiral_galaxy_components.config import default_config
+from spiral_galaxy_components.procedural import ProceduralGalaxy
+
+SEED = 5
+N_STARS = 1_000_000
+
+
+@pytest.fixture(scope='module')
+def full_galaxy():
+    with contextlib.redirect_stdout(io.StringIO()):
+        galaxy = SpiralGalaxy(scaled_config(N_STARS), seed=SEED)
+        galaxy.generate_galaxy()
+    return galaxy
+
+def count_inside(stars: np.ndarray, lower: tuple, upper: tuple) -> int:
+    inside = np.ones(len(stars), dtype=bool)
+    for axis, column in enumerate(('XX', 'YY', 'ZZ')):
+        inside &= (stars[column] >= lower[axis]) & (stars[column] <= upper[axis])
+    return int(np.count_nonzero(inside))
+
+
+@pytest.mark.parametrize('lower, upper', [
+    ((7.5, -0.5, -0.5), (8.5, 0.5, 0.5)), # Solar neighbourhood
+    ((-1.0, -1.0, -0.3), (1.0, 1.0, 0.3)), # Bulge and bar
+    ((-12.0, 3.0, -0.2), (-9.0, 6.0, 0.2)), # Outer disk and arms
+])
+def test_region_counts_match_full_generation(full_galaxy, lower, upper):
+    multiplier = N_STARS / config_star_count(default_config)
+    region = ProceduralGalaxy(default_config, seed=SEED).generate_region(lower, upper, multiplier)
+    expected = count_inside(full_galaxy.stars, lower, upper)
+    # Both counts are Poisson around the same mean
+    assert abs(len(region) - expected) <= 5 * np.sqrt(len(region) + expected)
+    assert count_inside(region, lower, upper) == len(region)
+
+def test_regions_repeat_and_overlap_consistently():
+    galaxy = ProceduralGalaxy(default_config, seed=SEED)
+    region = galaxy.generate_region((7.5, -0.5, -0.5), (8.5, 0.5, 0.5), 10)
+    again = ProceduralGalaxy(default_config, seed=SEED).generate_region((7.5, -0.5, -0.5), (8.5, 0.5, 0.5), 10)
+    assert region.tobytes() == again.tobytes()
+    # A box inside the first holds exactly the first's stars that fall in it
+    inner = galaxy.generate_region((7.75, -0.25, -0.25), (8.25, 0.25, 0.25), 10)
+    assert len(inner) == count_inside(region, (7.75, -0.25, -0.25), (8.25, 0.25, 0.25))
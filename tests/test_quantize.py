@@ -0,0 +1,43 @@
+import contextlib
+import io
+import numpy as np
+import pytest
+from spiral_galaxy import SpiralGalaxy
+from spiral_galaxy_components.components import scaled_config
+from spiral_galaxy_components.quantize import LOG_COLUMNS, LOG_LEVELS, decode_stars, encode_stars, load_quantized, round_trip_report, save_quantized
+
+
+@pytest.fixture(scope='module')
+def stars():
+    with contextlib.redirect_stdout(io.StringIO()):
+        galaxy = SpiralGalaxy(scaled_config(100_000), seed=2)
+        galaxy.generate_galaxy()
+    return galaxy.stars
+
+
+@pytest.mark.parametrize('max_error', [0.05, 0.005, 1e-5])
+def test_position_error_stays_below_max_error(stars, max_error):
+    report = round_trip_report(stars, encode_stars(stars, max_error))
+    # Half a step along each axis at most
+    assert report['max_position_error_kpc'] <= max_error * np.sqrt(3) * (1 + 1e-9)
+
+def test_forced_bits_bound_the_error_by_the_chunk_box(stars):
+    quantized = encode_stars(stars, position_bits=16, chunk_size=1000)
+    decoded = decode_stars(quantized, dtype=np.float64)
+    chunk = np.arange(len(stars)) // 1000
+    for axis, column in enumerate(('XX', 'YY', 'ZZ')):
+        assert np.all(np.abs(decoded[column] - stars[column]) <= quantized.step[chunk, axis] / 2 * (1 + 1e-6))
+
+def test_log_columns_have_bounded_relative_error(stars):
+    quantized = encode_stars(stars)
+    report = round_trip_report(stars, quantized)
+    for name in LOG_COLUMNS:
+        low, high = quantized.log_ranges[name]
+        half_step = np.log(high / low) / LOG_LEVELS / 2
+        assert report[f'max_{name}_relative_error'] <= np.expm1(half_step) * (1 + 1e-6) + 1e-6
+
+def test_save_and_load_round_trip(stars, tmp_path):
+    quantized = encode_stars(stars)
+    loaded = load_quantized(save_quantized(str(tmp_path / 'stars'), quantized, compress=True))
+    assert decode_stars(loaded).tobytes() == decode_stars(quantized).tobytes()
+    assert quantized.nbytes < stars.nbytes
@@ -0,0 +1,79 @@
+import os
+import numpy as np
+import pytest
+from spiral_galaxy_components.shared_buffer import SharedStarBuffer
+from spiral_galaxy_components.star_buffer import make_star_buffer
+
+
+@pytest.fixture
+def name():
+    return f'galaxy_test_{os.getpid()}'
+
+def random_stars(n: int) -> np.ndarray:
+    stars = make_star_buffer(n)
+    for column in stars.dtype.names:
+        stars[column] = np.random.default_rng(n).random(n)
+    return stars
+
+
+def test_publish_and_attach(name):
+    publisher = SharedStarBuffer.create(name, random_stars(100).nbytes)
+    reader = SharedStarBuffer.attach(name)
+    try:
+        assert reader.stars() is None
+        stars = random_stars(100)
+        version = publisher.publish(stars, {'bulge': slice(0, 40), 'disk': slice(40, 100)})
+        assert version == 2 and reader.version() == version
+        shared, slices, shared_version = reader.stars()
+        assert shared_version == version
+        assert shared.tobytes() == stars.tobytes()
+        assert slices == {'bulge': slice(0, 40), 'disk': slice(40, 100)}
+
+        assert publisher.publish(stars[:10]) == 4
+        assert len(reader.stars()[0]) == 10
+    finally:
+        reader.close()
+        publisher.close()
+
+def test_publish_beyond_capacity_raises(name):
+    publisher = SharedStarBuffer.create(name, random_stars(10).nbytes)
+    try:
+        with pytest.raises(ValueError):
+            publisher.publish(random_stars(11))
+        assert publisher.version() == 0
+    finally:
+        publisher.close()
+
+def test_attach_before_the_header_is_written_raises_value_error(name):
+    publisher = SharedStarBuffer.create(name, 1024)
+    try:
+        # As between the creation of the segment and the writing of its header
+        publisher.header[0]['magic'] = b''
+        with pytest.raises(ValueError):
+            SharedStarBuffer.attach(name)
+    finally:
+        publisher.close()
+
+def test_attach_to_a_missing_segment_raises_file_not_found(name):
+    with pytest.raises(FileNotFoundError):
+        SharedStarBuffer.attach(name)
+
+def test_replacing_a_segment_retires_it(name):
+    publisher = SharedStarBuffer.create(name, random_stars(10).nbytes)
+    publisher.publish(random_stars(10))
+    reader = SharedStarBuffer.attach(name)
+    generation = publisher.generation() + 1
+    publisher.close()
+    assert reader.retired()
+
+    larger = SharedStarBuffer.create(name, random_stars(1000).nbytes, generation)
+    try:
+        larger.publish(random_stars(1000))
+        reader.close()
+        reader = SharedStarBuffer.attach(name)
+        assert not reader.retired()
+        assert reader.generation() == generation
+        assert len(reader.stars()[0]) == 1000
+    finally:
+        reader.close()
+        larger.close()
@@ -0,0 +1,329 @@
+import json
+import os
+import sys
+import time
+import numpy as np
+from dataclasses import asdict, dataclass, replace
+from sharded_galaxy import MANIFEST_FORMAT, LocalProcessBackend, TCPQueueBackend
+from spiral_galaxy_components.components import CHUNK_SIZE, COMPONENT_NAMES, COMPONENTS, component_parameters, config_star_count, sample_component, scaled_config
+from spiral_galaxy_components.config import SpiralGalaxyConfig
+from spiral_galaxy_components.helper import derive_seed
+from spiral_galaxy_components.sampling import sample_isotropic_directions, sample_plummer_radius, sample_temperature
+from spiral_galaxy_components.star_buffer import fill_star_buffer, make_star_buffer, star_dtype
+from spiral_galaxy_components.writer import ChunkFile
+
+MORPHOLOGIES = ('spiral', 'elliptical', 'irregular')
+# Seed keys of the catalogue stream and of the per-galaxy streams, after those of SpiralGalaxy
+CATALOGUE_KEY = 9
+GALAXY_KEY = 10
+
+# One row per galaxy of a field. Positions and distances in kpc, orientation as a unit quaternion
+CATALOGUE_DTYPE = np.dtype([
+    ('morphology', np.uint8), # Index into MORPHOLOGIES
+    ('n_stars', np.int64),
+    ('start', np.int64), # First star of the galaxy in the dataset
+    ('x', np.float64), ('y', np.float64), ('z', np.float64),
+    ('distance', np.float64), # From the observer at the origin
+    ('size', np.float64), # Scale factor applied to the galaxy's unit-size model
+    ('qw', np.float64), ('qx', np.float64), ('qy', np.float64), ('qz', np.float64),
+])
+
+
+@dataclass(frozen=True)
+class EllipticalGalaxyParameters:
+    radius: float # kpc
+    axis_ratios: tuple[float, float, float]
+    temp_mean: float
+    temp_sd: float
+    brightness: float
+    size: float
+
+default_elliptical_parameters: EllipticalGalaxyParameters = EllipticalGalaxyParameters(
+    radius=30.0,
+    axis_ratios=(1.0, 0.8, 0.6),
+    temp_mean=3000.0,
+    temp_sd=500.0,
+    brightness=2.0,
+    size=2.0
+)
+
+
+@dataclass(frozen=True)
+class IrregularGalaxyParameters:
+    radius: float # kpc, of the sphere the star-forming regions are scattered in
+    n_regions: int
+    region_radius: float # kpc, Plummer scale of one region
+    temp_mean: float
+    temp_sd: float
+    brightness: float
+    size: float
+
+default_irregular_parameters: IrregularGalaxyParameters = IrregularGalaxyParameters(
+    radius=8.0,
+    n_regions=50,
+    region_radius=0.5,
+    temp_mean=10000.0,
+    temp_sd=1500.0,
+    brightness=2.0,
+    size=2.0
+)
+
+
+@dataclass(frozen=True)
+class FieldParameters:
+    n_galaxies: int
+    field_size: float # kpc, edge of the cube centred on the observer the galaxies are scattered in
+    morphology_fractions: tuple[float, float, float] # Of spiral, elliptical and irregular galaxies
+    morphology_stars: tuple[float, float, float] # Stars of a galaxy of size 1 relative to mean_stars, per morphology
+    mean_stars: int
+    size_sigma: float # Standard deviation of the log of the size factors
+    min_stars: int
+    elliptical_parameters: EllipticalGalaxyParameters = default_elliptical_parameters
+    irregular_parameters: IrregularGalaxyParameters = default_irregular_parameters
+
+default_field_parameters: FieldParameters = FieldParameters(
+    n_galaxies=1000,
+    field_size=20000.0,
+    morphology_fractions=(0.6, 0.3, 0.1),
+    morphology_stars=(1.0, 1.5, 0.2),
+    mean_stars=20000,
+    size_sigma=0.4,
+    min_stars=100
+)
+
+
+@dataclass(frozen=True)
+class FieldPartition:
+
+    """A run of consecutive galaxies of the catalogue, written to one partition file."""
+
+    index: int
+    first_galaxy: int
+    last_galaxy: int
+    start: int # First star of the partition in the dataset
+    stop: int
+
+    @property
+    def file_name(self) -> str:
+        return f'part-{self.index:05d}-field.npy'
+
+
+# ---------- Catalogue ----------
+
+def sample_catalogue(parameters: FieldParameters, seed: int | np.random.SeedSequence | None) -> np.ndarray:
+    """Draw the morphology, position, orientation, size and star count of every galaxy of a field."""
+    rng = np.random.default_rng(derive_seed(seed, CATALOGUE_KEY))
+    n = parameters.n_galaxies
+    catalogue = np.zeros(n, dtype=CATALOGUE_DTYPE)
+
+    catalogue['morphology'] = rng.choice(len(MORPHOLOGIES), n, p=np.asarray(parameters.morphology_fractions) / sum(parameters.morphology_fractions))
+    position = rng.uniform(-parameters.field_size / 2, parameters.field_size / 2, (n, 3))
+    catalogue['x'], catalogue['y'], catalogue['z'] = position.T
+    catalogue['distance'] = np.linalg.norm(position, axis=1)
+    catalogue['size'] = rng.lognormal(0.0, parameters.size_sigma, n)
+    # Normalised Gaussian quaternions are uniformly distributed rotations
+    quaternion = rng.normal(size=(n, 4))
+    quaternion /= np.linalg.norm(quaternion, axis=1, keepdims=True)
+    catalogue['qw'], catalogue['qx'], catalogue['qy'], catalogue['qz'] = quaternion.T
+
+    # Stars grow with the area of the galaxy
+    n_stars = np.asarray(parameters.morphology_stars)[catalogue['morphology']] * parameters.mean_stars * catalogue['size']**2
+    catalogue['n_stars'] = np.maximum(np.round(n_stars), parameters.min_stars)
+    catalogue['start'] = np.cumsum(catalogue['n_stars']) - catalogue['n_stars']
+    return catalogue
+
+def rotation_matrices(catalogue: np.ndarray) -> np.ndarray:
+    """Rotation matrix of every galaxy's quaternion, scaled by its size, shape (n, 3, 3)."""
+    w, x, y, z = (catalogue[q] for q in ('qw', 'qx', 'qy', 'qz'))
+    matrices = np.stack([
+        1 - 2*(y*y + z*z), 2*(x*y - w*z), 2*(x*z + w*y),
+        2*(x*y + w*z), 1 - 2*(x*x + z*z), 2*(y*z - w*x),
+        2*(x*z - w*y), 2*(y*z + w*x), 1 - 2*(x*x + y*y),
+    ], axis=1).reshape(-1, 3, 3)
+    return matrices * catalogue['size'][:, None, None]
+
+def plan_field_partitions(catalogue: np.ndarray, stars_per_partition: int = 8 * CHUNK_SIZE) -> list[FieldPartition]:
+    """Group consecutive galaxies into partitions of about stars_per_partition stars, never splitting a galaxy."""
+    partitions = []
+    first = 0
+    total = 0
+    for index, n_stars in enumerate(catalogue['n_stars']):
+        total += int(n_stars)
+        if total >= stars_per_partition or index == len(catalogue) - 1:
+            start = int(catalogue['start'][first])
+            partitions.append(FieldPartition(len(partitions), first, index + 1, start, start + total))
+            first, total = index + 1, 0
+    return partitions
+
+
+# ---------- Galaxies ----------
+
+def spiral_field_config(n_stars: int) -> SpiralGalaxyConfig:
+    """The default config scaled to exactly n_stars stars, the rounding left over going to the largest component."""
+    config = scaled_config(n_stars)
+    largest = max(COMPONENTS, key=lambda name: component_parameters(config, name).n_stars)
+    field_name = COMPONENTS[largest][1]
+    parameters = getattr(config, field_name)
+    return replace(config, **{field_name: replace(parameters, n_stars=parameters.n_stars + n_stars - config_star_count(config))})
+
+def sample_elliptical_stars(parameters: EllipticalGalaxyParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    """Vectorized elliptical_galaxy_rendering.py, in kpc."""
+    r = sample_plummer_radius(n_stars, parameters.radius, parameters.radius, rng)
+    ux, uy, uz = sample_isotropic_directions(n_stars, rng)
+    jitter = parameters.radius / 20
+    ratios = np.asarray(parameters.axis_ratios) / max(parameters.axis_ratios)
+    x = (r * ux + rng.normal(0, jitter, n_stars)) * ratios[0]
+    y = (r * uy + rng.normal(0, jitter, n_stars)) * ratios[1]
+    z = (r * uz + rng.normal(0, jitter, n_stars)) * ratios[2]
+    T = sample_temperature(n_stars, parameters.temp_mean, parameters.temp_sd, rng)
+    return x, y, z, T, np.full(n_stars, parameters.brightness), np.full(n_stars, parameters.size)
+
+def sample_irregular_stars(parameters: IrregularGalaxyParameters, n_stars: int, rng: np.random.Generator) -> tuple[np.ndarray, ...]:
+    """Plummer clumps around star-forming regions scattered in a sphere, as in star_formation_regions_rendering.py."""
+    centres = np.stack(sample_isotropic_directions(parameters.n_regions, rng), axis=1) * parameters.radius * rng.uniform(0, 1, (parameters.n_regions, 1))**(1/3)
+    region = np.repeat(np.arange(parameters.n_regions), rng.multinomial(n_stars, np.full(parameters.n_regions, 1 / parameters.n_regions)))
+    r = sample_plummer_radius(n_stars, parameters.region_radius, parameters.radius, rng)
+    ux, uy, uz = sample_isotropic_directions(n_stars, rng)
+    jitter = parameters.region_radius / 20
+    x = r * ux + rng.normal(0, jitter, n_stars) + centres[region, 0]
+    y = r * uy + rng.normal(0, jitter, n_stars) + centres[region, 1]
+    z = r * uz + rng.normal(0, jitter, n_stars) + centres[region, 2]
+    T = sample_temperature(n_stars, parameters.temp_mean, parameters.temp_sd, rng)
+    return x, y, z, T, np.full(n_stars, parameters.brightness), np.full(n_stars, parameters.size)
+
+def generate_field_galaxy(row: np.void, index: int, parameters: FieldParameters, seed, out: np.ndarray) -> None:
+    """
+    Draw galaxy number index of the catalogue, centred and unrotated at size 1, into out. A spiral
+    holds the stars of SpiralGalaxy(spiral_field_config(n_stars), seed=derive_seed(seed, GALAXY_KEY, index)).
+    """
+    galaxy_seed = derive_seed(seed, GALAXY_KEY, index)
+    morphology = MORPHOLOGIES[row['morphology']]
+    n_stars = int(row['n_stars'])
+
+    if morphology == 'spiral':
+        config = spiral_field_config(n_stars)
+        start = 0
+        for component_index, name in enumerate(COMPONENT_NAMES):
+            parameters = component_parameters(config, name)
+            sample_component(name, parameters, derive_seed(galaxy_seed, component_index), out[start:start + parameters.n_stars])
+            start += parameters.n_stars
+    elif morphology == 'elliptical':
+        fill_star_buffer(out, sample_elliptical_stars(parameters.elliptical_parameters, n_stars, np.random.default_rng(galaxy_seed)))
+    else:
+        fill_star_buffer(out, sample_irregular_stars(parameters.irregular_parameters, n_stars, np.random.default_rng(galaxy_seed)))
+
+def transform_galaxies(stars: np.ndarray, catalogue: np.ndarray) -> None:
+    """
+    Rotate, scale and move, in place, a block of stars holding the galaxies of catalogue back to
+    back. The positions are converted to one float64 (n, 3) array for the whole block.
+    """
+    positions = np.stack([stars['XX'], stars['YY'], stars['ZZ']], axis=1).astype(np.float64)
+    matrices = rotation_matrices(catalogue)
+    translations = np.stack([catalogue['x'], catalogue['y'], catalogue['z']], axis=1)
+    start = 0
+    for matrix, translation, n_stars in zip(matrices, translations, catalogue['n_stars']):
+        stop = start + int(n_stars)
+        block = positions[start:stop]
+        np.matmul(block, matrix.T, out=block)
+        block += translation
+        start = stop
+    stars['XX'], stars['YY'], stars['ZZ'] = positions.T
+
+
+def iter_galaxy_blocks(catalogue: np.ndarray, block_size: int) -> list[tuple[int, int]]:
+    """Runs [first, last) of consecutive galaxies holding about block_size stars, or one larger galaxy."""
+    blocks = []
+    first = 0
+    total = 0
+    for index, n_stars in enumerate(catalogue['n_stars']):
+        if total and total + n_stars > block_size:
+            blocks.append((first, index))
+            first, total = index, 0
+        total += int(n_stars)
+    if total:
+        blocks.append((first, len(catalogue)))
+    return blocks
+
+def run_field_partition(task: tuple[FieldPartition, np.ndarray, FieldParameters, int, int, str]) -> dict:
+    """
+    Generate the galaxies of one partition a block at a time, transform them into the field and
+    stream them to the partition file, returning its manifest entry. Only one block of stars is in
+    memory at once, or one galaxy when it is larger than a block. rows are the partition's own
+    catalogue rows, so a task never carries the whole catalogue.
+    """
+    partition, rows, parameters, seed, block_size, output_dir = task
+    path = os.path.join(output_dir, partition.file_name)
+    file = ChunkFile(path + '.tmp.npy', 'npy', partition.stop - partition.start, star_dtype())
+    try:
+        for first, last in iter_galaxy_blocks(rows, block_size):
+            stars = make_star_buffer(int(rows['n_stars'][first:last].sum()))
+            start = 0
+            for offset in range(first, last):
+                n_stars = int(rows['n_stars'][offset])
+                generate_field_galaxy(rows[offset], partition.first_galaxy + offset, parameters, seed, stars[start:start + n_stars])
+                start += n_stars
+            transform_galaxies(stars, rows[first:last])
+            file.write(stars)
+    finally:
+        file.close()
+    os.replace(path + '.tmp.npy', path)
+    return {'file': partition.file_name, 'galaxies': [partition.first_galaxy, partition.last_galaxy], 'start': partition.start, 'stop': partition.stop, 'n_stars': partition.stop - partition.start}
+
+
+def generate_field(parameters: FieldParameters, output_dir: str, seed: int | None = None, backend=None,
+                   stars_per_partition: int = 8 * CHUNK_SIZE, block_size: int = CHUNK_SIZE) -> str:
+    """
+    Sample a catalogue of galaxies, generate them on a backend of sharded_galaxy.py and write them as
+    one partitioned dataset with a manifest readable by sharded_galaxy.iter_partitions(). The catalogue
+    is saved next to it as catalogue.npy; its start and n_stars columns locate every galaxy's stars.
+    Returns the manifest path.
+    """
+    if seed is None:
+        seed = np.random.SeedSequence().entropy
+    backend = backend or LocalProcessBackend()
+    os.makedirs(output_dir, exist_ok=True)
+
+    catalogue = sample_catalogue(parameters, seed)
+    np.save(os.path.join(output_dir, 'catalogue.npy'), catalogue)
+    partitions = plan_field_partitions(catalogue, stars_per_partition)
+    n_stars = int(catalogue['n_stars'].sum())
+    print(f"\n---------- Universe field: {len(catalogue)} galaxies, {n_stars} stars, {len(partitions)} partitions ----------")
+    for index, morphology in enumerate(MORPHOLOGIES):
+        print(f"{morphology}: {np.count_nonzero(catalogue['morphology'] == index)} galaxies")
+
+    start_time = time.perf_counter()
+    entries = list(backend.map(run_field_partition, [(partition, catalogue[partition.first_galaxy:partition.last_galaxy], parameters, seed, block_size, output_dir) for partition in partitions]))
+
+    manifest = {
+        'format': MANIFEST_FORMAT,
+        'seed': seed,
+        'chunk_size': CHUNK_SIZE,
+        'n_stars': n_stars,
+        'dtype': np.lib.format.dtype_to_descr(star_dtype()),
+        'components': {}, # A field has no components, catalogue.npy locates its galaxies
+        'partitions': entries,
+        'catalogue': 'catalogue.npy',
+        'field': asdict(parameters),
+    }
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    with open(manifest_path, 'w') as f:
+        json.dump(manifest, f, indent=1)
+
+    print(f"{n_stars} stars written to {output_dir} in {time.perf_counter() - start_time:.1f} s")
+    return manifest_path
+
+def load_catalogue(manifest_path: str) -> np.ndarray:
+    return np.load(os.path.join(os.path.dirname(os.path.abspath(manifest_path)), 'catalogue.npy'))
+
+
+def main():
+    # python universe_field.py <output_dir> [n_galaxies] [n_local_tcp_workers]
+    output_dir = sys.argv[1] if len(sys.argv) > 1 else 'universe_field'
+    parameters = replace(default_field_parameters, n_galaxies=int(sys.argv[2])) if len(sys.argv) > 2 else default_field_parameters
+    backend = TCPQueueBackend(spawn_local_workers=int(sys.argv[3])) if len(sys.argv) > 3 else LocalProcessBackend()
+    generate_field(parameters, output_dir, backend=backend)
+
+if __name__ == "__main__":
+    # Run from the module, so TCP workers can unpickle its tasks, which they cannot from __main__
+    import universe_field
+    universe_field.main()